@@ -4,6 +4,7 @@ the Politeness Analyzer, and various other ways of getting metadata.
 """
 import _pickle
 import atexit
+import hashlib
 from external.polite.features.vectorizer import PolitenessFeatureVectorizer
 from external.polite.request_utils import check_is_request
 from external.polite.scripts.format_input import format_doc
@@ -15,6 +16,7 @@ import pandas
 from pycorenlp import StanfordCoreNLP
 import scipy
 from scipy.sparse import csr_matrix
+import sentencecache
 import shutil
 import sklearn
 import subprocess
@@ -27,9 +29,26 @@ import time
 ## Kill it when we exit
 #atexit.register(corenlp.kill)
 
+# The most recently used sentences' results (see sentencecache.py)
+SENTENCE_CACHE = sentencecache.SentenceCache(sentencecache.DEFAULT_MAXSIZE)
+
 # Load up the politeness model
 POLITE_FILEPATH = os.path.join(os.path.split(__file__)[0], "politeness-svm.p")
-politeness_model = _pickle.load(open(POLITE_FILEPATH, 'rb'), encoding='latin1', fix_imports=True)
+politeness_model = None
+
+def load_politeness_model(path=POLITE_FILEPATH):
+    """
+    Loads the politeness model at the given path for get_politeness() to use, and returns it.
+    Cached politeness results are thrown away if the model isn't the same (by SHA-1) as the last one.
+    """
+    global politeness_model
+    with open(path, 'rb') as f:
+        raw = f.read()
+    politeness_model = _pickle.loads(raw, encoding='latin1', fix_imports=True)
+    SENTENCE_CACHE.set_model_hash(hashlib.sha1(raw).hexdigest())
+    return politeness_model
+
+load_politeness_model()
 
 # Sleep a few seconds to let the server start
 #time.sleep(4)
@@ -108,6 +127,9 @@ def get_politeness(raw_text):
     Works best if the given text contains requests, rather than statements,
     but will try regardless.
     """
+    return list(SENTENCE_CACHE.get("politeness", raw_text, _get_politeness))
+
+def _get_politeness(raw_text):
     vectorizer = PolitenessFeatureVectorizer()
     formatted = format_doc(raw_text)
     accumulated_probs = []
@@ -126,16 +148,21 @@ def get_requests(raw_text):
     """
     accumulated = []
     for s in get_sentences(raw_text):
-        for f in format_doc(s):
-            if check_is_request(f):
-                accumulated.append(s)
+        if SENTENCE_CACHE.get("request", s, _is_request):
+            accumulated.append(s)
     accumulated = list(set(accumulated))
     return accumulated
 
+def _is_request(sentence):
+    return any(check_is_request(f) for f in format_doc(sentence))
+
 def get_sentences(raw_text):
     """
     Returns raw_text as a list of sentences.
     """
+    return list(SENTENCE_CACHE.get("sentences", raw_text, _get_sentences))
+
+def _get_sentences(raw_text):
     return ["".join(s['sentences']) for s in format_doc(raw_text)]
 
 def get_sentiment(raw_text):
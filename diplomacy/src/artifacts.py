@@ -0,0 +1,436 @@
+"""
+This module converts the trained betrayal models into plain NumPy arrays and provides
+pure NumPy predictors for them, so that inference needs neither scikit-learn's pickles
+nor Keras (and therefore not TensorFlow).
+
+A bundle is a directory with one compressed .npz file per model and a manifest.json
+that records the bundle's format version and where each model came from (its source file
+and that file's SHA-1). A model in a bundle is out of date once its source file has changed,
+e.g., after the model is retrained, and is then loaded from the source file instead. Export a
+bundle (which also checks that every predictor matches its original on the validation set) with:
+
+python3 artifacts.py --models-dir models
+
+and load it with load_bundle("models/numpy").
+"""
+import argparse
+import hashlib
+import json
+import numpy as np
+import os
+
+FORMAT_VERSION = 1
+BUNDLE_DIRNAME = "numpy"
+MANIFEST_FILENAME = "manifest.json"
+# Where the models trained on the default window of three seasons live.
+# Models trained on other window lengths live in models/window<N>/
+MODEL_DIR = "models"
+DEFAULT_WINDOW = 3
+
+# The models that get exported, in the order inference.load_models returns them: name -> (type, source file)
+MODEL_SOURCES = [
+                    ("KNN",     "knn",      "knn.model"),
+                    ("Tree",    "tree",     "tree.model"),
+                    ("Forest",  "forest",   "forest.model"),
+                    ("SVM",     "svm",      "svm.model"),
+                    ("MLP",     "mlp",      "mlp.hdf5"),
+                ]
+
+#### PREDICTORS ################################################################
+
+class NumpyKNN:
+    """
+    K nearest neighbors with Minkowski distance and uniform or inverse distance weights.
+    """
+    def __init__(self, arrays):
+        self.fit_X = arrays["fit_X"]
+        self.y = arrays["y"]
+        self.classes = arrays["classes"]
+        self.n_neighbors = int(arrays["n_neighbors"])
+        self.p = float(arrays["p"])
+        self.distance_weights = bool(arrays["distance_weights"])
+
+    def _distances(self, X, chunk=256):
+        """
+        Returns the distance from every row of X to every training sample, computed a chunk of rows at a time.
+        """
+        dists = []
+        for start in range(0, len(X), chunk):
+            diff = np.abs(X[start:start + chunk, np.newaxis, :] - self.fit_X[np.newaxis, :, :])
+            if self.p == 2:
+                dists.append(np.sqrt(np.sum(diff * diff, axis=2)))
+            else:
+                dists.append(np.sum(diff ** self.p, axis=2) ** (1.0 / self.p))
+        return np.concatenate(dists) if dists else np.zeros((0, len(self.fit_X)))
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        dist = self._distances(X)
+        k = min(self.n_neighbors, dist.shape[1])
+        ind = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        neigh_dist = dist[np.arange(len(X))[:, np.newaxis], ind]
+        if self.distance_weights:
+            with np.errstate(divide='ignore'):
+                weights = 1.0 / neigh_dist
+            # Exact matches get all of the weight, like scikit-learn does it
+            inf_mask = np.isinf(weights)
+            inf_row = np.any(inf_mask, axis=1)
+            weights[inf_row] = inf_mask[inf_row]
+        else:
+            weights = np.ones_like(neigh_dist)
+        votes = np.zeros((len(X), len(self.classes)))
+        np.add.at(votes, (np.arange(len(X))[:, np.newaxis], self.y[ind]), weights)
+        return self.classes[np.argmax(votes, axis=1)]
+
+class NumpyForest:
+    """
+    One or more decision trees, stored as flat node arrays. A single tree predicts the class with the largest
+    value in its leaf; a forest predicts the class with the largest mean (normalized) leaf value over its trees.
+    """
+    def __init__(self, arrays):
+        self.children_left = arrays["children_left"]
+        self.children_right = arrays["children_right"]
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.classes = arrays["classes"]
+
+    def _leaves(self, X):
+        # Trees compare float32 features against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        node = np.tile(self.roots, (len(X), 1))
+        rows = np.repeat(np.arange(len(X))[:, np.newaxis], len(self.roots), axis=1)
+        active = self.children_left[node] != -1
+        while np.any(active):
+            n = node[active]
+            go_left = X[rows[active], self.feature[n]] <= self.threshold[n]
+            node[active] = np.where(go_left, self.children_left[n], self.children_right[n])
+            active = self.children_left[node] != -1
+        return node
+
+    def predict_proba(self, X):
+        values = self.value[self._leaves(X)]
+        values = values / np.sum(values, axis=2, keepdims=True)
+        return np.mean(values, axis=1)
+
+    def predict(self, X):
+        if len(self.roots) == 1:
+            return self.classes[np.argmax(self.value[self._leaves(X)[:, 0]], axis=1)]
+        return self.classes[np.argmax(self.predict_proba(X), axis=1)]
+
+class NumpySVM:
+    """
+    A binary support vector classifier with an RBF kernel.
+    """
+    def __init__(self, arrays):
+        self.support_vectors = arrays["support_vectors"]
+        self.dual_coef = arrays["dual_coef"]
+        self.intercept = float(arrays["intercept"])
+        self.gamma = float(arrays["gamma"])
+        self.classes = arrays["classes"]
+
+    def decision_function(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        sq_dists = (np.sum(X * X, axis=1)[:, np.newaxis] + np.sum(self.support_vectors ** 2, axis=1)[np.newaxis, :]
+                    - 2 * np.dot(X, self.support_vectors.T))
+        return np.dot(np.exp(-self.gamma * np.maximum(sq_dists, 0)), self.dual_coef) + self.intercept
+
+    def predict(self, X):
+        return self.classes[(self.decision_function(X) > 0).astype(int)]
+
+class NumpyMLP:
+    """
+    A stack of dense layers. Like the Keras model it comes from, predict returns probabilities of shape (n, 1).
+    """
+    ACTIVATIONS = {
+                    "relu":     lambda z: np.maximum(z, 0),
+                    "sigmoid":  lambda z: 1 / (1 + np.exp(-z)),
+                    "tanh":     np.tanh,
+                    "linear":   lambda z: z,
+                  }
+
+    def __init__(self, arrays):
+        nlayers = int(arrays["nlayers"])
+        self.layers = [(arrays["W" + str(i)], arrays["b" + str(i)], str(arrays["activation" + str(i)])) for i in range(nlayers)]
+
+    def predict(self, X):
+        a = np.asarray(X, dtype=np.float32)
+        for W, b, activation in self.layers:
+            a = self.ACTIVATIONS[activation](np.dot(a, W) + b).astype(np.float32)
+        return a
+
+PREDICTORS = {
+                "knn":      NumpyKNN,
+                "tree":     NumpyForest,
+                "forest":   NumpyForest,
+                "svm":      NumpySVM,
+                "mlp":      NumpyMLP,
+             }
+
+#### CONVERTERS ################################################################
+
+def _tree_arrays(estimators, classes):
+    """
+    Flattens the given scikit-learn decision trees into one set of node arrays, with node indices offset per tree.
+    """
+    arrays = {"children_left": [], "children_right": [], "feature": [], "threshold": [], "value": [], "roots": []}
+    offset = 0
+    for est in estimators:
+        t = est.tree_
+        left, right = t.children_left.copy(), t.children_right.copy()
+        left[left != -1] += offset
+        right[right != -1] += offset
+        arrays["children_left"].append(left)
+        arrays["children_right"].append(right)
+        arrays["feature"].append(np.maximum(t.feature, 0))
+        arrays["threshold"].append(t.threshold)
+        arrays["value"].append(t.value[:, 0, :])
+        arrays["roots"].append(np.array([offset]))
+        offset += t.node_count
+    arrays = {k: np.concatenate(v) for k, v in arrays.items()}
+    arrays["classes"] = np.asarray(classes)
+    return arrays
+
+def convert_knn(clf):
+    """
+    Returns the arrays for a NumpyKNN from a scikit-learn KNeighborsClassifier.
+    """
+    if clf.effective_metric_ not in ("euclidean", "minkowski", "manhattan"):
+        raise ValueError("Unsupported KNN metric: " + str(clf.effective_metric_))
+    p = {"euclidean": 2, "manhattan": 1}.get(clf.effective_metric_, clf.effective_metric_params_.get("p", clf.p))
+    if clf.weights not in ("uniform", "distance"):
+        raise ValueError("Unsupported KNN weights: " + str(clf.weights))
+    return {"fit_X": np.asarray(clf._fit_X, dtype=np.float64), "y": np.asarray(clf._y), "classes": np.asarray(clf.classes_),
+            "n_neighbors": np.array(clf.n_neighbors), "p": np.array(p), "distance_weights": np.array(clf.weights == "distance")}
+
+def convert_tree(clf):
+    """
+    Returns the arrays for a NumpyForest from a scikit-learn DecisionTreeClassifier.
+    """
+    return _tree_arrays([clf], clf.classes_)
+
+def convert_forest(clf):
+    """
+    Returns the arrays for a NumpyForest from a scikit-learn RandomForestClassifier.
+    """
+    return _tree_arrays(clf.estimators_, clf.classes_)
+
+def convert_svm(clf):
+    """
+    Returns the arrays for a NumpySVM from a scikit-learn SVC. The public dual_coef_ and intercept_ already have
+    the sign that makes a positive decision value mean classes_[1].
+    """
+    if clf.kernel != "rbf" or len(clf.classes_) != 2:
+        raise ValueError("Only binary SVMs with an RBF kernel are supported.")
+    return {"support_vectors": np.asarray(clf.support_vectors_, dtype=np.float64), "dual_coef": np.asarray(clf.dual_coef_[0], dtype=np.float64),
+            "intercept": np.array(clf.intercept_[0]), "gamma": np.array(clf._gamma), "classes": np.asarray(clf.classes_)}
+
+def convert_mlp(model):
+    """
+    Returns the arrays for a NumpyMLP from a Keras Sequential model of Dense and Dropout layers.
+    """
+    arrays = {}
+    i = 0
+    for layer in model.layers:
+        kind = type(layer).__name__
+        if kind == "Dense":
+            W, b = layer.get_weights()
+            activation = layer.get_config()["activation"]
+            if activation not in NumpyMLP.ACTIVATIONS:
+                raise ValueError("Unsupported activation in the MLP: " + str(activation) + ". Expected one of " + str(sorted(NumpyMLP.ACTIVATIONS)))
+            arrays["W" + str(i)], arrays["b" + str(i)] = W.astype(np.float32), b.astype(np.float32)
+            arrays["activation" + str(i)] = np.array(activation)
+            i += 1
+        elif kind != "Dropout":
+            raise ValueError("Unsupported layer in the MLP: " + kind)
+    arrays["nlayers"] = np.array(i)
+    return arrays
+
+CONVERTERS = {
+                "knn":      convert_knn,
+                "tree":     convert_tree,
+                "forest":   convert_forest,
+                "svm":      convert_svm,
+                "mlp":      convert_mlp,
+             }
+
+#### MODEL DIRECTORIES #########################################################
+
+def get_model_dir(window=DEFAULT_WINDOW):
+    """
+    Returns the directory that holds the models trained on the given window length.
+    """
+    if window == DEFAULT_WINDOW:
+        return MODEL_DIR
+    else:
+        return os.path.join(MODEL_DIR, "window" + str(window))
+
+def check_model_dir(model_dir, window):
+    """
+    Raises a ValueError if model_dir is where inference looks for the models of a window length other than the
+    given one (see get_model_dir), since saving models there would break inference for that window.
+    Directories that inference doesn't look in are fine.
+    """
+    path = os.path.abspath(model_dir)
+    if os.path.dirname(path) == os.path.abspath(MODEL_DIR) and os.path.basename(path).startswith("window"):
+        served = os.path.basename(path)[len("window"):]
+    elif path == os.path.abspath(MODEL_DIR):
+        served = str(DEFAULT_WINDOW)
+    else:
+        return
+    if served != str(window):
+        raise ValueError("Inference uses the models in " + model_dir + " for a window of " + served + " seasons, not " + str(window) +
+                         ". Save them to " + get_model_dir(window) + " instead.")
+
+#### BUNDLES ###################################################################
+
+def file_sha1(path):
+    """
+    Returns the SHA-1 hex digest of the file at the given path.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+# path -> ((size, modification time), SHA-1) of the files that source_sha1() has hashed
+_source_sha1s = {}
+
+def source_sha1(path):
+    """
+    Returns the SHA-1 hex digest of the file at the given path, only hashing it again if its size or modification time changed.
+    """
+    st = os.stat(path)
+    stamp = (st.st_size, st.st_mtime_ns)
+    cached = _source_sha1s.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, file_sha1(path))
+        _source_sha1s[path] = cached
+    return cached[1]
+
+def load_original_model(path, kind):
+    """
+    Returns the model of the given type (see MODEL_SOURCES) saved at path, loaded with scikit-learn or Keras.
+    """
+    if kind == "mlp":
+        if not "SSH_CONNECTION" in os.environ:
+            # Disable annoying TF warnings when importing keras (which imports TF)
+            os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
+        import keras
+        model = keras.models.load_model(path)
+        # Builds the predict function now, so that the model can be used from threads other than this one
+        # (a private method, which not every version of Keras has)
+        if hasattr(model, "_make_predict_function"):
+            model._make_predict_function()
+        return model
+    else:
+        from sklearn.externals import joblib
+        return joblib.load(path)
+
+def load_original_models(models_dir):
+    """
+    Returns a list of (name, model) loaded with scikit-learn and Keras from the given directory.
+    """
+    return [(name, load_original_model(os.path.join(models_dir, filename), kind)) for name, kind, filename in MODEL_SOURCES]
+
+def export_bundle(models_dir="models", bundle_dir=None):
+    """
+    Converts the models in models_dir into a bundle in bundle_dir (models_dir/numpy by default).
+    Returns the path to the bundle.
+    """
+    bundle_dir = bundle_dir if bundle_dir else os.path.join(models_dir, BUNDLE_DIRNAME)
+    os.makedirs(bundle_dir, exist_ok=True)
+    manifest = {"format_version": FORMAT_VERSION, "models": []}
+    for (name, model), (_name, kind, filename) in zip(load_original_models(models_dir), MODEL_SOURCES):
+        print("  |-> Converting", name, "...")
+        npz = kind + ".npz"
+        np.savez_compressed(os.path.join(bundle_dir, npz), **CONVERTERS[kind](model))
+        manifest["models"].append({"name": name, "type": kind, "file": npz, "source": filename,
+                                   "source_sha1": file_sha1(os.path.join(models_dir, filename))})
+    with open(os.path.join(bundle_dir, MANIFEST_FILENAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return bundle_dir
+
+def has_bundle(bundle_dir):
+    """
+    Returns whether there is a bundle in the given directory.
+    """
+    return os.path.exists(os.path.join(bundle_dir, MANIFEST_FILENAME))
+
+def read_manifest(bundle_dir):
+    """
+    Returns the manifest of the given bundle, checking that this code can read the bundle's format.
+    """
+    with open(os.path.join(bundle_dir, MANIFEST_FILENAME)) as f:
+        manifest = json.load(f)
+    if manifest["format_version"] != FORMAT_VERSION:
+        raise ValueError("Bundle " + bundle_dir + " has format version " + str(manifest["format_version"]) +
+                         " but this code reads version " + str(FORMAT_VERSION) + ". Export it again.")
+    return manifest
+
+def is_up_to_date(entry, models_dir):
+    """
+    Returns whether the given manifest entry was exported from the current version of its source file in models_dir.
+    A bundle shipped without its source files has nothing to be out of date with.
+    """
+    path = os.path.join(models_dir, entry["source"])
+    return not os.path.exists(path) or source_sha1(path) == entry["source_sha1"]
+
+def load_bundle_entry(bundle_dir, entry):
+    """
+    Returns the predictor for one of the models listed in the given bundle's manifest.
+    """
+    with np.load(os.path.join(bundle_dir, entry["file"])) as arrays:
+        return PREDICTORS[entry["type"]](dict(arrays.items()))
+
+def load_bundle(bundle_dir, models_dir=None):
+    """
+    Returns a list of (name, predictor) for the models in the given bundle, in the order they were exported.
+    If models_dir is given, raises a ValueError if any of them is out of date with its source file there.
+    """
+    entries = read_manifest(bundle_dir)["models"]
+    if models_dir is not None:
+        outdated = [entry["source"] for entry in entries if not is_up_to_date(entry, models_dir)]
+        if outdated:
+            raise ValueError("Bundle " + bundle_dir + " is out of date with " + str(outdated) + " in " + models_dir + ". Export it again.")
+    return [(entry["name"], load_bundle_entry(bundle_dir, entry)) for entry in entries]
+
+def verify_bundle(originals, predictors, X):
+    """
+    Compares the predictions of the original models against their NumPy predictors on X.
+    Returns a dict of name -> number of samples on which they disagree.
+    """
+    mismatches = {}
+    for (name, original), (_name, predictor) in zip(originals, predictors):
+        expected = np.ravel(original.predict(X))
+        got = np.ravel(predictor.predict(X))
+        if name == "MLP":
+            # Same decision, and probabilities that agree to float32 precision
+            mismatches[name] = int(np.sum((expected > 0.5) != (got > 0.5)) + np.sum(~np.isclose(expected, got, atol=1e-5)))
+        else:
+            mismatches[name] = int(np.sum(expected != got))
+    return mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exports the betrayal models as a NumPy bundle and checks it against the originals.")
+    parser.add_argument("-m", "--models-dir", default="models", help="Where the trained models are. Default: %(default)s")
+    parser.add_argument("-o", "--out", default=None, help="Where to write the bundle. Default: <models-dir>/" + BUNDLE_DIRNAME)
+    parser.add_argument("-d", "--data", default=None, help="Path to the diplomacy_data.json dataset, for checking the bundle.")
+    parser.add_argument("-w", "--window", type=int, default=3, help="The number of seasons the models were trained on. Default: %(default)s")
+    parser.add_argument("--no-verify", action="store_true", help="Don't check the bundle against the validation set.")
+    args = parser.parse_args()
+
+    print("Exporting the models in", args.models_dir, "...")
+    bundle_dir = export_bundle(args.models_dir, args.out)
+    print("Wrote", bundle_dir)
+    if not args.no_verify:
+        import data
+        _ = [s for s in data.get_all_sequences(args.data)]
+        X_val, _y_val = data.get_validation_set(window=args.window)
+        mismatches = verify_bundle(load_original_models(args.models_dir), load_bundle(bundle_dir), X_val)
+        for name, n in mismatches.items():
+            print("  |->", name, "mismatches on", len(X_val), "validation samples:", n)
+        if any(mismatches.values()):
+            exit(1)
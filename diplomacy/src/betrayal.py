@@ -3,11 +3,26 @@ This is the UI for the program. Call this script with:
 
 python3 betrayal.py msg_pairs_one.yml msg_pairs_two.yml msg_pairs_three.yml
 
+or, to use the models trained on a different number of seasons per window:
+
+python3 betrayal.py --window 4 msg_pairs_one.yml msg_pairs_two.yml msg_pairs_three.yml msg_pairs_four.yml
+
+or, to score every pair of countries in a whole game directory (one YAML file per pair per season) at once:
+
+python3 betrayal.py --game example_game --report example_game_report.csv
+
 """
+import argparse
+import csv
 import data
+import dedup
 import inference
-import sys
-import yaml
+import json
+import numpy as np
+import os
+import seasonfiles
+
+REPORT_COLUMNS = ["pair", "from_country", "to_country", "first_season", "last_season"]
 
 def _convert_relationship_from_yaml(rel_as_yam):
     """
@@ -15,25 +30,102 @@ def _convert_relationship_from_yaml(rel_as_yam):
     """
     return inference.get_relationship(rel_as_yam)
 
-def _predict(rel):
+def _predict(rel, window=inference.DEFAULT_WINDOW):
     """
     Predicts the betrayal probabilities and returns them as an inference.Output object.
     """
-    return inference.predict(rel)
+    return inference.predict(rel, window)
 
 def _load_yaml_files(files):
     """
     Loads the files found at the given file paths into YAML dictionaries
     and concatenates them into a single list of dicts and returns it.
+
+    Besides YAML files, season bundles (see seasonfiles.py) work too.
+
+    Every season is put in the canonical order for its pair of countries as it is loaded (see inference.orient_season),
+    so files don't need to be rewritten into alphabetical order first.
     """
-    relationship_as_yaml = []
-    for yam in files:
-        with open(yam) as f:
-            y = yaml.load(f)
-            relationship_as_yaml.append(y)
-    return relationship_as_yaml
+    return [inference.orient_season(yam) for yam in seasonfiles.load_season_files(files)]
 
-def betrayal(paths):
+def _group_game_files(game_dir):
+    """
+    Loads every YAML file in the given directory and groups them by pair of countries.
+
+    Returns a dict of (country, country) -> list of YAML dicts in chronological order. Within a pair,
+    every YAML dict has the same country in 'a_to_b' (see _load_yaml_files).
+    """
+    paths = sorted(os.path.join(game_dir, name) for name in os.listdir(game_dir) if seasonfiles.is_season_file(name))
+    pairs = {}
+    for yam in _load_yaml_files(paths):
+        pairs.setdefault(inference.get_pair(yam), []).append(yam)
+    for yams in pairs.values():
+        yams.sort(key=inference.season_key)
+    return pairs
+
+def _season_name(season):
+    """
+    Returns a data.Season's name, like "1901 fall".
+    """
+    return str(season.year) + " " + season.season
+
+def betrayal_game(game_dir, window=inference.DEFAULT_WINDOW, near_duplicates=None):
+    """
+    Predicts betrayals for every pair of countries in the given game directory and every window of `window`
+    consecutive seasons the pair talked in. Every distinct message is analyzed once (see dedup.py; near_duplicates
+    is the similarity threshold for near duplicates, if any), and each model gets all of the game's windows in a
+    single batch.
+
+    Returns a list of report rows (dicts with the REPORT_COLUMNS and one column per model), in chronological
+    order within each pair.
+    """
+    print("Loading YAML files...")
+    pairs = _group_game_files(game_dir)
+    print("Converting", len(pairs), "pairs of countries into relationships and doing NLP analysis...")
+    for pair, yams in sorted(pairs.items()):
+        if len(yams) < window:
+            print("  |-> Skipping", "-".join(pair), "which only has", len(yams), "season(s)")
+            del pairs[pair]
+    msgs = [m for yams in pairs.values() for yam in yams for direction in ("a_to_b", "b_to_a") for m in yam[direction]['messages'] or []]
+    analyses, stats = dedup.analyze_messages(msgs, near_duplicates=near_duplicates)
+    print("  |->", dedup.format_stats(stats))
+    analyze = dict(zip(msgs, analyses)).__getitem__
+    relationships = [(pair, inference.get_relationship(yams, analyze)) for pair, yams in sorted(pairs.items())]
+
+    print("Predicting the betrayal likelihoods...")
+    Xs = [data.windows_from_matrix(rel.to_feature_matrix(), window) for _pair, rel in relationships]
+    predictions = inference.predict_batch(np.concatenate(Xs) if Xs else np.zeros((0, 0)), window)
+
+    rows = []
+    for pair, rel in relationships:
+        for seasons in rel.get_season_windows(window):
+            rows.append({
+                            "pair":         "-".join(pair),
+                            "from_country": pair[0],
+                            "to_country":   pair[1],
+                            "first_season": _season_name(seasons[0]),
+                            "last_season":  _season_name(seasons[-1]),
+                        })
+    for name, ys in predictions:
+        for row, y in zip(rows, ys):
+            row[name] = int(y)
+    return rows
+
+def write_report(rows, path):
+    """
+    Writes the given report rows to path, as JSON if path ends in .json and as CSV otherwise.
+    """
+    if path.endswith(".json"):
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=2)
+    else:
+        columns = REPORT_COLUMNS + [c for c in (rows[0].keys() if rows else []) if c not in REPORT_COLUMNS]
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            writer.writerows(rows)
+
+def betrayal(paths, window=inference.DEFAULT_WINDOW):
     """
     The main function for this program.
     Takes the user args (YAML files), turns them into a relationship, then evaluates that relationship using
@@ -45,21 +137,48 @@ def betrayal(paths):
     print("Converting YAML files into a single relationship b/w the two players and doing NLP analysis...")
     relationship = _convert_relationship_from_yaml(relationship_as_yaml)
     print("Predicting the betrayal likelihoods...")
-    betrayals = _predict(relationship)
+    betrayals = _predict(relationship, window)
     return betrayals, relationship
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Need at least one YAML file.")
-        print("USAGE:", sys.argv[0], "path/to/file.yml path/to/otherfile.yml path/to/finalfile.yml")
-        exit(1)
-    elif len(sys.argv) < 4:
-        print("WARNING: With less than three YAML files, you will be running in debug mode. You need three YAML files to make this work.")
-    elif len(sys.argv) > 4:
-        print("This program requires exactly three YAML files.")
-        print("USAGE:", sys.argv[0], "path/to/file.yml path/to/otherfile.yml path/to/finalfile.yml")
+    parser = argparse.ArgumentParser(description="Predicts whether a betrayal is imminent between two players.")
+    parser.add_argument("paths", nargs="*", metavar="path/to/file.yml", help="One YAML file per season, in chronological order.")
+    parser.add_argument("-g", "--game", default=None, metavar="DIR",
+                        help="Instead of the given YAML files, score every pair of countries in this game directory.")
+    parser.add_argument("-r", "--report", default=None,
+                        help="With --game, where to write the report (.json for JSON, CSV otherwise). Default: print it")
+    parser.add_argument("-w", "--window", type=int, default=inference.DEFAULT_WINDOW,
+                        help="The number of seasons the models look at. The last this many YAML files are used. Default: %(default)s")
+    parser.add_argument("--near-duplicates", type=float, nargs="?", const=dedup.DEFAULT_THRESHOLD, default=None, metavar="SIMILARITY",
+                        help="With --game, also analyze near duplicate messages only once: those at least this similar (%(const)s if not given).")
+    parser.add_argument("--parallel", choices=["thread", "process"], default=None,
+                        help="Ask the ensemble's models concurrently, in a pool of threads or of processes. Default: one after the other")
+    parser.add_argument("--timeout", type=float, default=None, help="With --parallel, the seconds to wait for the ensemble's models. Default: no limit")
+    parser.add_argument("--short-circuit", action="store_true",
+                        help="With --parallel, stop waiting for the ensemble's models once the rest can't change its decision.")
+    args = parser.parse_args()
+
+    if args.parallel:
+        inference.configure_ensemble(args.parallel, args.timeout, args.short_circuit)
+
+    if args.game:
+        rows = betrayal_game(args.game, args.window, args.near_duplicates)
+        if args.report:
+            write_report(rows, args.report)
+            print("Wrote", len(rows), "predictions to", args.report)
+        else:
+            for row in rows:
+                print(row)
+        exit(0)
+
+    if len(args.paths) < args.window:
+        print("This program requires at least", args.window, "YAML files for a window of", args.window, "seasons.")
+        parser.print_usage()
         exit(1)
 
-    betrayals, _relationship = betrayal(sys.argv[1:])
+    betrayals, _relationship = betrayal(args.paths, args.window)
     print(betrayals)
+    if args.parallel:
+        for stats in inference.get_ensemble(args.window).member_stats():
+            print("  |->", stats["name"], "| latency: %.1fms" % stats["max_ms"], "| timeouts:", stats["timeouts"], "| skipped:", stats["skipped"])
 
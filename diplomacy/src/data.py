@@ -13,6 +13,11 @@ np.random.seed(12345)
 # The default data path
 DATA_PATH = os.path.join("..", "data_from_paper", "diplomacy_data.json")
 UPSAMPLE_TIMES = 4
+# The number of features in a season's feature vector (see Season.to_feature_vector), without the discourse tags
+FEATURES_PER_SEASON = 10
+# Fills the timesteps past the end of a relationship in padded sequence batches. Real
+# features are never negative, so this can't be mistaken for a season with no messages.
+PAD_VALUE = -1.0
 validation_set = None
 training_set = None
 already_got_all_sequences = False
@@ -174,11 +179,23 @@ class Relationship:
         Returns a list of trigram seasons. If a relationship is five seasons long:
         [S01, W01, S02, W02, S03] -> [(S01, W01, S02), (W01, S02, W02), (S02, W02, S03)]
         """
-        trigrams = []
-        for i in range(len(self.seasons)):
-            if i + 2 < len(self.seasons):
-                trigrams.append((self.seasons[i], self.seasons[i + 1], self.seasons[i + 2]))
-        return trigrams
+        return self.get_season_windows(3)
+
+    def get_season_windows(self, window=3):
+        """
+        Returns a list of tuples of `window` consecutive seasons. If a relationship is five seasons long and window is 2:
+        [S01, W01, S02, W02, S03] -> [(S01, W01), (W01, S02), (S02, W02), (W02, S03)]
+
+        Relationships shorter than the window yield no windows at all.
+        """
+        return [tuple(self.seasons[i:i + window]) for i in range(len(self.seasons) - window + 1)]
+
+    def to_feature_matrix(self, replicate=False):
+        """
+        Returns a numpy array of shape (number of seasons, number of features per season), where each
+        row is Season.to_feature_vector() for the corresponding season (betrayer features first).
+        """
+        return np.array([s.to_feature_vector(False, replicate) for s in self.seasons], dtype=np.float64)
 
 
 def get_all_sequences(datapath=None):
@@ -201,20 +218,57 @@ def get_all_sequences(datapath=None):
     for seq in training_set:
         yield seq
 
-def _concatenate_trigram(tri, reverse, replicate=False):
+def features_per_season(replicate=False):
+    """
+    Returns the number of features in a season's feature vector, with (replicate=True) or without the discourse tags.
+    """
+    return FEATURES_PER_SEASON + (2 if replicate else 0)
+
+def _window_indices(nseasons, window):
     """
-    Takes an iterable of three Season objects and returns a numpy vector of
-    all the features of each Season concatenated.
+    Returns an array of shape (number of windows, window) of season indices, one row per sliding window:
+    nseasons=5, window=3 -> [[0, 1, 2], [1, 2, 3], [2, 3, 4]]
     """
-    fv = []
-    for s in tri:
-        fv += s.to_feature_vector(reverse, replicate)
-    return np.array(fv)
+    nwindows = max(nseasons - window + 1, 0)
+    return np.arange(nwindows)[:, np.newaxis] + np.arange(window)[np.newaxis, :]
 
-def get_X_feed(reverse=True, datapath=None, upsample=False, replicate=False):
+def windows_from_matrix(fm, window, reverse_mask=None):
+    """
+    Takes a feature matrix as returned by Relationship.to_feature_matrix() and returns a matrix with one row per
+    sliding window of `window` seasons, each row being the feature vectors of those seasons concatenated.
+
+    reverse_mask, if given, is a boolean array with one entry per window; the windows where it is True have
+    the betrayer and victim halves of every season swapped (see Season.to_feature_vector's reverse parameter).
+
+    A matrix with fewer seasons than the window (or none at all) gives an empty matrix of shape (0, window * features).
+    """
+    fm = np.asarray(fm, dtype=np.float64)
+    if fm.ndim != 2:
+        # E.g., an empty list of seasons
+        fm = fm.reshape(-1, FEATURES_PER_SEASON)
+    idx = _window_indices(len(fm), window)
+    nfeatures = fm.shape[1]
+    windows = fm[idx]
+    if reverse_mask is not None and np.any(reverse_mask):
+        windows[reverse_mask] = np.roll(windows[reverse_mask], nfeatures // 2, axis=2)
+    return windows.reshape(len(idx), window * nfeatures)
+
+def _relationship_windows(relationship, window, reverse, replicate):
+    """
+    Returns (windows, reverses, X) for the given relationship, where windows is the list of Season tuples,
+    reverses is whether each window was reversed, and X is the corresponding matrix of feature vectors.
+    """
+    windows = relationship.get_season_windows(window)
+    reverses = [random.choice([True, False]) if reverse else False for _ in windows]
+    X = windows_from_matrix(relationship.to_feature_matrix(replicate), window, np.array(reverses, dtype=bool))
+    return windows, reverses, X
+
+def get_X_feed(reverse=True, datapath=None, upsample=False, replicate=False, window=3):
     """
     Generator for getting all the X vectors. Returns a tuple of (reversed, X) at each yield.
 
+    The window parameter is how many consecutive seasons go into each X; the layout below is for the default of three.
+
     Each X is a numpy array that looks like this:
     [N_words_Betrayer_season0, N_sentences_Betrayer_season0, N_requests_season0, politeness_season0, sentiment_season0, N_words_Victim_season0, ..., N_words_Victim_season1, ..., sentiment_season2]
 
@@ -235,10 +289,9 @@ def get_X_feed(reverse=True, datapath=None, upsample=False, replicate=False):
     """
     def get_them():
         for relationship in get_all_sequences(datapath):
-            season_trigrams = relationship.get_season_trigrams()
-            for tri in season_trigrams:
-                r = random.choice([True, False]) if reverse else False
-                yield relationship, tri, r, _concatenate_trigram(tri, r, replicate)
+            windows, reverses, X = _relationship_windows(relationship, window, reverse, replicate)
+            for win, r, x in zip(windows, reverses, X):
+                yield relationship, win, r, x
 
     if upsample:
         base = [(r, t) for _, _, r, t in get_them()]
@@ -250,28 +303,59 @@ def get_X_feed(reverse=True, datapath=None, upsample=False, replicate=False):
         for _, _, r, t in get_them():
             yield r, t
 
-def get_validation_set(datapath=None, replicate=False):
-    def get_Xs():
-        for relationship in validation_set:
-            season_trigrams = relationship.get_season_trigrams()
-            for tri in season_trigrams:
-                r = random.choice([True, False])
-                yield _concatenate_trigram(tri, r, replicate)
-
-    def get_ys():
-        for i, relationship in enumerate(validation_set):
-            season_trigrams = relationship.get_season_trigrams()
-            for tri in season_trigrams:
-                if tri[-1].is_last_season_in_relationship and relationship.betrayal:
-                    yield 1
-                else:
-                    yield 0
-
-    Y_val = np.array([y for y in get_ys()])
-    X_val = np.array([x for x in get_Xs()])
+def upsample(X, y, times=UPSAMPLE_TIMES):
+    """
+    Returns (X, y) with `times` extra copies of every betrayal (y == 1) appended, like get_X_feed and get_Y_feed_binary
+    do with upsample=True, but for a dataset that is already built (e.g., the training side of a cross validation fold,
+    so that no copy of a betrayal ends up on the test side).
+    """
+    X, y = np.asarray(X), np.asarray(y)
+    betrayals = np.flatnonzero(y == 1)
+    idx = np.concatenate([np.arange(len(y))] + [betrayals] * times)
+    return X[idx], y[idx]
+
+def get_validation_set(datapath=None, replicate=False, window=3):
+    Xs = []
+    Ys = []
+    for relationship in validation_set:
+        windows, _reverses, X = _relationship_windows(relationship, window, True, replicate)
+        Xs.extend(X)
+        Ys.extend(1 if win[-1].is_last_season_in_relationship and relationship.betrayal else 0 for win in windows)
+
+    Y_val = np.array(Ys)
+    X_val = np.array(Xs)
 
     return X_val, Y_val
 
+def get_windowed_datasets(windows=(3,), datapath=None, reverse=False, replicate=False, validation=False):
+    """
+    Builds the binary dataset for each of the given window lengths in a single pass over the relationships,
+    so that different window sizes can be compared against one another cheaply.
+
+    Returns a dict of the form {window: (X, y)}, where y is 1 for the window that ends on the last season of a
+    relationship that ends in betrayal, and 0 otherwise.
+
+    If validation is True, the dataset is built from the validation set rather than the training set.
+    """
+    sequences = [seq for seq in get_all_sequences(datapath)]
+    if validation:
+        sequences = validation_set
+    Xs = {w: [] for w in windows}
+    Ys = {w: [] for w in windows}
+    for relationship in sequences:
+        fm = relationship.to_feature_matrix(replicate)
+        for w in windows:
+            nwindows = max(len(fm) - w + 1, 0)
+            reverse_mask = np.random.rand(nwindows) < 0.5 if reverse else None
+            y = np.zeros(nwindows, dtype=int)
+            if relationship.betrayal and nwindows > 0:
+                y[-1] = 1
+            Xs[w].append(windows_from_matrix(fm, w, reverse_mask))
+            Ys[w].append(y)
+    # With no relationships there is nothing to concatenate, so those windows get empty arrays of the right shape
+    return {w: (np.concatenate(Xs[w]), np.concatenate(Ys[w])) if Xs[w] else (np.zeros((0, w * features_per_season(replicate))), np.zeros(0, dtype=int))
+            for w in windows}
+
 def get_X_feed_rnn(datapath=None):
     """
     Yields one relationship feature vector at a time: [[blah], [blah], [blah]] <-- One of these at a time; each one will be length 3 to 10
@@ -287,6 +371,55 @@ def get_Y_feed_binary_rnn(datapath=None):
     for relationship in get_all_sequences(datapath):
         yield [1 if s.is_last_season_in_relationship and relationship.betrayal else 0 for s in relationship.seasons]
 
+def get_sequences(datapath=None, validation=False, replicate=False):
+    """
+    Returns a list of (X, y) pairs, one per relationship, where X is the relationship's feature matrix (one row per season,
+    see Relationship.to_feature_matrix) and y is an array with a 1 for the last season of a betrayal and 0s everywhere else.
+
+    If validation is True, the pairs come from the validation set rather than the training set.
+    """
+    sequences = [seq for seq in get_all_sequences(datapath)]
+    if validation:
+        sequences = validation_set
+    pairs = []
+    for relationship in sequences:
+        y = np.zeros(len(relationship), dtype=np.float32)
+        if relationship.betrayal:
+            y[-1] = 1
+        pairs.append((relationship.to_feature_matrix(replicate), y))
+    return pairs
+
+def pad_sequences(pairs, maxlen=None):
+    """
+    Pads the given (X, y) pairs (see get_sequences) with PAD_VALUE out to maxlen (or the longest X) and stacks them.
+
+    Returns (X, y, weights), with shapes (n, maxlen, n_features), (n, maxlen, 1) and (n, maxlen). weights is 1 for
+    every real season and 0 for every padded one, so it can be used as a temporal sample weight.
+    """
+    maxlen = maxlen if maxlen else max(len(x) for x, _y in pairs)
+    nfeatures = pairs[0][0].shape[1]
+    X = np.full((len(pairs), maxlen, nfeatures), PAD_VALUE, dtype=np.float32)
+    y = np.zeros((len(pairs), maxlen, 1), dtype=np.float32)
+    weights = np.zeros((len(pairs), maxlen), dtype=np.float32)
+    for i, (x, labels) in enumerate(pairs):
+        X[i, :len(x)] = x
+        y[i, :len(x), 0] = labels
+        weights[i, :len(x)] = 1
+    return X, y, weights
+
+def bucket_sequences(pairs, batch_size):
+    """
+    Groups the given (X, y) pairs (see get_sequences) into batches of up to batch_size whole relationships of similar
+    length, and pads each batch only as far as its own longest relationship.
+
+    Returns a list of padded batches, each as returned by pad_sequences.
+    """
+    by_length = sorted(range(len(pairs)), key=lambda i: len(pairs[i][0]))
+    batches = []
+    for start in range(0, len(by_length), batch_size):
+        batches.append(pad_sequences([pairs[i] for i in by_length[start:start + batch_size]]))
+    return batches
+
 def _get_label_from_trigram(tri, relationship, betrayal, reverse):
     """
     Gets the Y corresponding to the given trigram.
@@ -324,7 +457,7 @@ def _get_label_from_trigram(tri, relationship, betrayal, reverse):
             return np.array(y, dtype=np.float32)
 
 
-def get_Y_feed(X, datapath=None, upsample=False):
+def get_Y_feed(X, datapath=None, upsample=False, window=3):
     """
     Generator for getting each Y vector (label vector) that corresponds to each X vector.
     X is a list of: [(reversed, fv), (reversed, fv), ...]
@@ -342,28 +475,31 @@ def get_Y_feed(X, datapath=None, upsample=False):
     UPSAMPLE IS NOT IMPLEMENTED FOR THIS FUNCTION YET.
     """
     for i, relationship in enumerate(get_all_sequences(datapath)):
-        season_trigrams = relationship.get_season_trigrams()
+        season_trigrams = relationship.get_season_windows(window)
         for tri in season_trigrams:
             yield _get_label_from_trigram(tri, relationship, relationship.betrayal, X[i][0])
 
-def get_Y_feed_binary(datapath=None, upsample=False):
+def get_Y_feed_binary(datapath=None, upsample=False, window=3):
     """
     Generator for getting each y label (binary value) that corresponds to each X vector.
 
-    The returned label indicates whether this triseason's last season is a betrayal (1) or not (0).
+    The returned label indicates whether this window's last season is a betrayal (1) or not (0).
 
     When upsample is True, we add duplicate betrayal datapoints to address the class imbalance. These extra betrayals are all added to the end, so
     you should probably shuffle the data when you get it.
     """
+    nbetrayals = 0
     for i, relationship in enumerate(get_all_sequences(datapath)):
-        season_trigrams = relationship.get_season_trigrams()
-        for tri in season_trigrams:
-            if tri[-1].is_last_season_in_relationship and relationship.betrayal:
+        season_windows = relationship.get_season_windows(window)
+        for win in season_windows:
+            if win[-1].is_last_season_in_relationship and relationship.betrayal:
+                nbetrayals += 1
                 yield 1
             else:
                 yield 0
     if upsample:
-        for i in range(250 * UPSAMPLE_TIMES):
+        # Matches the extra betrayals that get_X_feed adds
+        for i in range(nbetrayals * UPSAMPLE_TIMES):
             yield 1
 
 def x_str(x):
@@ -0,0 +1,139 @@
+"""
+This module finds the duplicate messages in a batch before they are analyzed, so that each
+distinct message goes through analyzer.analyze_message once and its analysis is then shared
+by every copy of it (resends, per-CC copies of the same message, the same season parsed twice).
+
+Messages are exact duplicates when their normalized text (see normalize()) is the same. Case
+is kept, since the sentiment and politeness analyses depend on it. Optionally, near duplicates
+(e.g., a message resent with a word changed or in different case, or with part of a thread
+quoted) are found too, by comparing MinHash signatures of their lower cased character shingles,
+with locality sensitive hashing so that each message is only compared against likely matches.
+A near duplicate gets the analysis of the first message it matched, which is close to, but
+not exactly, what its own analysis would have been.
+"""
+import analyzer
+import hashlib
+import random
+import zlib
+
+DEFAULT_THRESHOLD = 0.9
+NUM_PERM = 64
+BANDS = 16
+SHINGLE_SIZE = 5
+# A Mersenne prime larger than any shingle hash, for the MinHash permutations
+_PRIME = (1 << 61) - 1
+
+def normalize(msg):
+    """
+    Returns the text that decides whether two messages are the same: the preprocessed message
+    (see analyzer._preprocess) with all of its whitespace collapsed into single spaces.
+    """
+    return " ".join(analyzer._preprocess(msg).split())
+
+def text_key(msg):
+    """
+    Returns the SHA-1 of the given message's normalized text.
+    """
+    return hashlib.sha1(normalize(msg).encode("utf-8")).hexdigest()
+
+class MinHasher:
+    """
+    Computes MinHash signatures of texts' character shingles.
+    """
+    def __init__(self, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, seed=12345):
+        rng = random.Random(seed)
+        self.shingle_size = shingle_size
+        self.permutations = [(rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)]
+
+    def shingles(self, text):
+        """
+        Returns the set of hashes of the given text's character shingles.
+        """
+        k = self.shingle_size
+        return {zlib.crc32(text[i:i + k].encode("utf-8")) for i in range(max(len(text) - k + 1, 1))}
+
+    def signature(self, text):
+        """
+        Returns the given (normalized) text's MinHash signature, a tuple of num_perm numbers.
+        """
+        shingles = self.shingles(text)
+        return tuple(min((a * s + b) % _PRIME for s in shingles) for a, b in self.permutations)
+
+def similarity(sig_a, sig_b):
+    """
+    Returns the estimated Jaccard similarity of the shingles behind the two given signatures.
+    """
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / len(sig_a)
+
+class Deduplicator:
+    """
+    Assigns each message it is given to a group of duplicates, the first message of which represents the group.
+    near_duplicates is the similarity at or above which two messages are near duplicates, or None to only find exact ones.
+    """
+    def __init__(self, near_duplicates=None, num_perm=NUM_PERM, bands=BANDS):
+        self.near_duplicates = near_duplicates
+        self.representatives = []   # Group -> the first message in it
+        self.nmessages = 0
+        self._groups = {}           # text_key -> group
+        if near_duplicates is not None:
+            self._minhasher = MinHasher(num_perm)
+            self._rows = num_perm // bands
+            self._signatures = []   # Group -> its representative's signature
+            self._buckets = {}      # (band, that band of a signature) -> groups
+
+    def add(self, msg):
+        """
+        Returns the group the given message belongs to, starting a new one if it doesn't match any.
+        """
+        self.nmessages += 1
+        key = text_key(msg)
+        if key in self._groups:
+            return self._groups[key]
+
+        group = None
+        if self.near_duplicates is not None:
+            sig = self._minhasher.signature(normalize(msg).casefold())
+            bands = [(i, sig[i * self._rows:(i + 1) * self._rows]) for i in range(len(sig) // self._rows)]
+            candidates = sorted(set(g for band in bands for g in self._buckets.get(band, [])))
+            group = next((g for g in candidates if similarity(sig, self._signatures[g]) >= self.near_duplicates), None)
+            if group is None:
+                self._signatures.append(sig)
+                for band in bands:
+                    self._buckets.setdefault(band, []).append(len(self.representatives))
+
+        if group is None:
+            group = len(self.representatives)
+            self.representatives.append(msg)
+        self._groups[key] = group
+        return group
+
+    def stats(self):
+        """
+        Returns a dict with the number of messages seen, of distinct ones (exactly and nearly) and the ratio of duplicates.
+        """
+        ngroups = len(self.representatives)
+        return {
+                    "messages":         self.nmessages,
+                    "distinct":         len(self._groups),
+                    "near_distinct":    ngroups,
+                    "duplicate_ratio":  1.0 - ngroups / self.nmessages if self.nmessages else 0.0,
+               }
+
+def analyze_messages(msgs, analyze=analyzer.analyze_message, near_duplicates=None):
+    """
+    Analyzes each distinct message in the given list once and returns (the list of analyses, one per message in
+    msgs, with duplicates sharing theirs; the Deduplicator's stats).
+    """
+    dedup = Deduplicator(near_duplicates)
+    groups = [dedup.add(msg) for msg in msgs]
+    analyses = [analyze(msg) for msg in dedup.representatives]
+    return [analyses[g] for g in groups], dedup.stats()
+
+def format_stats(stats):
+    """
+    Returns the given stats as one line of text.
+    """
+    s = str(stats["messages"]) + " messages, " + str(stats["distinct"]) + " distinct"
+    if stats["near_distinct"] != stats["distinct"]:
+        s += " (" + str(stats["near_distinct"]) + " counting near duplicates)"
+    return s + ", %.1f%% duplicates" % (100 * stats["duplicate_ratio"])
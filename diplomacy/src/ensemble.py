@@ -0,0 +1,263 @@
+"""
+This module provides the ensemble of betrayal models.
+
+Each member votes yes (betrayal) or no. A yes vote counts for the member's recall and a
+no vote against it for the member's precision, each normalized by the sum over all the
+members in MEMBER_METRICS. The ensemble predicts a betrayal when the votes add up to
+more than DECISION_THRESHOLD.
+
+The metrics are the ones the members got on the validation set. They are data rather
+than code: to add a member or update its numbers, edit MEMBER_METRICS.
+
+The members can also be asked concurrently, in a pool of threads or of processes
+(executor="thread" or "process"). Then each member's latency is tracked (see
+member_stats()), a member that takes longer than `timeout` seconds abstains, and with
+short_circuit=True the ensemble stops waiting as soon as the members that are still
+running can no longer change any of its decisions.
+"""
+import collections
+import concurrent.futures
+import multiprocessing
+import numpy as np
+import threading
+import time
+
+# Member name -> (precision, recall) on the validation set
+MEMBER_METRICS = {
+                    "MLP":      (0.87, 0.89),
+                    "KNN":      (0.8, 0.78),
+                    "Tree":     (0.85, 0.63),
+                    "Forest":   (0.85, 0.71),
+                    "SVM":      (0.83, 0.69),
+                 }
+DECISION_THRESHOLD = 0.51
+EXECUTORS = [None, "thread", "process"]
+# How many of each member's most recent latencies member_stats() summarizes
+LATENCY_HISTORY = 1000
+# Short circuiting only decides a sample when it is at least this far from the threshold, so that the
+# order the members finish in (and so the order their weights get added in) can't change the decision
+_SHORT_CIRCUIT_MARGIN = 1e-9
+# The members given to this process, when it is a worker in a process pool
+_worker_models = None
+
+def _member_predict(model, X):
+    """
+    Returns a member's predictions on X (one number per sample) and how long it took to get them.
+    """
+    start = time.time()
+    predictions = np.ravel(model.predict(X)).astype(float)
+    return predictions, time.time() - start
+
+def _init_worker(models):
+    """
+    Keeps the ensemble's members around in a process pool's worker, so they are only pickled once.
+    """
+    global _worker_models
+    _worker_models = models
+
+def _worker_predict(i, X):
+    """
+    Returns the i'th member's predictions on X from inside a process pool's worker.
+    """
+    return _member_predict(_worker_models[i], X)
+
+def get_weight_matrix(names, metrics=MEMBER_METRICS):
+    """
+    Returns an array of shape (len(names), 2) whose row i holds the i'th member's weight for a no vote
+    (column 0) and for a yes vote (column 1).
+    """
+    unknown = [name for name in names if name not in metrics]
+    if unknown:
+        raise ValueError("Model(s) " + str(unknown) + " not accounted for in the ensemble's metrics: " + str(sorted(metrics.keys())))
+    precision = sum(p for p, _r in metrics.values())
+    recall = sum(r for _p, r in metrics.values())
+    return np.array([[-1 * metrics[name][0] / precision, 1 * metrics[name][1] / recall] for name in names])
+
+class Ensemble:
+    """
+    A weighted vote of the given models, each of which is called once per batch.
+
+    executor is None (ask the members one after the other), "thread" or "process". Process pools need members
+    that can be pickled, e.g., the NumPy predictors from artifacts.py rather than a Keras model.
+    timeout is the number of seconds to wait for the members of a concurrent ensemble, after which the ones
+    that haven't answered abstain. A member that times out still finishes in the background, in its worker.
+    """
+    def __init__(self, models, names, metrics=MEMBER_METRICS, threshold=DECISION_THRESHOLD,
+                 executor=None, max_workers=None, timeout=None, short_circuit=False):
+        if executor not in EXECUTORS:
+            raise ValueError("Unknown executor: " + str(executor) + ". Expected one of " + str(EXECUTORS))
+        self.models = models
+        self.names = names
+        self.weights = get_weight_matrix(names, metrics)
+        self.threshold = threshold
+        self.executor = executor
+        self.max_workers = max_workers if max_workers else len(models)
+        self.timeout = timeout
+        self.short_circuit = short_circuit
+        self._pool = None
+        self._lock = threading.Lock()
+        self._latencies = [collections.deque(maxlen=LATENCY_HISTORY) for _ in models]
+        self._timeouts = [0] * len(models)
+        self._skipped = [0] * len(models)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """
+        Shuts down the ensemble's pool, if it has one.
+        """
+        pool, self._pool = getattr(self, "_pool", None), None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _get_pool(self):
+        """
+        Returns the ensemble's pool, starting it the first time.
+        """
+        with self._lock:
+            if self._pool is None:
+                if self.executor == "thread":
+                    self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+                else:
+                    context = multiprocessing.get_context("spawn")
+                    self._pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context,
+                                                                        initializer=_init_worker, initargs=(self.models,))
+            return self._pool
+
+    def _record(self, i, seconds=None, timed_out=False, skipped=False):
+        """
+        Records how the i'th member's part in one batch went.
+        """
+        with self._lock:
+            if seconds is not None:
+                self._latencies[i].append(seconds)
+            self._timeouts[i] += int(timed_out)
+            self._skipped[i] += int(skipped)
+
+    def _is_decided(self, votes, answered):
+        """
+        Returns whether the members that haven't answered yet can no longer change the decision on any sample.
+        """
+        totals = self.combine(votes, answered)
+        pending = self.weights[~answered]
+        lowest = totals + np.sum(pending.min(axis=1))
+        highest = totals + np.sum(pending.max(axis=1))
+        return bool(np.all((lowest > self.threshold + _SHORT_CIRCUIT_MARGIN) | (highest <= self.threshold - _SHORT_CIRCUIT_MARGIN)))
+
+    def _fan_out(self, X):
+        """
+        Asks the members concurrently. Returns the (samples, members) predictions and which members answered.
+        """
+        pool = self._get_pool()
+        if self.executor == "thread":
+            futures = {pool.submit(_member_predict, model, X): i for i, model in enumerate(self.models)}
+        else:
+            futures = {pool.submit(_worker_predict, i, X): i for i in range(len(self.models))}
+        predictions = np.zeros((len(X), len(self.models)))
+        answered = np.zeros(len(self.models), dtype=bool)
+        try:
+            for future in concurrent.futures.as_completed(futures, timeout=self.timeout):
+                i = futures[future]
+                predictions[:, i], seconds = future.result()
+                answered[i] = True
+                self._record(i, seconds)
+                if self.short_circuit and not answered.all() and self._is_decided(self._to_votes(predictions), answered):
+                    break
+        except concurrent.futures.TimeoutError:
+            for i in np.flatnonzero(~answered):
+                self._record(i, timed_out=True)
+        else:
+            for i in np.flatnonzero(~answered):
+                self._record(i, skipped=True)
+        for future in futures:
+            future.cancel()
+        return predictions, answered
+
+    @staticmethod
+    def _to_votes(predictions):
+        """
+        Returns the yes votes in the given member predictions. The MLP gives probabilities rather than labels:
+        like it always has, anything but a probability of exactly zero counts as a yes vote.
+        """
+        return predictions != 0
+
+    def member_predictions(self, Xs):
+        """
+        Returns an array of shape (len(Xs), number of members) of each member's prediction on each sample (a label,
+        or the MLP's probability), along with a boolean array of which members answered (all of them, unless they
+        are asked concurrently). Each member is asked once.
+        """
+        X = np.asarray(Xs)
+        X = X.reshape(len(X), -1)
+        if len(X) == 0:
+            return np.zeros((0, len(self.models))), np.ones(len(self.models), dtype=bool)
+        if self.executor is not None:
+            return self._fan_out(X)
+        predictions = []
+        for i, model in enumerate(self.models):
+            prediction, seconds = _member_predict(model, X)
+            self._record(i, seconds)
+            predictions.append(prediction)
+        return np.column_stack(predictions), np.ones(len(self.models), dtype=bool)
+
+    def votes(self, Xs):
+        """
+        Returns a boolean array of shape (len(Xs), number of members) of each member's vote on each sample,
+        along with a boolean array of which members answered (see member_predictions()).
+        """
+        predictions, answered = self.member_predictions(Xs)
+        return self._to_votes(predictions), answered
+
+    def decision_function(self, Xs):
+        """
+        Returns the weighted sum of the members' votes on each sample.
+        """
+        return self.combine(*self.votes(Xs))
+
+    def predict_with_members(self, Xs):
+        """
+        Returns (the members' predictions and which of them answered, as from member_predictions(); the ensemble's
+        predictions, as from predict()), asking each member only once for both.
+        """
+        predictions, answered = self.member_predictions(Xs)
+        decisions = self.combine(self._to_votes(predictions), answered) > self.threshold
+        return predictions, answered, decisions.astype(int).reshape(-1, 1)
+
+    def combine(self, votes, answered=None):
+        """
+        Returns the weighted sum of the given (samples, members) votes. Members that didn't answer count for nothing.
+        """
+        totals = np.zeros(len(votes))
+        # Member by member, so that the sums come out exactly as they would one sample at a time
+        for i in range(votes.shape[1]):
+            if answered is None or answered[i]:
+                totals += self.weights[i, votes[:, i].astype(int)]
+        return totals
+
+    def member_stats(self):
+        """
+        Returns one dict per member with its number of answers, its latency percentiles in milliseconds over the
+        last LATENCY_HISTORY answers, and the number of times it timed out or was skipped by short circuiting.
+        """
+        with self._lock:
+            stats = []
+            for i, name in enumerate(self.names):
+                ms = np.array(self._latencies[i]) * 1000
+                stats.append({
+                                "name":     name,
+                                "answers":  len(ms),
+                                "mean_ms":  float(np.mean(ms)) if len(ms) else float("nan"),
+                                "p50_ms":   float(np.percentile(ms, 50)) if len(ms) else float("nan"),
+                                "p95_ms":   float(np.percentile(ms, 95)) if len(ms) else float("nan"),
+                                "max_ms":   float(np.max(ms)) if len(ms) else float("nan"),
+                                "timeouts": self._timeouts[i],
+                                "skipped":  self._skipped[i],
+                             })
+            return stats
+
+    def predict(self, Xs):
+        """
+        Returns an array of shape (len(Xs), 1) with 1 where the ensemble predicts a betrayal and 0 elsewhere.
+        """
+        return (self.decision_function(Xs) > self.threshold).astype(int).reshape(-1, 1)
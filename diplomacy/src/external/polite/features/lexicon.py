@@ -0,0 +1,73 @@
+"""
+Precompiled matching of token lists against word lists (lexicons) whose entries
+can be single words ("maybe") or phrases of several words ("in my opinion").
+
+The entries of every lexicon are compiled once into a single token trie, so a
+document's tokens are matched against all of the lexicons in one scan: from
+each token, the trie is followed only as far as some entry continues, which is
+at most as many tokens as the longest entry.
+"""
+from collections import Counter
+
+# Key of a trie node's set of the lexicons an entry ending at that node is in.
+# Tokens are strings, so this can't clash with one.
+_END = None
+
+
+class LexiconMatcher:
+    """
+    Matches tokens against several named lexicons at once. Entries are matched
+    case-insensitively if the tokens given to the matcher are lower case.
+    """
+
+    def __init__(self, lexicons):
+        """
+        lexicons is a dict of lexicon name -> iterable of entries (strings of
+        one or more whitespace separated words).
+        """
+        self.names = list(lexicons)
+        self._trie = {}
+        for name, entries in lexicons.items():
+            for entry in entries:
+                words = entry.lower().split()
+                if not words:
+                    continue
+                node = self._trie
+                for word in words:
+                    node = node.setdefault(word, {})
+                node.setdefault(_END, set()).add(name)
+
+    def matches(self, tokens):
+        """
+        Yields (lexicon name, start, end) for every entry found in the given
+        tokens, where tokens[start:end] is the entry. Overlapping entries are
+        all found.
+        """
+        tokens = tokens if isinstance(tokens, (list, tuple)) else list(tokens)
+        trie = self._trie
+        for start in range(len(tokens)):
+            node = trie.get(tokens[start])
+            end = start + 1
+            while node is not None:
+                for name in node.get(_END, ()):
+                    yield name, start, end
+                if end == len(tokens):
+                    break
+                node = node.get(tokens[end])
+                end += 1
+
+    def counts(self, tokens):
+        """
+        Returns a Counter of lexicon name -> number of entries found in the
+        given tokens (every lexicon has a count, 0 if nothing was found).
+        """
+        counts = Counter({name: 0 for name in self.names})
+        counts.update(name for name, _start, _end in self.matches(tokens))
+        return counts
+
+    def has(self, tokens):
+        """
+        Returns a dict of lexicon name -> whether any of its entries are in the
+        given tokens.
+        """
+        return {name: n > 0 for name, n in self.counts(tokens).items()}
@@ -4,6 +4,9 @@ import re
 from itertools import chain
 from collections import defaultdict
 
+#### PACKAGE IMPORTS ###########################################################
+from external.polite.features.lexicon import LexiconMatcher
+
 # Get the Local Directory to access support files.
 local_dir = os.path.split(__file__)[0]
 
@@ -43,6 +46,20 @@ positive_words = set(map(lambda x: x.strip(), codecs.open(pos_filename, encoding
 neg_filename = os.path.join(local_dir, "liu-negative-words.txt")
 negative_words = set(map(lambda x: x.strip(), codecs.open(neg_filename, encoding='utf-8').read().splitlines()))
 
+#### LEXICON MATCHING ##########################################################
+####    The hedges (some of which are several words long) and the positive and
+####    negative words, compiled once so that a list of (lower case) tokens is
+####    checked against all of them in a single scan.
+TERM_LEXICONS = LexiconMatcher({"hedge": hedges, "positive": positive_words, "negative": negative_words})
+
+def lexicon_counts(terms):
+    """
+    Given a list of lower case tokens, return a Counter of how many hedges,
+    positive words and negative words are in it:
+        { "hedge": 1, "positive": 2, "negative": 0 }
+    """
+    return TERM_LEXICONS.counts(terms)
+
 #### PARSE ELEMENT ANCESTORS ###################################################
 ####    Given a dependency parse string, such as "nsubj(dont-5, I-4)", tranform
 ####    or return specific constituents.
@@ -68,7 +85,8 @@ please.__name__ = "Please"
 pleasestart = lambda p: (getleftpos(p) == 1 and getleft(p) == "please") or (getrightpos(p) == 1 and getright(p) == "please")
 pleasestart.__name__ = "Please start"
 
-hashedges = lambda p:   getdeptag(p) == "nsubj" and  getleft(p) in hedges
+hedge_set = frozenset(hedges)
+hashedges = lambda p:   getdeptag(p) == "nsubj" and  getleft(p) in hedge_set
 hashedges.__name__ = "Hedges"
 
 deference = lambda p: (getleftpos(p) == 1 and getleft(p) in ["great","good","nice","good","interesting","cool","excellent","awesome"]) or (getrightpos(p) == 1 and getright(p) in ["great","good","nice","good","interesting","cool","excellent","awesome"])
@@ -131,14 +149,14 @@ subjunctive.__name__ = "SUBJUNCTIVE"
 indicative = lambda s: "can you" in s or "will you" in s
 indicative.__name__ = "INDICATIVE"
 
-####    Based on token lists.
-has_hedge = lambda l: len(set(l).intersection(hedges)) > 0
+####    Based on token lists (see lexicon_counts).
+has_hedge = lambda l: lexicon_counts(l)["hedge"] > 0
 has_hedge.__name__ = "HASHEDGE"
 
-has_positive = lambda l: len(positive_words.intersection(l)) > 0
+has_positive = lambda l: lexicon_counts(l)["positive"] > 0
 has_positive.__name__ = "HASPOSITIVE"
 
-has_negative = lambda l: len(negative_words.intersection(l)) > 0
+has_negative = lambda l: lexicon_counts(l)["negative"] > 0
 has_negative.__name__ = "HASNEGATIVE"
 
 #### EVALUATE STRATEGY FUNCTIONS ###############################################
@@ -172,13 +190,15 @@ DEPENDENCY_STRATEGIES = [please, pleasestart, btw, hashedges, really, deference,
 ####    Define the text-based strategies to include:
 TEXT_STRATEGIES = [subjunctive, indicative]
 
-####    Define the term-based strategies to include:
+####    Define the term-based strategies to include, along with the lexicon
+####    each one looks for:
 TERM_STRATEGIES = [has_hedge, has_positive, has_negative]
+TERM_STRATEGY_LEXICONS = {has_hedge: "hedge", has_positive: "positive", has_negative: "negative"}
 
 ####    Generate a list of all feature names based on the strategies. The lambda
 ####    function converts the strategy names into feature names.
 fnc2feature_name = lambda f: "feature_politeness_==%s==" % f.__name__.replace(" ","_")
-POLITENESS_FEATURES = map(fnc2feature_name, chain(DEPENDENCY_STRATEGIES, TEXT_STRATEGIES, TERM_STRATEGIES))
+POLITENESS_FEATURES = list(map(fnc2feature_name, chain(DEPENDENCY_STRATEGIES, TEXT_STRATEGIES, TERM_STRATEGIES)))
 
 def get_politeness_strategy_features(document):
     """
@@ -215,18 +235,18 @@ def get_politeness_strategy_features(document):
         features[f] = int(check_elems_for_strategy(parses, lambda p: check_elems_for_strategy(p, fnc)))
 
     # Text-based features:
-    sentences = map(lambda s: s.lower(), document['sentences'])
+    sentences = [s.lower() for s in document['sentences']]
     for fnc in TEXT_STRATEGIES:
         f = fnc2feature_name(fnc)
         features[f] = int(check_elems_for_strategy(sentences, fnc))
 
-    # Term-based features:
-    terms = map(lambda x: x.lower(), document['unigrams'])
+    # Term-based features, all from one scan of the terms:
+    counts = lexicon_counts([x.lower() for x in document['unigrams']])
     for fnc in TERM_STRATEGIES:
         f = fnc2feature_name(fnc)
         ## HACK: weird feature names right now
         #f = f.replace("==", "=")
-        features[f] = int(check_elems_for_strategy([terms], fnc))
+        features[f] = int(counts[TERM_STRATEGY_LEXICONS[fnc]] > 0)
 
     return features
 
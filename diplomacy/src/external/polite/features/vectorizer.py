@@ -1,9 +1,11 @@
 import os
 import _pickle
-import string
+import json
 import nltk
-from itertools import chain
-from collections import defaultdict
+import concurrent.futures
+import multiprocessing
+from itertools import chain, islice
+from collections import Counter
 
 #### PACKAGE IMPORTS ###########################################################
 from external.polite.features.politeness_strategies import get_politeness_strategy_features
@@ -16,13 +18,71 @@ def get_unigrams_and_bigrams(document):
     """
     Grabs unigrams and bigrams from document sentences. NLTK does the work.
     """
-    unigram_lists = map(lambda x: nltk.word_tokenize(x), document['sentences'])
+    # A list, since it is gone through twice (a map would be used up by the bigrams)
+    unigram_lists = [nltk.word_tokenize(x) for x in document['sentences']]
     bigrams = chain(*map(lambda x: nltk.bigrams(x), unigram_lists))
     unigrams = chain(*unigram_lists)
 
     return unigrams, bigrams
 
 
+def count_ngrams(documents):
+    """
+    Counts the unigrams and bigrams in the given documents. Returns
+    (unigram Counter, bigram Counter).
+    """
+    unigram_counts, bigram_counts = Counter(), Counter()
+    for d in documents:
+        unigrams, bigrams = get_unigrams_and_bigrams(d)
+        unigram_counts.update(unigrams)
+        bigram_counts.update(bigrams)
+    return unigram_counts, bigram_counts
+
+
+def iter_documents(path):
+    """
+    Yields the documents in the given file one at a time, without reading the
+    whole file into memory. The file is either a JSON list of documents (like
+    the corpora's) or has one JSON document per line.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r') as f:
+        buf, pos, started = "", 0, False
+        while True:
+            # Skip whitespace and the list's brackets and commas
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] in ",]" or (buf[pos] == "[" and not started)):
+                started = started or buf[pos] == "["
+                pos += 1
+            try:
+                doc, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    if buf[pos:].strip():
+                        raise
+                    return
+                buf, pos = buf[pos:] + chunk, 0
+                continue
+            if end == len(buf):
+                # The document might go on in the next chunk (e.g., a number)
+                chunk = f.read(1 << 20)
+                if chunk:
+                    buf, pos = buf[pos:] + chunk, 0
+                    continue
+            started = True
+            pos = end
+            yield doc
+
+
+def _batches(documents, size):
+    """ Yields lists of up to size documents from the given iterable. """
+    documents = iter(documents)
+    batch = list(islice(documents, size))
+    while batch:
+        yield batch
+        batch = list(islice(documents, size))
+
+
 class PolitenessFeatureVectorizer:
     """
     Return document features based on 1) unigrams, 2) bigrams, and 3) politeness
@@ -74,7 +134,9 @@ class PolitenessFeatureVectorizer:
     def _get_term_features(self, document):
         # One binary feature per ngram in self.unigrams and self.bigrams
         unigrams, bigrams = get_unigrams_and_bigrams(document)
-        # Add unigrams to document for later use
+        # Add unigrams to document for later use (as a list, since they are
+        # gone through again here)
+        unigrams = list(unigrams)
         document['unigrams'] = unigrams
         unigrams, bigrams = set(unigrams), set(bigrams)
         f = {}
@@ -84,9 +146,9 @@ class PolitenessFeatureVectorizer:
 
 
     @staticmethod
-    def generate_bow_features(documents, min_unigram_count=20, min_bigram_count=20):
+    def generate_bow_features(documents, min_unigram_count=20, min_bigram_count=20, workers=1, batch_size=1000):
         """
-        Given a list of documents, compute and store a list of unigrams and
+        Given documents, compute and store a list of unigrams and
         bigrams with a frequency > min_unigram_count and > min_bigram_count,
         respectively. This method must be called prior to the first vectorizer
         instantiation. Documents must be of the form:
@@ -94,27 +156,37 @@ class PolitenessFeatureVectorizer:
                 "sentences": [ "sent1 text", "sent2 text", ... ],
                 "parses": [ ["dep(a, b)"], ["dep(c, d)"], ... ]
             }
+
+        documents can be any iterable of them, or the path of a file to stream
+        them from (see iter_documents), so that they never all have to be in
+        memory at once. With workers > 1, batches of batch_size documents are
+        tokenized and counted in that many worker processes and their counts
+        are merged; only a couple of batches per worker are in flight at once.
         """
-        punctuation = string.punctuation
-        punctuation = punctuation.replace("?","").replace("!","")
-        unigram_counts, bigram_counts = defaultdict(int), defaultdict(int)
-        # Count unigrams and bigrams:
-        for d in documents:
-            unigrams, bigrams = get_unigrams_and_bigrams(d)
-            # Count
-            for w in unigrams:
-                unigram_counts[w] += 1
-            for w in bigrams:
-                bigram_counts[w] += 1
+        if isinstance(documents, str):
+            documents = iter_documents(documents)
+        if workers == 1:
+            unigram_counts, bigram_counts = count_ngrams(documents)
+        else:
+            unigram_counts, bigram_counts = Counter(), Counter()
+            context = multiprocessing.get_context("spawn")
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                pending = set()
+                for batch in _batches(documents, batch_size):
+                    if len(pending) >= 2 * workers:
+                        done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                        for future in done:
+                            unigrams, bigrams = future.result()
+                            unigram_counts.update(unigrams)
+                            bigram_counts.update(bigrams)
+                    pending.add(pool.submit(count_ngrams, batch))
+                for future in concurrent.futures.as_completed(pending):
+                    unigrams, bigrams = future.result()
+                    unigram_counts.update(unigrams)
+                    bigram_counts.update(bigrams)
         # Keep only ngrams that pass frequency threshold:
-        unigram_features = []
-        for key in unigram_counts.keys():
-            if unigram_counts[key] > min_unigram_count:
-                unigram_features.append(key)
-        bigram_features = []
-        for key in bigram_counts.keys():
-            if bigram_counts[key] > min_bigram_count:
-                bigram_features.append(key)
+        unigram_features = sorted(w for w, c in unigram_counts.items() if c > min_unigram_count)
+        bigram_features = sorted(w for w, c in bigram_counts.items() if c > min_bigram_count)
         # Save results:
         _pickle.dump(unigram_features, open(PolitenessFeatureVectorizer.UNIGRAMS_FILENAME, 'wb'))
         _pickle.dump(bigram_features, open(PolitenessFeatureVectorizer.BIGRAMS_FILENAME, 'wb'))
@@ -1,10 +1,14 @@
 
+import argparse
 import random
 import _pickle
 import numpy as np
 import os
 import sys
 import json
+import concurrent.futures
+import multiprocessing
+from array import array
 
 from sklearn import svm
 from scipy.sparse import csr_matrix
@@ -25,11 +29,12 @@ and treat this as a regression problem
 """
 
 
-def train_svm(documents, ntesting=500):
+def train_svm(documents, ntesting=500, workers=1):
     """
     Given a list annotated documents (training data) of the following form, and
     an integer specifying the number of documents to withhold for testing,
-    return a fitted SVC, serialized via pickle.
+    return a fitted SVC, serialized via pickle. The n-grams are counted and
+    the feature vectors calculated in workers processes.
         {
             "sentences": ["sent1 text", "sent2 text", ...],
             "parses": [
@@ -41,7 +46,7 @@ def train_svm(documents, ntesting=500):
     """
     # Generate and persist list of unigrams, bigrams
     print("Gathering N-Grams...")
-    PolitenessFeatureVectorizer.generate_bow_features(documents)
+    PolitenessFeatureVectorizer.generate_bow_features(documents, workers=workers)
 
     # For good luck
     print("Splitting Testing and Training Docs...")
@@ -53,8 +58,8 @@ def train_svm(documents, ntesting=500):
     print("Saving Testing Docs for Later...")
     _pickle.dump(testing, open("testing-data.p", 'wb'))
 
-    X, y = documents2feature_vectors(documents)
-    Xtest, ytest = documents2feature_vectors(testing)
+    X, y = documents2feature_vectors(documents, workers)
+    Xtest, ytest = documents2feature_vectors(testing, workers)
 
     print("Fitting...")
     clf = svm.SVC(C=0.02, kernel='linear', probability=True)
@@ -67,33 +72,85 @@ def train_svm(documents, ntesting=500):
     return clf
 
 
-def documents2feature_vectors(documents):
-    """ Generate feature vectors for the given list of documents. """
+# Set in each worker process by _init_worker
+_vectorizer = None
+_feature_index = None
+
+
+def _document_label(d):
+    # If politeness score > 0.0,
+    # the doc is polite, class=1
+    try:
+        return 1 if float(d['score']) > 0.0 else 0
+    except ValueError:
+        return 0
+
+
+def _init_worker(feature_keys):
+    global _vectorizer, _feature_index
+    _vectorizer = PolitenessFeatureVectorizer()
+    _feature_index = {f: j for j, f in enumerate(feature_keys)}
+
+
+def _sparse_rows(documents):
+    """
+    Returns the CSR pieces of the given documents' feature vectors:
+    (row lengths, column indices, values, labels), with only the non-zero
+    values stored.
+    """
+    lengths, indices, data, labels = array('q'), array('q'), array('q'), array('q')
+    for d in documents:
+        fs = _vectorizer.features(d)
+        row = sorted((_feature_index[f], v) for f, v in fs.items() if v)
+        lengths.append(len(row))
+        indices.extend(j for j, _v in row)
+        data.extend(v for _j, v in row)
+        labels.append(_document_label(d))
+    return lengths, indices, data, labels
+
+
+def documents2feature_vectors(documents, workers=1, chunksize=1000):
+    """
+    Generate feature vectors for the given list of documents.
+
+    The sparse matrix is built chunk by chunk from the non-zero features
+    only, so memory grows with the number of non-zeros rather than with
+    documents times vocabulary. With workers > 1, the chunks are featurized
+    in that many worker processes.
+    """
     print("Calculating Feature Vectors...")
     vectorizer = PolitenessFeatureVectorizer()
-    fks = False
-    X, y = [], []
-    cnt = 0
-    for d in documents:
-        fs = vectorizer.features(d)
-        if not fks:
-            fks = sorted(fs.keys())
-        fv = [fs[f] for f in fks]
-        # If politeness score > 0.0, 
-        # the doc is polite, class=1
-        try:
-            l = 1 if float(d['score']) > 0.0 else 0
-        except ValueError:
-            l = 0
-        X.append(fv)
-        y.append(l)
-        print(cnt)
-        cnt+=1
-    X = csr_matrix(np.asarray(X))
-    y = np.asarray(y)
+    fks = sorted(vectorizer.features(documents[0]).keys()) if documents else []
+    chunks = [documents[i:i + chunksize] for i in range(0, len(documents), chunksize)]
+    if workers == 1:
+        _init_worker(fks)
+        pieces = map(_sparse_rows, chunks)
+        pool = None
+    else:
+        context = multiprocessing.get_context("spawn")
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                                      initializer=_init_worker, initargs=(fks,))
+        pieces = pool.map(_sparse_rows, chunks)
+
+    indptr, indices, data, y = array('q', [0]), array('q'), array('q'), array('q')
+    try:
+        for lengths, chunk_indices, chunk_data, labels in pieces:
+            for n in lengths:
+                indptr.append(indptr[-1] + n)
+            indices.extend(chunk_indices)
+            data.extend(chunk_data)
+            y.extend(labels)
+            print(len(y), "/", len(documents))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    # The copies make the arrays writable (numpy arrays over an array.array's buffer aren't)
+    X = csr_matrix((np.frombuffer(data, dtype=np.int64).copy(), np.frombuffer(indices, dtype=np.int64).copy(),
+                    np.frombuffer(indptr, dtype=np.int64).copy()), shape=(len(y), len(fks)))
+    y = np.frombuffer(y, dtype=np.int64).copy()
     return X, y
 
-def train_classifier(dataset, ntesting=500):
+def train_classifier(dataset, ntesting=500, workers=1):
     """
     Wrapper function for train_svm(). Given a dataset identifier ('all',
     'wikipedia', or 'stackexchange') and an integer specifying how many
@@ -119,15 +176,19 @@ def train_classifier(dataset, ntesting=500):
         all_docs = json.loads(open(PARSED_STACK_EXCHANGE, 'r').read()) + json.loads(open(PARSED_WIKIPEDIA, 'r').read())
 
     print("Starting to Train Model...")
-    FITTED_SVC = train_svm(all_docs, ntesting=ntesting)
+    FITTED_SVC = train_svm(all_docs, ntesting=ntesting, workers=workers)
     print("Dumping Model to File...")
     _pickle.dump(FITTED_SVC, open("politeness-svm.p", 'wb'))
     print("Finishing up...")
 
 if __name__ == "__main__":
     # Train a dummy model off our 4 sample request docs
+    parser = argparse.ArgumentParser(description="Trains a dummy politeness SVM on the sample request documents.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="The number of processes that count the n-grams and calculate the feature vectors. Default: %(default)s")
+    args = parser.parse_args()
 
     from test_documents import TEST_DOCUMENTS
 
-    train_svm(TEST_DOCUMENTS, ntesting=1)
+    train_svm(TEST_DOCUMENTS, ntesting=1, workers=args.workers)
 
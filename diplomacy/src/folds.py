@@ -0,0 +1,162 @@
+"""
+This module provides a cache of cross validation folds.
+
+Folds are computed once per dataset (identified by a fingerprint of its contents)
+and persisted to disk as the dataset and each fold's train and test indices. Every
+model evaluated on the same dataset then gets the exact same splits, and every
+process slices its folds out of the same memory mapped copy of the dataset.
+
+A cache is built in a temporary directory and renamed into place when it is complete,
+so processes that create the same cache at the same time never see (or write into)
+each other's partial files.
+
+Usage:
+
+cache = folds.get_fold_cache(X, y)
+scores = folds.cross_val_score(clf, cache, n_jobs=-1)
+for X_train, y_train, X_test, y_test in cache:
+    ...
+"""
+import hashlib
+import json
+import numpy as np
+import os
+import shutil
+import tempfile
+from sklearn.base import clone
+from sklearn.externals import joblib
+from sklearn.model_selection import StratifiedKFold
+
+FOLD_CACHE_DIR = ".fold_cache"
+DEFAULT_N_SPLITS = 5
+# Fold caches that have already been opened by this process, by path
+_open_caches = {}
+
+def fingerprint(X, y):
+    """
+    Returns a hex digest that identifies the given dataset by its shapes, types and contents.
+    """
+    h = hashlib.sha1()
+    for a in (X, y):
+        a = np.ascontiguousarray(a)
+        h.update(str(a.shape).encode())
+        h.update(str(a.dtype).encode())
+        h.update(a.data)
+    return h.hexdigest()
+
+class FoldCache:
+    """
+    The persisted folds of one dataset. Use get_fold_cache() or FoldCache.open() rather than building one directly.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.n_splits = meta["n_splits"]
+        self.fingerprint = meta["fingerprint"]
+        self.X = np.load(os.path.join(path, "X.npy"), mmap_mode='r')
+        self.y = np.load(os.path.join(path, "y.npy"), mmap_mode='r')
+        indices = np.load(os.path.join(path, "folds.npz"))
+        self.splits = [(indices["train_" + str(i)], indices["test_" + str(i)]) for i in range(self.n_splits)]
+
+    def __iter__(self):
+        for i in range(self.n_splits):
+            yield self.fold(i)
+
+    def __len__(self):
+        return self.n_splits
+
+    def __str__(self):
+        return "Folds: " + str(self.n_splits) + " Samples: " + str(len(self.y)) + " Fingerprint: " + self.fingerprint
+
+    def fold(self, i):
+        """
+        Returns (X_train, y_train, X_test, y_test) for the i'th fold, sliced out of the memory mapped dataset.
+        """
+        train, test = self.splits[i]
+        return self.X[train], self.y[train], self.X[test], self.y[test]
+
+    @staticmethod
+    def create(X, y, n_splits=DEFAULT_N_SPLITS, cache_dir=FOLD_CACHE_DIR):
+        """
+        Computes the folds for the given dataset and persists them (unless they already are).
+        Returns the path to the persisted folds.
+
+        The folds are the same as the ones cross_val_score(cv=n_splits) would use for a classifier.
+        """
+        fp = fingerprint(X, y)
+        path = os.path.join(cache_dir, fp[:16] + "_" + str(n_splits))
+        if os.path.exists(os.path.join(path, "meta.json")):
+            return path
+
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix=os.path.basename(path) + ".tmp", dir=cache_dir)
+        try:
+            X, y = np.asarray(X), np.asarray(y)
+            np.save(os.path.join(tmp, "X.npy"), np.ascontiguousarray(X))
+            np.save(os.path.join(tmp, "y.npy"), np.ascontiguousarray(y))
+            indices = {}
+            cv = StratifiedKFold(n_splits=n_splits)
+            for i, (train, test) in enumerate(cv.split(X, y)):
+                indices["train_" + str(i)] = train
+                indices["test_" + str(i)] = test
+            np.savez(os.path.join(tmp, "folds.npz"), **indices)
+            with open(os.path.join(tmp, "meta.json"), 'w') as f:
+                json.dump({"n_splits": n_splits, "fingerprint": fp, "n_samples": len(y)}, f)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # Another process got there first (its cache is complete, since it is only renamed into place when it is),
+                # unless what is there is left over from a run that died before this cache was written atomically
+                if not os.path.exists(os.path.join(path, "meta.json")):
+                    shutil.rmtree(path, ignore_errors=True)
+                    os.rename(tmp, path)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        return path
+
+    @staticmethod
+    def open(path):
+        """
+        Returns the FoldCache persisted at the given path, reusing it if this process already opened it.
+        """
+        if path not in _open_caches:
+            _open_caches[path] = FoldCache(path)
+        return _open_caches[path]
+
+def get_fold_cache(X, y, n_splits=DEFAULT_N_SPLITS, cache_dir=FOLD_CACHE_DIR):
+    """
+    Returns the FoldCache for the given dataset, computing and persisting the folds the first time.
+    """
+    return FoldCache.open(FoldCache.create(X, y, n_splits, cache_dir))
+
+def _fold_score(clf, path, i):
+    """
+    Fits a clone of clf on the i'th fold of the FoldCache persisted at path and returns its score on the fold's test set.
+    """
+    X_train, y_train, X_test, y_test = FoldCache.open(path).fold(i)
+    return clone(clf).fit(X_train, y_train).score(X_test, y_test)
+
+def cross_val_score(clf, cache, n_jobs=1, backend=None):
+    """
+    Returns an array with the score (see clf.score) of a clone of clf fit on each fold of the given FoldCache,
+    like sklearn's cross_val_score, but on the persisted folds.
+
+    The folds are run by joblib with n_jobs jobs, in worker processes by default or in threads with backend="threading".
+    Either way, each job opens the cache by its path, so only the path is sent to it rather than the arrays.
+    """
+    parallel = joblib.Parallel(n_jobs=n_jobs, backend=backend) if backend else joblib.Parallel(n_jobs=n_jobs)
+    return np.array(parallel(joblib.delayed(_fold_score)(clf, cache.path, i) for i in range(cache.n_splits)))
+
+def cross_val_predict(clf, cache, method="predict"):
+    """
+    Fits a clone of clf on each fold of the given FoldCache and returns its out-of-fold predictions for every sample,
+    using clf's `method` (e.g., "predict" or "predict_proba"). clf itself is left as it is.
+    """
+    predictions = None
+    for (_train, test), (X_train, y_train, X_test, _y_test) in zip(cache.splits, cache):
+        pred = getattr(clone(clf).fit(X_train, y_train), method)(X_test)
+        if predictions is None:
+            predictions = np.zeros((len(cache.y),) + np.shape(pred)[1:], dtype=np.asarray(pred).dtype)
+        predictions[test] = pred
+    return predictions
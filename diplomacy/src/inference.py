@@ -1,73 +1,63 @@
 """
 This is the API for the part of the program that does the inference.
 """
-import os
-if not "SSH_CONNECTION" in os.environ:
-    # Disable annoying TF warnings when importing keras (which imports TF)
-    os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
-    import tensorflow as tf
 import analyzer
+import artifacts
 import data
-import keras
+import dedup
+from ensemble import Ensemble
+import functools
 import numpy as np
-from sklearn.externals import joblib
-
-
-class Ensemble:
-    def __init__(self, models, names):
-        self.models = models
-        self.names = names
-
-    def predict(self, Xs):
-        ys = []
-        for X in Xs:
-            Y = []
-            for name, model in zip(self.names, self.models):
-                if name == "MLP":
-                    Y.append(np.array([model.predict(X.reshape(1, 30)).tolist()[0]]))
-                else:
-                    Y.append(model.predict(X.reshape(1, -1)).tolist()[0])
-            ys.append(Y)
-        weighted_ys = []
-        precision = 0.87 + 0.8+ 0.85 + 0.85 + 0.83
-        recall = 0.89 + 0.78 + 0.63 + 0.71 + 0.69
-        for Y in ys:
-            weighted_Y = []
-            for name, y in zip(self.names, Y):
-                to_append = 0
-                if name == "MLP" and y:
-                    to_append = 1 * 0.89 / recall
-                elif name == "MLP" and not y:
-                    to_append = -1 * 0.87 / precision
-                elif name == "KNN" and y:
-                    to_append = 1 * 0.78 / recall
-                elif name == "KNN" and not y:
-                    to_append = -1 * 0.8 / precision
-                elif name == "Tree" and y:
-                    to_append = 1 * 0.63 / recall
-                elif name == "Tree" and not y:
-                    to_append = -1 * 0.85 / precision
-                elif name == "Forest" and y:
-                    to_append = 1 * 0.71 / recall
-                elif name == "Forest" and not y:
-                    to_append = -1 * 0.85 / precision
-                elif name == "SVM" and y:
-                    to_append = 1 * 0.69 / recall
-                elif name == "SVM" and not y:
-                    to_append = -1 * 0.83 /precision
-                else:
-                    assert False, "Model: " + name + " not accounted for when y is " + bool(y)
-                weighted_Y.append(to_append)
-            prediction = np.array([1]) if sum(weighted_Y) > 0.51 else np.array([0])
-            weighted_ys.append(prediction)
-        return np.array(weighted_ys)
-
-
-
-def get_relationship(rel_as_yam):
+import registry
+
+# Where the models trained on the default window of three seasons live.
+# Models trained on other window lengths live in models/window<N>/ (see artifacts.get_model_dir)
+MODEL_DIR = artifacts.MODEL_DIR
+DEFAULT_WINDOW = artifacts.DEFAULT_WINDOW
+
+# The models every prediction in this process uses
+REGISTRY = registry.ModelRegistry(Ensemble)
+
+def get_cached_analyzer():
+    """
+    Returns a function that does what analyzer.analyze_message does, but that only analyzes each distinct message
+    (see dedup.normalize) once no matter how many times it is asked to.
+    """
+    cache = {}
+    def analyze(msg):
+        key = dedup.text_key(msg)
+        if key not in cache:
+            cache[key] = analyzer.analyze_message(msg)
+        return cache[key]
+    return analyze
+
+def season_key(yam):
+    """
+    Returns the given season's YAML dict as a number that sorts chronologically: the year, plus 0.5 in the Fall.
+    """
+    return int(yam['year']) + (0 if yam['season'] == "Spring" else 0.5)
+
+def get_pair(yam):
+    """
+    Returns the pair of countries that the given season's YAML dict is between, in alphabetical order.
+    """
+    return tuple(sorted((yam['a_to_b']['from_country'], yam['a_to_b']['to_country'])))
+
+def orient_season(yam):
+    """
+    Returns the given season's YAML dict with 'a_to_b' being the messages from the first country of its pair
+    (see get_pair()), swapping 'a_to_b' and 'b_to_a' if needed.
+    """
+    if yam['a_to_b']['from_country'] == get_pair(yam)[0]:
+        return yam
+    return dict(yam, a_to_b=yam['b_to_a'], b_to_a=yam['a_to_b'])
+
+def get_relationship(rel_as_yam, analyze=analyzer.analyze_message):
     """
     Creates a data.Relationship object from the given files.
     Used for inference, not training.
+
+    analyze is the function used to analyze each message (e.g., the one from get_cached_analyzer()).
     """
     betrayal = False # Not needed for inference
     from_player = rel_as_yam[0]['a_to_b']['from_country']
@@ -79,8 +69,9 @@ def get_relationship(rel_as_yam):
         interaction = None # Not needed for inference
         betrayer = "a_to_b" # Not needed for inference
         victim = "b_to_a" # Not needed for inference
-        messages_betrayer = [analyzer.analyze_message(m) for m in s[betrayer]['messages']]
-        messages_victim = [analyzer.analyze_message(m) for m in s[victim]['messages']]
+        # A one sided season has no messages (null in its YAML file) in one direction
+        messages_betrayer = [analyze(m) for m in s[betrayer]['messages'] or []]
+        messages_victim = [analyze(m) for m in s[victim]['messages'] or []]
         messages = {"betrayer": messages_betrayer, "victim": messages_victim}
         sdict = {"season": year, "interaction": interaction, "messages": messages}
         seasons.append(sdict)
@@ -88,32 +79,73 @@ def get_relationship(rel_as_yam):
     relationship = data.Relationship({"idx": 0, "game": 0, "betrayal": betrayal, "people": [from_player, to_player], "seasons": seasons})
     return relationship
 
-def load_models():
+def get_model_dir(window=DEFAULT_WINDOW):
+    """
+    Returns the directory that holds the models trained on the given window length.
+    """
+    return artifacts.get_model_dir(window)
+
+def load_models(window=DEFAULT_WINDOW):
     """
-    Returns a list of classifiers loaded from the default model location.
+    Returns a list of classifiers for the given window length.
+
+    The models are loaded once per process (see registry.py) and reloaded if their files change.
+    If the models have been exported as a NumPy bundle (see artifacts.py), the bundle's predictors are used,
+    which doesn't need scikit-learn's pickles or Keras and TensorFlow. Otherwise the original models are loaded.
+    """
+    return REGISTRY.get_models(get_model_dir(window))
+
+def preload(windows=(DEFAULT_WINDOW,)):
+    """
+    Loads the models for each of the given window lengths, e.g., when a long running process starts up.
+    """
+    REGISTRY.preload([get_model_dir(w) for w in windows])
+
+def configure_ensemble(executor=None, timeout=None, short_circuit=False):
+    """
+    Sets how the ensemble asks its members (see ensemble.Ensemble): one after the other (executor=None),
+    or concurrently in a "thread" or "process" pool, optionally with a timeout and short circuiting.
+    """
+    REGISTRY.set_ensemble_maker(functools.partial(Ensemble, executor=executor, timeout=timeout, short_circuit=short_circuit))
+
+def get_ensemble(window=DEFAULT_WINDOW):
+    """
+    Returns the ensemble for the given window length.
     """
-    model_paths = {
-                    'KNN':      "models/knn.model",
-                    'Tree':     "models/tree.model",
-                    'Forest':   "models/forest.model",
-                    'SVM':      "models/svm.model",
-                    #'Logreg':   "models/logregr.model", <- This model ain't great
-                  }
-    models = [(name, joblib.load(path)) for name, path in model_paths.items()]
-    models.append(("MLP", keras.models.load_model("models/mlp.hdf5")))
-    models.append(("Ensemble", Ensemble([m[1] for m in models], [m[0] for m in models])))
-    return models
+    return dict(load_models(window))["Ensemble"]
 
-def predict(rel):
+def predict(rel, window=DEFAULT_WINDOW):
     """
     Predicts whether there will be a betrayal or not next turn based on the given relationship.
+
+    Uses the most recent `window` seasons of the relationship and the models trained on that window length.
+    """
+    assert len(rel) >= window, "You need at least " + str(window) + " YAML files for a window of " + str(window) + " seasons."
+    Xs = data.windows_from_matrix(rel.to_feature_matrix(), window)[-1:]
+    return [(name, int(ys[0])) for name, ys in predict_batch(Xs, window)]
+
+def predict_batch(Xs, window=DEFAULT_WINDOW):
     """
-    assert len(rel) == 3, "Currently you need exactly 3 YAML files."
-    fvs = []
-    for s in rel.get_season_trigrams()[0]:
-        fvs += s.to_feature_vector()
-    Xs = np.array(fvs).reshape(1, -1)
-    yes_nos = [(name, model.predict(Xs).tolist()[0]) for name, model in load_models()]
-    yes_nos = [(name, round(yn[0])) if type(yn) == list else (name, yn) for name, yn in yes_nos]
-    return yes_nos
+    Predicts whether there will be a betrayal or not after each of the given windows (rows of feature vectors
+    as returned by data.windows_from_matrix()). Each model gets all of them in one batch.
 
+    The members are only asked through the ensemble (see ensemble.Ensemble.predict_with_members), so each of them
+    runs once, however the ensemble is configured. A member that didn't answer in time is left out.
+
+    Returns a list of (name, array with a 0 or 1 per window).
+    """
+    ensemble = get_ensemble(window)
+    if len(Xs) == 0:
+        return [(name, np.zeros(0, dtype=int)) for name in ensemble.names + ["Ensemble"]]
+    predictions, answered, decisions = ensemble.predict_with_members(Xs)
+    yes_nos = [(name, np.round(predictions[:, i]).astype(int)) for i, name in enumerate(ensemble.names) if answered[i]]
+    return yes_nos + [("Ensemble", np.ravel(decisions))]
+
+def predict_windows(rel, window=DEFAULT_WINDOW):
+    """
+    Predicts, for every sliding window of `window` seasons in the given relationship, whether there will be a betrayal
+    the season after it.
+
+    Returns a list of (name, array with a 0 or 1 per window), in the order of data.Relationship.get_season_windows().
+    """
+    return predict_batch(data.windows_from_matrix(rel.to_feature_matrix(), window), window)
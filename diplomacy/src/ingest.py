@@ -0,0 +1,246 @@
+"""
+This is a front end module that turns raw games straight into training data, in the same
+relationship format as diplomacy_data.json (so data.get_all_sequences() can read it).
+
+A game is a directory of playdiplomacy message dumps (.txt files, in any subdirectories, like
+mygame/), along with its game history (times.txt) and, optionally, its betrayals (labels.csv,
+one "Season Year Betrayer-Victim # comment" per line). Each game is parsed, grouped into seasons
+and pairs of countries, and has its messages analyzed in memory, with no YAML files in between.
+Duplicate messages are only analyzed once (see dedup.py). Games are ingested in parallel worker processes.
+
+Every ingested game is checkpointed in its own file, along with a fingerprint of the files it
+came from, so an interrupted run picks up where it left off, and games that haven't changed
+since the last run aren't ingested again.
+
+Each pair of countries that talked in at least `min_seasons` seasons becomes one relationship.
+If the pair has a betrayal in labels.csv, the relationship ends in the season of the (first)
+betrayal, with the betrayer's messages as "betrayer"; otherwise it covers every season the pair
+talked in. The seasons' interactions are not known from the messages, so they are all null.
+
+Example:
+
+python3 ingest.py mygame othergame --out ingested_data.json --workers 4
+
+"""
+import analyzer
+import argparse
+import concurrent.futures
+import dedup
+import hashlib
+import inference
+import json
+import multiprocessing
+import os
+from scripts import gameparser
+import time
+
+CHECKPOINT_DIR = "ingest_checkpoints"
+# Bump this whenever ingestion changes in a way that makes old checkpoints wrong
+CHECKPOINT_VERSION = 3
+TIMES_NAME = "times.txt"
+LABELS_NAME = "labels.csv"
+
+def game_files(game_dir):
+    """
+    Returns the paths of the message dumps in the given game directory, sorted.
+    """
+    paths = []
+    for dirpath, _dirnames, filenames in os.walk(game_dir):
+        for name in filenames:
+            if name.endswith(".txt") and name != TIMES_NAME:
+                paths.append(os.path.join(dirpath, name))
+    return sorted(paths)
+
+def fingerprint(game_dir):
+    """
+    Returns a hash of the names, sizes and modification times of every file the given game is ingested from.
+    """
+    h = hashlib.sha1(str(CHECKPOINT_VERSION).encode("utf-8"))
+    extras = [os.path.join(game_dir, name) for name in (TIMES_NAME, LABELS_NAME)]
+    for path in game_files(game_dir) + [p for p in extras if os.path.exists(p)]:
+        st = os.stat(path)
+        h.update((os.path.relpath(path, game_dir) + "|" + str(st.st_size) + "|" + str(st.st_mtime_ns) + "\n").encode("utf-8"))
+    return h.hexdigest()
+
+def load_labels(path):
+    """
+    Returns the betrayals in the given labels file as a dict of pair of countries (see inference.get_pair) ->
+    (season, betrayer), keeping the first betrayal of each pair. Seasons are numbers like 1901.5 (see inference.season_key).
+    """
+    labels = {}
+    if not os.path.exists(path):
+        return labels
+    with open(path) as f:
+        for line in f:
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+            season, year, countries = line.split()
+            betrayer, victim = [c.strip().lower().title() for c in countries.split("-")]
+            key = inference.season_key({"year": year, "season": season})
+            pair = tuple(sorted((betrayer, victim)))
+            if pair not in labels or key < labels[pair][0]:
+                labels[pair] = (key, betrayer)
+    return labels
+
+def get_seasons(game_dir):
+    """
+    Parses the given game's message dumps into season dicts (like the YAML files betrayal.py takes) and
+    returns a dict of pair of countries -> list of its season dicts in chronological order.
+    """
+    timelist = gameparser.TimeList(os.path.join(game_dir, TIMES_NAME))
+    msgs = gameparser.iter_messages(game_files(game_dir), timelist)
+    pairs = {}
+    for conversation in gameparser.group_conversations(msgs):
+        yam = gameparser.season_record(conversation)
+        pairs.setdefault(inference.get_pair(yam), []).append(yam)
+    for yams in pairs.values():
+        yams.sort(key=inference.season_key)
+    return pairs
+
+def relationship_record(game, pair, yams, label, analyze):
+    """
+    Returns the given pair's seasons as a relationship dict in the diplomacy_data.json format (with idx 0;
+    see merge_checkpoints()). label is the pair's (season, betrayer) from load_labels(), or None.
+    """
+    betrayer = label[1] if label else pair[0]
+    victim = pair[1] if betrayer == pair[0] else pair[0]
+    seasons = []
+    for yam in yams:
+        key = inference.season_key(yam)
+        if label and key > label[0]:
+            break
+        if yam['a_to_b']['from_country'] != betrayer:
+            yam = dict(yam, a_to_b=yam['b_to_a'], b_to_a=yam['a_to_b'])
+        messages = {
+                        "betrayer": [analyze(m) for m in yam['a_to_b']['messages']],
+                        "victim":   [analyze(m) for m in yam['b_to_a']['messages']],
+                   }
+        seasons.append({"season": key, "interaction": None, "messages": messages})
+    return {"idx": 0, "game": game, "betrayal": label is not None, "people": [betrayer, victim], "seasons": seasons}
+
+def ingest_game(game_dir, min_seasons=inference.DEFAULT_WINDOW, near_duplicates=None, analyze=analyzer.analyze_message):
+    """
+    Returns (the list of relationship dicts (see relationship_record()) for the given game directory, the dedup stats).
+    Every distinct message (see dedup.py; near_duplicates is the similarity threshold for near duplicates, if any) is
+    analyzed once, and only the messages of the relationships that are kept are analyzed at all.
+    """
+    game = os.path.basename(os.path.normpath(game_dir))
+    labels = load_labels(os.path.join(game_dir, LABELS_NAME))
+    relationships = []
+    for pair, yams in sorted(get_seasons(game_dir).items()):
+        # The raw messages stand in for their analyses until every message of the game is known
+        rel = relationship_record(game, pair, yams, labels.get(pair), str)
+        if rel["seasons"] and len(rel["seasons"]) >= min_seasons:
+            relationships.append(rel)
+
+    per_person = [s["messages"] for rel in relationships for s in rel["seasons"]]
+    msgs = [m for messages in per_person for person in ("betrayer", "victim") for m in messages[person]]
+    analyses, stats = dedup.analyze_messages(msgs, analyze, near_duplicates)
+    analyses = iter(analyses)
+    for messages in per_person:
+        for person in ("betrayer", "victim"):
+            messages[person] = [next(analyses) for _m in messages[person]]
+    return relationships, stats
+
+def checkpoint_path(game_dir, checkpoint_dir=CHECKPOINT_DIR):
+    return os.path.join(checkpoint_dir, os.path.basename(os.path.normpath(game_dir)) + ".json")
+
+def read_checkpoint(game_dir, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Returns the given game's checkpoint (a dict with its "fingerprint" and "relationships"), or None if there isn't one.
+    """
+    path = checkpoint_path(game_dir, checkpoint_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def _ingest_and_checkpoint(game_dir, checkpoint_dir, settings):
+    """
+    Ingests the given game and writes its checkpoint. Returns (game_dir, number of relationships, dedup stats, seconds taken).
+    """
+    start = time.time()
+    fp = fingerprint(game_dir)
+    relationships, stats = ingest_game(game_dir, **settings)
+    path = checkpoint_path(game_dir, checkpoint_dir)
+    tmp = path + ".tmp" + str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({"game_dir": game_dir, "fingerprint": fp, "settings": settings, "dedup": stats, "relationships": relationships}, f)
+    os.replace(tmp, path)
+    return game_dir, len(relationships), stats, time.time() - start
+
+def is_up_to_date(game_dir, checkpoint_dir=CHECKPOINT_DIR, settings=None):
+    """
+    Returns whether the given game's checkpoint exists and was made from the game's current files with the given
+    settings (ingest_game()'s keyword arguments).
+    """
+    checkpoint = read_checkpoint(game_dir, checkpoint_dir)
+    return checkpoint is not None and checkpoint["fingerprint"] == fingerprint(game_dir) and checkpoint["settings"] == (settings or {})
+
+def merge_checkpoints(game_dirs, checkpoint_dir=CHECKPOINT_DIR):
+    """
+    Returns (the relationships of all of the given games' checkpoints as a single list, numbered (idx) in order;
+    the games' dedup stats added up).
+    """
+    relationships = []
+    totals = {"messages": 0, "distinct": 0, "near_distinct": 0}
+    for game_dir in game_dirs:
+        checkpoint = read_checkpoint(game_dir, checkpoint_dir)
+        relationships += checkpoint["relationships"]
+        for name in totals:
+            totals[name] += checkpoint["dedup"][name]
+    for idx, rel in enumerate(relationships):
+        rel["idx"] = idx
+    totals["duplicate_ratio"] = 1.0 - totals["near_distinct"] / totals["messages"] if totals["messages"] else 0.0
+    return relationships, totals
+
+def _print_game(game_dir, nrels, stats, seconds):
+    print("  |->", game_dir, "|", nrels, "relationship(s) in %.1fs" % seconds, "|", dedup.format_stats(stats))
+
+def ingest(game_dirs, out_path, checkpoint_dir=CHECKPOINT_DIR, workers=None, min_seasons=inference.DEFAULT_WINDOW, near_duplicates=None):
+    """
+    Ingests every given game directory that isn't checkpointed yet (in `workers` worker processes, one per
+    CPU by default) and writes all of their relationships to out_path. Returns (the number of relationships,
+    the dedup stats of all the games).
+    """
+    if len(set(os.path.basename(os.path.normpath(d)) for d in game_dirs)) != len(game_dirs):
+        raise ValueError("Every game directory needs a different name, since that is what their checkpoints are named after.")
+    settings = {"min_seasons": min_seasons, "near_duplicates": near_duplicates}
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    todo = [d for d in game_dirs if not is_up_to_date(d, checkpoint_dir, settings)]
+    print("Ingesting", len(todo), "game(s),", len(game_dirs) - len(todo), "already checkpointed...")
+    workers = min(workers if workers else os.cpu_count(), max(len(todo), 1))
+    if workers == 1:
+        for game_dir in todo:
+            _print_game(*_ingest_and_checkpoint(game_dir, checkpoint_dir, settings))
+    elif todo:
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = [pool.submit(_ingest_and_checkpoint, game_dir, checkpoint_dir, settings) for game_dir in todo]
+            for future in concurrent.futures.as_completed(futures):
+                _print_game(*future.result())
+
+    relationships, stats = merge_checkpoints(game_dirs, checkpoint_dir)
+    tmp = out_path + ".tmp" + str(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(relationships, f)
+    os.replace(tmp, out_path)
+    return len(relationships), stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Turns raw games into training data in the diplomacy_data.json format.")
+    parser.add_argument("game_dirs", nargs="+", metavar="game_dir", help="The game directories (like mygame/).")
+    parser.add_argument("-o", "--out", required=True, help="The JSON file to write the relationships to.")
+    parser.add_argument("-c", "--checkpoint-dir", default=CHECKPOINT_DIR, help="Where the per game checkpoints are kept. Default: %(default)s")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="The number of worker processes. Default: one per CPU")
+    parser.add_argument("--min-seasons", type=int, default=inference.DEFAULT_WINDOW,
+                        help="Leave out pairs that talked in fewer seasons than this. Default: %(default)s")
+    parser.add_argument("--near-duplicates", type=float, nargs="?", const=dedup.DEFAULT_THRESHOLD, default=None, metavar="SIMILARITY",
+                        help="Also analyze near duplicate messages only once: those at least this similar (%(const)s if not given). Default: exact duplicates only")
+    args = parser.parse_args()
+
+    start = time.time()
+    nrels, stats = ingest(args.game_dirs, args.out, args.checkpoint_dir, args.workers, args.min_seasons, args.near_duplicates)
+    print("Wrote", nrels, "relationships from", len(args.game_dirs), "game(s) to", args.out, "in %.1fs" % (time.time() - start))
+    print("  |->", dedup.format_stats(stats))
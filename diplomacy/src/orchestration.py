@@ -0,0 +1,213 @@
+"""
+This is a front end module for training the whole model zoo at once.
+
+The dataset is built once, written to disk as numpy arrays, and memory mapped by
+a pool of worker processes, each of which trains and cross validates one model.
+All of the models are cross validated on the same cached folds (see folds.py).
+The models are trained concurrently, so the total wall time is roughly that of
+the slowest model rather than the sum of all of them. The MLP is only cross
+validated when asked to (--mlp-cv), since that means fitting it once per fold.
+
+Example:
+
+python3 orchestration.py --models mlp knn tree forest svm --cpus 4 --window 3
+
+which saves the models to the directory inference uses for that window (models/ for the
+default window of three seasons, models/window<N>/ otherwise; see artifacts.get_model_dir).
+
+"""
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+# Longest running first, so that the slow models start as early as possible
+ALL_MODELS = ["mlp", "svm", "forest", "logregr", "knn", "tree"]
+DEFAULT_MODELS = ["mlp", "knn", "tree", "forest", "svm"]
+SUMMARY_COLUMNS = ["model", "cv_mean", "cv_std", "accuracy", "precision", "recall", "fscore",
+                   "fit_wall_s", "fit_cpu_s", "total_wall_s", "total_cpu_s"]
+THREAD_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+def _cpu_time():
+    """
+    Returns the CPU time (user + system) used so far by this process (all of its threads) and its finished children.
+    Everything a worker does runs in threads of its own process, so this covers all of it.
+    """
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def build_dataset(workdir, path_to_data=None, window=3, cv=5):
+    """
+    Builds the (upsampled, shuffled) training set and the validation set once and saves
+    them to disk so that they can be memory mapped by the workers. The training set
+    goes into the shared fold cache (see folds.py) along with its cross validation folds.
+
+    Returns a dict of array name -> path, plus "folds" -> path to the fold cache.
+    """
+    import folds
+    import numpy as np
+    import training
+
+    X_train, y_train = training._get_xy(path_to_data, binary=True, window=window)
+    paths = {"folds": folds.FoldCache.create(X_train, y_train, n_splits=max(cv, 2))}
+    for name, array in (("X_val", training.X_validation_set), ("y_val", training.Y_validation_set)):
+        paths[name] = os.path.join(workdir, name + ".npy")
+        np.save(paths[name], np.ascontiguousarray(array))
+    return paths
+
+def _cross_validate_mlp(cache, X_val, y_val, workdir):
+    """
+    Returns the accuracy of a fresh MLP fit (see training.fit_mlp, which stops early and keeps to the time budget)
+    on each of the cached folds. The validation set decides when to stop, so each fold's test set is only scored.
+    """
+    import numpy as np
+    import training
+
+    scores = []
+    for i, (X_train, y_train, X_test, y_test) in enumerate(cache):
+        path = os.path.join(workdir, "mlp_fold" + str(i) + ".hdf5")
+        model = training.fit_mlp(training.make_mlp(X_train.shape[1]), X_train, y_train, X_val, y_val, path, verbose=0)
+        scores.append(np.mean((np.ravel(model.predict(X_test)) > 0.5).astype(int) == y_test))
+    return np.array(scores)
+
+def _train_one(name, array_paths, save_dir, cv, n_jobs, mlp_cv=False):
+    """
+    Trains, cross validates, evaluates and saves a single model. Runs inside a worker process.
+    The sklearn models' folds run in n_jobs threads; the MLP's, if mlp_cv is True, one after the other.
+
+    Returns a dict with one entry per column in SUMMARY_COLUMNS.
+    """
+    start_wall, start_cpu = time.time(), _cpu_time()
+    import folds
+    import numpy as np
+    import training
+    from sklearn.base import clone
+    from sklearn.externals import joblib
+    from sklearn.metrics import accuracy_score, precision_recall_fscore_support
+
+    cache = folds.FoldCache.open(array_paths["folds"])
+    X_train, y_train = cache.X, cache.y
+    X_val, y_val = [np.load(array_paths[a], mmap_mode='r') for a in ("X_val", "y_val")]
+
+    fit_wall, fit_cpu = time.time(), _cpu_time()
+    if name == "mlp":
+        path = os.path.join(save_dir, "mlp.hdf5")
+        clf = training.fit_mlp(training.make_mlp(X_train.shape[1]), X_train, y_train, X_val, y_val, path, verbose=0)
+    else:
+        path = os.path.join(save_dir, name + ".model")
+        estimator = training.SKLEARN_MODEL_MAKERS[name]()
+        clf = clone(estimator).fit(X_train, y_train)
+        joblib.dump(clf, path)
+    fit_wall, fit_cpu = time.time() - fit_wall, _cpu_time() - fit_cpu
+
+    if cv <= 1 or (name == "mlp" and not mlp_cv):
+        scores = np.array([np.nan])
+    elif name == "mlp":
+        scores = _cross_validate_mlp(cache, X_val, y_val, os.path.dirname(array_paths["X_val"]))
+    else:
+        # Threads rather than joblib's worker processes, which outlive the folds (so their CPU time is never counted)
+        scores = folds.cross_val_score(estimator, cache, n_jobs=n_jobs, backend="threading")
+
+    y_pred = np.ravel(clf.predict(X_val))
+    if name == "mlp":
+        y_pred = (y_pred > 0.5).astype(int)
+    precision, recall, fscore, _support = precision_recall_fscore_support(y_val, y_pred, average='binary')
+
+    return {
+                "model":        name,
+                "cv_mean":      float(np.mean(scores)),
+                "cv_std":       float(np.std(scores)),
+                "accuracy":     accuracy_score(y_val, y_pred),
+                "precision":    precision,
+                "recall":       recall,
+                "fscore":       fscore,
+                "fit_wall_s":   fit_wall,
+                "fit_cpu_s":    fit_cpu,
+                "total_wall_s": time.time() - start_wall,
+                "total_cpu_s":  _cpu_time() - start_cpu,
+           }
+
+def format_summary(rows):
+    """
+    Returns the given result rows as a tab separated table (with a header line).
+    """
+    lines = ["\t".join(SUMMARY_COLUMNS)]
+    for row in rows:
+        lines.append("\t".join(row[c] if c == "model" else "%.3f" % row[c] for c in SUMMARY_COLUMNS))
+    return os.linesep.join(lines) + os.linesep
+
+def train_all(models=DEFAULT_MODELS, cpus=None, save_dir=None, path_to_data=None, window=3, cv=5, workdir=None, mlp_cv=False):
+    """
+    Trains and cross validates the given models concurrently, using at most `cpus` CPUs in total.
+    The MLP is only cross validated if mlp_cv is True.
+
+    The models are saved to save_dir, by default the directory inference uses for the window length. A ValueError
+    is raised if inference uses save_dir for another window length (see artifacts.check_model_dir).
+
+    The dataset is written to workdir, which is a temporary directory (removed afterwards) if none is given.
+
+    Returns a list of result rows (see SUMMARY_COLUMNS), in the order the models were given.
+    """
+    import artifacts
+
+    save_dir = save_dir if save_dir else artifacts.get_model_dir(window)
+    artifacts.check_model_dir(save_dir, window)
+    cpus = cpus if cpus else os.cpu_count()
+    nworkers = max(1, min(cpus, len(models)))
+    threads_per_model = max(1, cpus // nworkers)
+    os.makedirs(save_dir, exist_ok=True)
+    own_workdir = not workdir
+    workdir = workdir if workdir else tempfile.mkdtemp(prefix="diplomacy_zoo_")
+    old_env = {var: os.environ.get(var) for var in THREAD_VARS}
+    try:
+        print("Building the dataset once...")
+        array_paths = build_dataset(workdir, path_to_data, window, cv)
+
+        # Workers are fresh (spawned) interpreters, so they pick up these limits before importing numpy or TF
+        for var in THREAD_VARS:
+            os.environ[var] = str(threads_per_model)
+
+        print("Training", len(models), "models with", nworkers, "workers and", threads_per_model, "thread(s) each...")
+        ordered = sorted(models, key=ALL_MODELS.index)
+        results = {}
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=nworkers, mp_context=context) as pool:
+            futures = {pool.submit(_train_one, name, array_paths, save_dir, cv, threads_per_model, mlp_cv): name for name in ordered}
+            for future in concurrent.futures.as_completed(futures):
+                row = future.result()
+                print("  |-> Finished", row["model"], "in %.1fs" % row["total_wall_s"])
+                results[row["model"]] = row
+        return [results[name] for name in models]
+    finally:
+        for var, value in old_env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
+        if own_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trains and cross validates the betrayal models concurrently.")
+    parser.add_argument("-m", "--models", nargs="+", choices=ALL_MODELS, default=DEFAULT_MODELS, help="The models to train. Default: %(default)s")
+    parser.add_argument("-c", "--cpus", type=int, default=None, help="The total number of CPUs to use. Default: all of them")
+    parser.add_argument("-s", "--save-dir", default=None, help="Where to save the trained models. Default: the window's models directory (see inference.get_model_dir)")
+    parser.add_argument("-d", "--data", default=None, help="Path to the diplomacy_data.json dataset.")
+    parser.add_argument("-w", "--window", type=int, default=3, help="The number of seasons per feature vector. Default: %(default)s")
+    parser.add_argument("--cv", type=int, default=5, help="The number of cross validation folds (0 to skip). Default: %(default)s")
+    parser.add_argument("--mlp-cv", action="store_true", help="Cross validate the MLP too, which fits it once more per fold.")
+    parser.add_argument("--workdir", default=None, help="Where to put the memory mapped dataset. Default: a temporary directory")
+    parser.add_argument("--summary", default="training_summary.tsv", help="Where to write the summary table. Default: %(default)s")
+    args = parser.parse_args()
+
+    start = time.time()
+    rows = train_all(args.models, args.cpus, args.save_dir, args.data, args.window, args.cv, args.workdir, args.mlp_cv)
+    table = format_summary(rows)
+    with open(args.summary, 'w') as f:
+        f.write(table)
+    print("")
+    print(table)
+    print("Total wall time: %.1fs (sum of per-model wall times: %.1fs)" % (time.time() - start, sum(r["total_wall_s"] for r in rows)))
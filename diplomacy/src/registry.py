@@ -0,0 +1,276 @@
+"""
+This module provides a process-wide registry of the loaded betrayal models.
+
+Loading the models is by far the most expensive part of a single prediction (five files
+read from disk, and possibly a Keras graph built), so the registry loads each model once
+and hands out the same objects to every caller, from any thread. Before handing them out
+it checks (at most every `check_interval` seconds) whether a model's file has changed on
+disk: if its modification time has changed and its contents hash to something new, the
+model is reloaded. A model from a NumPy bundle is watched along with the original model file
+it was exported from, so retraining the original reloads it too (from the original, until
+the bundle is exported again; see get_sources()).
+
+The registry also records how long each model took to load and roughly how much memory
+it takes up, see ModelRegistry.stats().
+
+Usage:
+
+reg = registry.ModelRegistry(inference.Ensemble)
+models = reg.get_models("models")   # [(name, model), ..., ("Ensemble", ensemble)]
+"""
+import artifacts
+import functools
+import numpy as np
+import os
+import threading
+import time
+
+DEFAULT_CHECK_INTERVAL = 1.0
+STATS_COLUMNS = ["name", "path", "loads", "load_s", "megabytes", "sha1"]
+
+def footprint(obj, _seen=None):
+    """
+    Returns an estimate of the number of bytes taken up by the arrays that make up the given model.
+
+    Works for the NumPy predictors, scikit-learn estimators (including the trees inside them) and Keras models.
+    """
+    _seen = set() if _seen is None else _seen
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if hasattr(obj, "get_weights") and hasattr(obj, "layers"):
+        # A Keras model
+        return sum(w.nbytes for w in obj.get_weights())
+    if isinstance(obj, dict):
+        return sum(footprint(v, _seen) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(footprint(v, _seen) for v in obj)
+    if hasattr(obj, "__dict__"):
+        return footprint(vars(obj), _seen)
+    if hasattr(obj, "__getstate__"):
+        # E.g., scikit-learn's Tree, which is a Cython object without a __dict__
+        state = obj.__getstate__()
+        return footprint(state, _seen) if isinstance(state, dict) else 0
+    return 0
+
+class _Entry:
+    """
+    One model in the registry, along with where it came from and what it cost to load.
+    path is the file the model is loaded from, and source the original model file it was exported from
+    (the same file, unless the model comes from a bundle). Both are watched for changes.
+    """
+    def __init__(self, name, path, loader, source=None):
+        self.name = name
+        self.path = path
+        self.loader = loader
+        self.files = None
+        self.watch(source)
+        self.model = None
+        self.mtimes = None
+        self.sha1s = None
+        self.loads = 0
+        self.load_seconds = None
+        self.nbytes = None
+
+    @property
+    def sha1(self):
+        return self.sha1s[0] if self.sha1s else None
+
+    def watch(self, source):
+        """
+        Sets the files watched for changes: the model's own file, and its source if that is another file that exists.
+        """
+        self.files = [self.path] if source is None or source == self.path or not os.path.exists(source) else [self.path, source]
+
+    def _file_states(self):
+        """
+        Returns the modification times of the model's files, None for any that is missing.
+        """
+        return [_mtime(f) for f in self.files]
+
+    def snapshot(self):
+        """
+        Records the current state of the model's files without loading it, e.g., after a failed reload,
+        so that it is only tried again once the files change again.
+        """
+        self.mtimes = self._file_states()
+        self.sha1s = [_sha1(f) for f in self.files]
+
+    def load(self):
+        """
+        (Re)loads the model and records the state of its files at the time.
+        """
+        start = time.time()
+        mtimes = self._file_states()
+        self.model = self.loader()
+        self.load_seconds = time.time() - start
+        self.mtimes = mtimes
+        self.sha1s = [_sha1(f) for f in self.files]
+        self.nbytes = footprint(self.model)
+        self.loads += 1
+        print("  |-> Loaded", self.name, "from", self.path, "in %.2fs" % self.load_seconds)
+
+    def is_stale(self):
+        """
+        Returns whether any of the model's files has been changed (or removed) since it was loaded. Files are only
+        hashed when their modification time has changed, so merely touching a file doesn't cause a reload.
+        """
+        for i, f in enumerate(self.files):
+            mtime = _mtime(f)
+            if mtime == self.mtimes[i]:
+                continue
+            if _sha1(f) != self.sha1s[i]:
+                return True
+            self.mtimes[i] = mtime
+        return False
+
+def _mtime(path):
+    """
+    Returns the modification time of the file at the given path, or None if it doesn't exist (anymore).
+    """
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def _sha1(path):
+    """
+    Returns the SHA-1 of the file at the given path, or None if it doesn't exist (anymore).
+    """
+    try:
+        return artifacts.file_sha1(path)
+    except OSError:
+        return None
+
+def _original_source(model_dir, name, kind, filename):
+    path = os.path.join(model_dir, filename)
+    return (name, path, functools.partial(artifacts.load_original_model, path, kind), path)
+
+def get_sources(model_dir):
+    """
+    Returns a list of (name, path, loader, source) for the models in the given directory: the NumPy bundle's
+    predictors if the models have been exported (see artifacts.py), otherwise the original models. source is the
+    original model file each one comes from. A model whose original has changed since the bundle was exported
+    (e.g., it was retrained) is loaded from the original, until the bundle is exported again.
+    """
+    bundle_dir = os.path.join(model_dir, artifacts.BUNDLE_DIRNAME)
+    if not artifacts.has_bundle(bundle_dir):
+        return [_original_source(model_dir, name, kind, filename) for name, kind, filename in artifacts.MODEL_SOURCES]
+    sources = []
+    for entry in artifacts.read_manifest(bundle_dir)["models"]:
+        if artifacts.is_up_to_date(entry, model_dir):
+            sources.append((entry["name"], os.path.join(bundle_dir, entry["file"]), functools.partial(artifacts.load_bundle_entry, bundle_dir, entry),
+                            os.path.join(model_dir, entry["source"])))
+        else:
+            sources.append(_original_source(model_dir, entry["name"], entry["type"], entry["source"]))
+    return sources
+
+class ModelRegistry:
+    """
+    A thread safe cache of the models in each model directory, shared by everything in the process.
+
+    make_ensemble(models, names), if given, builds the ensemble that is appended to each directory's models.
+    It is only rebuilt when one of its members is reloaded.
+    """
+    def __init__(self, make_ensemble=None, check_interval=DEFAULT_CHECK_INTERVAL):
+        self.make_ensemble = make_ensemble
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        # model_dir -> (time of the last check, [_Entry], [(name, model)])
+        self._dirs = {}
+
+    def get_models(self, model_dir):
+        """
+        Returns the list of (name, model) for the given directory, loading or reloading whatever is needed.
+        """
+        cached = self._dirs.get(model_dir)
+        if cached is not None and time.time() - cached[0] < self.check_interval:
+            return list(cached[2])
+
+        with self._lock:
+            cached = self._dirs.get(model_dir)
+            if cached is not None and time.time() - cached[0] < self.check_interval:
+                return list(cached[2])
+
+            old_entries = {e.path: e for e in cached[1]} if cached is not None else {}
+            entries = []
+            changed = cached is None
+            for name, path, loader, source in get_sources(model_dir):
+                entry = old_entries.get(path)
+                if entry is None:
+                    entry = _Entry(name, path, loader, source)
+                    entry.load()
+                    changed = True
+                elif entry.is_stale():
+                    # The sources are looked up again on every check, so this is whichever source is there now
+                    entry.loader = loader
+                    entry.watch(source)
+                    try:
+                        entry.load()
+                        changed = True
+                    except OSError as e:
+                        print("  |-> Could not reload", name, "from", path, "(" + str(e) + "). Keeping the one that is loaded.")
+                        entry.snapshot()
+                entries.append(entry)
+            changed = changed or len(entries) != len(old_entries)
+
+            models = self._with_ensemble(entries) if changed else cached[2]
+            self._dirs[model_dir] = (time.time(), entries, models)
+            return list(models)
+
+    def _with_ensemble(self, entries):
+        """
+        Returns the list of (name, model) for the given entries, with the ensemble of them appended.
+        """
+        models = [(e.name, e.model) for e in entries]
+        if self.make_ensemble is not None:
+            models.append(("Ensemble", self.make_ensemble([m[1] for m in models], [m[0] for m in models])))
+        return models
+
+    def set_ensemble_maker(self, make_ensemble):
+        """
+        Replaces the function that builds the ensembles, and rebuilds the ensembles of the loaded models with it.
+        """
+        with self._lock:
+            self.make_ensemble = make_ensemble
+            for model_dir, (checked, entries, _models) in list(self._dirs.items()):
+                self._dirs[model_dir] = (checked, entries, self._with_ensemble(entries))
+
+    def preload(self, model_dirs):
+        """
+        Loads the models in each of the given directories, so that the first prediction doesn't pay for it.
+        """
+        for model_dir in model_dirs:
+            self.get_models(model_dir)
+
+    def clear(self):
+        """
+        Forgets every loaded model, so that they are all loaded again the next time they are asked for.
+        """
+        with self._lock:
+            self._dirs = {}
+
+    def stats(self):
+        """
+        Returns a list with one dict per loaded model with the columns in STATS_COLUMNS.
+        """
+        with self._lock:
+            return [{
+                        "name":      e.name,
+                        "path":      e.path,
+                        "loads":     e.loads,
+                        "load_s":    e.load_seconds,
+                        "megabytes": e.nbytes / 2**20,
+                        "sha1":      e.sha1,
+                    } for _t, entries, _models in self._dirs.values() for e in entries]
+
+def format_stats(rows):
+    """
+    Returns the given stats rows as a tab separated table (with a header line).
+    """
+    lines = ["\t".join(STATS_COLUMNS)]
+    for row in rows:
+        lines.append("\t".join("%.3f" % row[c] if isinstance(row[c], float) else str(row[c]) for c in STATS_COLUMNS))
+    return os.linesep.join(lines) + os.linesep
@@ -0,0 +1,114 @@
+"""
+Benchmarks gameparser.py's conversation grouping on a synthetic game.
+
+The synthetic game has the seven countries sending each other messages over a number of
+years, with a game history to match. The messages are written to a dump file and read back
+with gameparser.iter_messages just like real ones are, and are then grouped into conversations.
+For the smaller sizes, the result is checked against the old way of grouping them (every
+combination of two messages, then every combination of two of those), which is also timed.
+
+Usage:
+python3 benchmark_gameparser.py --sizes 1000 10000 20000 --compare-up-to 1000
+"""
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+import gameparser
+
+COUNTRIES = ["AUSTRIA", "ENGLAND", "FRANCE", "GERMANY", "ITALY", "RUSSIA", "TURKEY"]
+
+def make_game(nmessages, nyears=10, seed=12345):
+    """
+    Returns (path to a message dump, path to a game history file) for a synthetic game.
+    """
+    rng = random.Random(seed)
+    seasons = [(season, 1901 + y) for y in range(nyears) for season in ("Spring", "Fall")]
+    fd, timepath = tempfile.mkstemp(suffix=".txt", prefix="gamehistory_")
+    with os.fdopen(fd, 'w') as f:
+        for season, year in seasons:
+            f.write(season + " " + str(year) + " Orders ends May 01 2017 16:45 PST" + os.linesep)
+            f.write(season + " " + str(year) + " Retreat ends May 01 2017 17:45 PST" + os.linesep)
+
+    fd, dumppath = tempfile.mkstemp(suffix=".txt", prefix="messages_")
+    dump = os.fdopen(fd, 'w')
+    for i in range(nmessages):
+        season, year = rng.choice(seasons)
+        sender, recipient = rng.sample(COUNTRIES, 2)
+        hhmm = "%02d:%02d" % (rng.randrange(24), rng.randrange(60))
+        lines = [
+                    "From: " + sender,
+                    "Date: May 01 2017 " + hhmm + " (GMT-8) " + season + " " + str(year) + " ",
+                    "CC: " + recipient + " ",
+                    "",
+                    "Message number " + str(i) + " about " + rng.choice(COUNTRIES).title() + ".",
+                ]
+        if i:
+            dump.write(gameparser.SEPARATOR + "=======" + os.linesep)
+        dump.write(os.linesep.join(lines) + os.linesep)
+    dump.close()
+    return dumppath, timepath
+
+def quadratic_group_conversations(msgs):
+    """
+    The way gameparser.py used to group messages into conversations, for comparison.
+    """
+    pair_maybe_conversation = lambda a, b: a.year == b.year and a.season == b.season
+    combos = (pair for pair in itertools.combinations(msgs, 2) if pair_maybe_conversation(*pair))
+    pair_is_to_each_other = lambda a, b: set((a.to, a.from_)) == set((b.to, b.from_))
+    conversation_pairs = [(a, b) for a, b in combos if pair_is_to_each_other(a, b)]
+
+    def countries_are_same(cp, other):
+        return set([cp[0].to, cp[0].from_]) == set([other[0].to, other[0].from_])
+
+    conversations = {}
+    for cp in conversation_pairs:
+        for other in conversation_pairs:
+            if cp is not other and cp[0].year == other[0].year and cp[0].season == other[0].season and countries_are_same(cp, other):
+                key = gameparser.make_key(cp[0])
+                to_add = [cp[0], cp[1], other[0], other[1]]
+                try:
+                    conversations[key] += to_add
+                except KeyError:
+                    conversations[key] = to_add
+    return [list(set([msg for msg in v])) for _k, v in conversations.items()]
+
+def _as_comparable(conversations):
+    """
+    Returns the given conversations in a form that doesn't depend on the order of anything.
+    """
+    return {gameparser.make_key(c[0]): frozenset(gameparser._identity(m) for m in c) for c in conversations}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks gameparser.py's conversation grouping on synthetic games.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 20000], help="Numbers of messages. Default: %(default)s")
+    parser.add_argument("--compare-up-to", type=int, default=1000,
+                        help="Also run (and check against) the old grouping for sizes up to this. Default: %(default)s")
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        dumppath, timepath = make_game(n)
+        try:
+            start = time.time()
+            timelist = gameparser.TimeList(timepath)
+            msgs = list(gameparser.iter_messages([dumppath], timelist))
+            parse_s = time.time() - start
+        finally:
+            os.remove(dumppath)
+            os.remove(timepath)
+
+        start = time.time()
+        conversations = gameparser.group_conversations(msgs)
+        group_s = time.time() - start
+        print("%6d messages | parse: %.3fs | group: %.3fs | conversations: %d" % (n, parse_s, group_s, len(conversations)))
+
+        if n <= args.compare_up_to:
+            start = time.time()
+            old = quadratic_group_conversations(msgs)
+            old_s = time.time() - start
+            same = _as_comparable(old) == _as_comparable(conversations)
+            print("       old grouping: %.3fs (%.0fx slower) | same conversations: %s" % (old_s, old_s / max(group_s, 1e-9), same))
+            if not same:
+                exit(1)
@@ -8,37 +8,47 @@ It also takes a file that is just the playdiplomacy gamehistory page saved.
 The output of this script is a .yml file for each combination of players who
 communicated with one another per season over the course of the whole game.
 """
+import collections
 from datetime import datetime
-import itertools
 import os
 import re
 import sys
 
+# Messages are separated by a line of (at least) this
+SEPARATOR = "============="
+
+def to_minutes(time):
+    """
+    Returns the given time of day (a datetime or an "HH:MM" string) as the number of minutes since midnight.
+    """
+    if isinstance(time, str):
+        hours, minutes = time.split(":")
+        return int(hours) * 60 + int(minutes)
+    return time.hour * 60 + time.minute
+
 class Time:
     def __init__(self, line):
-        self.season, self.year, self.phase, _,  _month, _day, _year, self.time, _tz = line.strip().split(" ")
+        self.season, year, self.phase, _,  _month, _day, _year, self.time, _tz = line.strip().split(" ")
+        self.year = int(year)
+        self.minutes = to_minutes(self.time)
         self.time = datetime.strptime(self.time, "%H:%M")
 
     def __eq__(self, other):
-        for name, value in self.__dict__.items():
-            print(name, ":", value)
-
-            if hasattr(other, name):
-                if value != getattr(other, name):
-                    return False
-            else:
-                return False
-        return True
+        return isinstance(other, Time) and self.__dict__ == other.__dict__
 
 class TimeList:
     def __init__(self, path):
         with open(path, 'r') as f:
             self.times = [Time(line) for line in f if line.strip() and line.strip() != "Winter 1900" and line.strip() != "Fall 1905 Retreat"]
+        # (season, year, phase) -> the minute that phase ended in
+        self.deadlines = {}
+        for t in self.times:
+            self.deadlines.setdefault((t.season, t.year, t.phase), t.minutes)
 
     def after_deadline(self, season, year, time, msg):
         """
         Takes:
-        Fall/Spring, 19xx, datetime, msg
+        Fall/Spring, 19xx, datetime (or minutes since midnight), msg
 
         and returns whether the datetime is after the deadline for that phase.
 
@@ -46,68 +56,35 @@ class TimeList:
         Fall 1904 16:53 -> True
         The reason this returns True is because the Fall 1904 Orders phase ended at 16:45; we are actually into the build phase.
         """
-        for t in self.times:
-            if t.season == season and t.year == year and t.phase == "Orders":
-                if time < t.time:
-                    return False
-                elif time == t.time:
-                    # Message was sent in the minute that the phase ended. If the message is very short, this may have been when it was written.
-                    # Otherwise, the message was probably written and then sent right as the phase ended, and really belongs in the phase.
-                    if len(msg) < 50:
-                        return True
-                    else:
-                        return False
-                else:
-                    return True
-
-        def __eq__(self, other):
-            for name, value in self.__dict__.items():
-                print(name, ":", value)
-
-                if hasattr(other, name):
-                    if value != getattr(other, name):
-                        return False
-                else:
-                    return False
-            return True
+        deadline = self.deadlines.get((season, int(year), "Orders"))
+        if deadline is None:
+            return False
+        minutes = time if isinstance(time, int) else to_minutes(time)
+        if minutes == deadline:
+            # Message was sent in the minute that the phase ended. If the message is very short, this may have been when it was written.
+            # Otherwise, the message was probably written and then sent right as the phase ended, and really belongs in the phase.
+            return len(msg) < 50
+        return minutes > deadline
 
 class Message:
-    def __init__(self, txt, timelist):
-        txt = txt.split(os.linesep)
-        from_line = next((line for line in txt if line.lower().startswith("from:")))
-        date_line = next((line for line in txt if line.lower().startswith("date:")))
-        to_line = next((line for line in txt if line.lower().startswith("cc:")))
-        to_line_index = [i for i, line in enumerate(txt) if line.lower().startswith("cc:")][0]
-        msg_body = os.linesep.join([line.strip() for line in txt[(to_line_index + 1):] if line.strip() and not line.strip().startswith("Re:")])
-
-        self.from_ = from_line.split("From:")[1].strip().lower().title()
-
-        date = date_line.split("Date:")[1].strip()
-        self.year = int(date.split(" ")[-1])
-        self.season = date.split(" ")[-2]
-
-        self.to = to_line.split("CC:")[1].strip().lower().title()
-        self.message = msg_body.strip()
-        self.time = datetime.strptime(date_line.split(" ")[4], "%H:%M")
-
-        # Change season if after deadline
-        if timelist.after_deadline(self.season, self.year, self.time, self.message):
-            self.year = self.year + 1 if self.season == "Fall" else self.year
-            self.season = "Fall" if self.season == "Spring" else "Spring"
+    """
+    One message, reduced to what the conversations are made of. Use parse_message() or iter_messages() to read them.
+    """
+    __slots__ = ("from_", "to", "year", "season", "time", "message")
+
+    def __init__(self, from_, to, year, season, time, message):
+        self.from_ = from_
+        self.to = to
+        self.year = year
+        self.season = season
+        self.time = time
+        self.message = message
 
     def __eq__(self, other):
-        for name, value in self.__dict__.items():
-            print(name, ":", value)
-
-            if hasattr(other, name):
-                if value != getattr(other, name):
-                    return False
-            else:
-                return False
-        return True
+        return isinstance(other, Message) and _identity(self) == _identity(other)
 
     def __hash__(self):
-        return hash(frozenset(self.__dict__.items()))
+        return hash(_identity(self))
 
     def __repr__(self):
         return str(self)
@@ -122,16 +99,142 @@ class Message:
         return s
 
 
+def iter_message_texts(path):
+    """
+    Yields the lines of each message in the given playdiplomacy dump, one message at a time.
+    The file is split on the "=====" separators as it is read, so only one message is ever held in memory.
+    """
+    with open(path, 'r') as f:
+        lines = []
+        for line in f:
+            if line.startswith(SEPARATOR):
+                yield lines
+                lines = []
+            else:
+                lines.append(line.rstrip("\n"))
+        yield lines
+
+def parse_message(lines, timelist):
+    """
+    Returns the Message in the given lines (from iter_message_texts), or None if they aren't a message.
+    The From:, Date: and CC: headers and the body (everything after CC:) are picked out in a single pass.
+    """
+    from_line = date_line = to_line = None
+    body = []
+    for line in lines:
+        if to_line is not None:
+            stripped = line.strip()
+            if stripped and not stripped.startswith("Re:"):
+                body.append(stripped)
+        header = line[:5].lower()
+        if from_line is None and header.startswith("from:"):
+            from_line = line
+        elif date_line is None and header.startswith("date:"):
+            date_line = line
+        elif to_line is None and header.startswith("cc:"):
+            to_line = line
+    if from_line is None or date_line is None or to_line is None:
+        return None # Not in the right format
+
+    date = date_line.split("Date:")[1].strip().split(" ")
+    year = int(date[-1])
+    season = date[-2]
+    time = datetime.strptime(date_line.split(" ")[4], "%H:%M")
+    message = os.linesep.join(body)
+
+    # Change season if after deadline
+    if timelist.after_deadline(season, year, time, message):
+        year = year + 1 if season == "Fall" else year
+        season = "Fall" if season == "Spring" else "Spring"
+
+    from_ = from_line.split("From:")[1].strip().lower().title()
+    to = to_line.split("CC:")[1].strip().lower().title()
+    return Message(from_, to, year, season, time, message)
+
+def iter_messages(paths, timelist):
+    """
+    Yields the Messages in the given playdiplomacy dumps, one at a time, skipping anything that isn't a message.
+    """
+    for path in paths:
+        for lines in iter_message_texts(path):
+            msg = parse_message(lines, timelist)
+            if msg is not None:
+                yield msg
+
+def make_key(msg):
+    """
+    Returns the name of the conversation the given message belongs to. E.g., 1901SpringAF
+    """
+    letters = sorted((msg.to[0], msg.from_[0]))
+    return str(msg.year) + msg.season + letters[0] + letters[1]
+
+def _identity(msg):
+    """
+    Returns everything about a message that makes it the same message as another one.
+    """
+    return (msg.from_, msg.to, msg.year, msg.season, msg.time, msg.message)
+
+def group_conversations(msgs):
+    """
+    Lumps the given messages into conversations: the messages between the same two countries in the same season.
+    Returns a list of conversations, each a list of distinct messages in the order they were given.
+
+    This is a single pass over the messages, keyed on (year, season, pair of countries).
+    """
+    groups = collections.OrderedDict()
+    for msg in msgs:
+        groups.setdefault((msg.year, msg.season, frozenset((msg.to, msg.from_))), []).append(msg)
+
+    conversations = collections.OrderedDict()
+    for group in groups.values():
+        # Conversations used to be built by merging pairs of pairs of messages, so it takes
+        # at least three messages for there to be a conversation at all
+        if len(group) < 3:
+            continue
+        conversations.setdefault(make_key(group[0]), []).extend(group)
+
+    deduplicated = []
+    for conversation in conversations.values():
+        seen = set()
+        distinct = []
+        for msg in conversation:
+            if _identity(msg) not in seen:
+                seen.add(_identity(msg))
+                distinct.append(msg)
+        deduplicated.append(distinct)
+    return deduplicated
+
+def season_record(conversation):
+    """
+    Returns the given conversation as a season dict, in the same format as the YAML files yamlize writes.
+    The pair of countries is always in alphabetical order: 'a_to_b' holds the messages from the first of them.
+    """
+    a, b = sorted((conversation[0].from_, conversation[0].to))
+    def direction(from_, to):
+        return {
+                    "from_player":  from_,
+                    "from_country": from_,
+                    "to_player":    to,
+                    "to_country":   to,
+                    "messages":     [m.message for m in conversation if m.from_ == from_ and m.to == to],
+               }
+    return {"year": conversation[0].year, "season": conversation[0].season, "a_to_b": direction(a, b), "b_to_a": direction(b, a)}
+
 def yamlize(conversation, outputdir):
-    path = outputdir + os.sep + str(conversation[0].year) + conversation[0].season + conversation[0].from_[0] + conversation[0].to[0] + ".yml"
+    """
+    Writes the given conversation to a YAML file in outputdir, named after it (see make_key), with the pair of
+    countries in alphabetical order (see season_record).
+    """
+    record = season_record(conversation)
+    path = outputdir + os.sep + make_key(conversation[0]) + ".yml"
 
-    year = str(conversation[0].year)
-    season = str(conversation[0].season)
+    year = str(record["year"])
+    season = str(record["season"])
 
-    a = conversation[0].from_
-    b = conversation[0].to
-    a_to_b = ["\"" + m.message.replace("\"", "\\\"") + "\"" for m in conversation if m.from_ == a and m.to == b]
-    b_to_a = ["\"" + m.message.replace("\"", "\\\"") + "\"" for m in conversation if m.from_ == b and m.to == a]
+    a = record["a_to_b"]["from_player"]
+    b = record["a_to_b"]["to_player"]
+    a_to_b = ["\"" + m.replace("\"", "\\\"") + "\"" for m in record["a_to_b"]["messages"]]
+    b_to_a = ["\"" + m.replace("\"", "\\\"") + "\"" for m in record["b_to_a"]["messages"]]
 
     yaml = "year: " + year + os.linesep
     yaml += "season: " + season + os.linesep
@@ -177,52 +280,10 @@ if __name__ == "__main__":
             filepaths.append(os.path.join(dirpath, name))
     filepaths = [path for path in filepaths if path.endswith(".txt")]
 
-    texts = []
-    for path in filepaths:
-        with open(path, 'r') as f:
-            s = ""
-            for line in f:
-                if line.startswith("============="):
-                    texts.append(s)
-                    s = ""
-                    continue
-                else:
-                    s += line + os.linesep
-            texts.append(s)
-
     timelist = TimeList(timepath)
-    msgs = []
-    for t in texts:
-        try:
-            msgs.append(Message(t, timelist))
-        except StopIteration:
-            pass # This file is not in the right format
-
-    # Lump into conversations
-    pair_maybe_conversation = lambda a, b: a.year == b.year and a.season == b.season
-    combos = (pair for pair in itertools.combinations(msgs, 2) if pair_maybe_conversation(*pair))
-    pair_is_to_each_other = lambda a, b: set((a.to, a.from_)) == set((b.to, b.from_))
-    conversation_pairs = [(a, b) for a, b in combos if pair_is_to_each_other(a, b)]
-    # At this point, you have pairs of messages that belong together. But now you need to group all pairs that are the same into lists
-    def make_key(cp):
-        letters = sorted((cp[0].to[0], cp[0].from_[0]))
-        return str(cp[0].year) + cp[0].season + letters[0] + letters[1] # --> E.g., 1901SpringAF
-
-    def countries_are_same(cp, other):
-        return set([cp[0].to, cp[0].from_]) == set([other[0].to, other[0].from_])
-
-    conversations = {}
-    for cp in conversation_pairs:
-        for other in conversation_pairs:
-            if cp is not other and cp[0].year == other[0].year and cp[0].season == other[0].season and countries_are_same(cp, other):
-                key = make_key(cp)
-                to_add = [cp[0], cp[1], other[0], other[1]]
-                try:
-                    conversations[key] += to_add
-                except KeyError:
-                    conversations[key] = to_add
-
-    conversations = [list(set([msg for msg in v])) for _k, v in conversations.items()]
+    msgs = list(iter_messages(filepaths, timelist))
+
+    conversations = group_conversations(msgs)
 
     outputdir = "gameparser_output"
     if not os.path.exists(outputdir):
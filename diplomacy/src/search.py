@@ -0,0 +1,257 @@
+"""
+This is a front end module for searching the hyperparameters of the betrayal models.
+
+Each model family has a search space (see SEARCH_SPACES). Candidates drawn from it are
+compared with successive halving: every candidate is first evaluated cheaply (on a small
+fraction of each cached fold's training data, or for few epochs in the case of the MLP),
+and only the best 1/eta of them go on to the next, eta times more expensive, rung.
+
+Evaluations run in parallel worker processes on the shared cross validation folds (see
+folds.py). The folds are made from the training set before it is upsampled, and only the
+training side of each fold is upsampled, so that no copy of a betrayal that a candidate
+was trained on is also one that it is tested on. Every finished evaluation is appended to a results file, so an interrupted
+search picks up where it left off when it is run again. The search stops early if it runs
+out of its wall clock or CPU budget. The winner is refit on the whole training set and
+exported to the models directory.
+
+Example:
+
+python3 search.py svm --budget 600 --cpus 4
+
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import time
+
+SEARCH_SPACES = {
+                    "knn":      {"n_neighbors": [1, 3, 5, 7, 9, 15, 25], "weights": ["uniform", "distance"]},
+                    "tree":     {"max_depth": [None, 3, 5, 8, 12, 20], "min_samples_leaf": [1, 2, 5, 10, 20], "criterion": ["gini", "entropy"]},
+                    "forest":   {"n_estimators": [10, 30, 100, 300], "max_depth": [None, 5, 10, 20], "max_features": ["sqrt", "log2", None]},
+                    "svm":      {"C": [0.01, 0.1, 1, 10, 100], "gamma": ["auto", 0.001, 0.01, 0.1, 1]},
+                    "logregr":  {"C": [0.001, 0.01, 0.1, 1, 10, 100], "penalty": ["l1", "l2"]},
+                    "mlp":      {"hidden": [[1024, 256], [512, 128], [256, 64], [128]], "dropout": [0.2, 0.4, 0.5], "batch_size": [20, 64, 128]},
+                }
+SEARCH_RESULTS_DIR = "search_results"
+MLP_MAX_EPOCHS = 200
+
+def _cpu_time():
+    """
+    Returns the CPU time (user + system) used so far by this process and its finished children.
+    """
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+def _key(params, fraction):
+    """
+    Returns the key an evaluation is stored under in the results file.
+    """
+    return json.dumps(params, sort_keys=True) + "@" + "%.6f" % fraction
+
+def get_candidates(family, n_candidates, seed=12345):
+    """
+    Returns up to n_candidates parameter dicts from the given family's search space. The same
+    arguments always give the same candidates, which is what lets a search be resumed.
+    """
+    space = SEARCH_SPACES[family]
+    names = sorted(space.keys())
+    grid = [dict(zip(names, values)) for values in itertools.product(*[space[n] for n in names])]
+    if len(grid) > n_candidates:
+        grid = random.Random(seed).sample(grid, n_candidates)
+    return grid
+
+def get_rungs(n_candidates, eta=3):
+    """
+    Returns the list of training fractions for each rung of successive halving, cheapest first.
+    The last rung always uses all of the training data.
+    """
+    nrungs = max(int(math.log(max(n_candidates, 1), eta) + 1e-9) + 1, 1)
+    return [eta ** -(nrungs - 1 - i) for i in range(nrungs)]
+
+def _score(y_true, y_pred, metric):
+    """
+    Returns the given metric ("accuracy" or "f1") for the given predictions.
+    """
+    from sklearn.metrics import accuracy_score, f1_score
+    return f1_score(y_true, y_pred) if metric == "f1" else accuracy_score(y_true, y_pred)
+
+def _evaluate(family, params, fraction, fold_path, metric):
+    """
+    Evaluates one candidate on every cached fold, training on the given fraction of each fold's training data
+    (or, for the MLP, for that fraction of MLP_MAX_EPOCHS epochs). Runs inside a worker process.
+
+    Returns a result record for the results file.
+    """
+    start_wall, start_cpu = time.time(), _cpu_time()
+    import data
+    import folds
+    import numpy as np
+    import training
+
+    cache = folds.FoldCache.open(fold_path)
+    scores = []
+    for X_train, y_train, X_test, y_test in cache:
+        try:
+            if family == "mlp":
+                epochs = max(int(round(MLP_MAX_EPOCHS * fraction)), 1)
+                model = training.make_mlp(X_train.shape[1], params["hidden"], params["dropout"])
+                model.fit(*data.upsample(X_train, y_train), batch_size=params["batch_size"], epochs=epochs, verbose=0)
+                y_pred = (np.ravel(model.predict(X_test)) > 0.5).astype(int)
+            else:
+                n = max(int(len(y_train) * fraction), 1)
+                clf = training.SKLEARN_MODEL_MAKERS[family]().set_params(**params)
+                y_pred = clf.fit(*data.upsample(X_train[:n], y_train[:n])).predict(X_test)
+            scores.append(_score(y_test, y_pred, metric))
+        except ValueError as e:
+            # E.g., a small fraction of a fold that only has one class in it
+            print("  |-> Could not evaluate", params, "at", fraction, ":", e)
+            scores.append(float("nan"))
+    return {
+                "params":   params,
+                "fraction": fraction,
+                "score":    float(np.mean(scores)),
+                "scores":   [float(s) for s in scores],
+                "wall_s":   time.time() - start_wall,
+                "cpu_s":    _cpu_time() - start_cpu,
+           }
+
+def load_results(path):
+    """
+    Returns the evaluations stored in the given results file as a dict of key -> record.
+    """
+    results = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    results[_key(record["params"], record["fraction"])] = record
+    return results
+
+def successive_halving(family, fold_path, results_path, n_candidates=27, eta=3, budget=None, budget_type="wall", cpus=None, metric="accuracy"):
+    """
+    Runs (or resumes) successive halving over the given family's candidates.
+
+    budget is in seconds of wall clock time or of CPU time (summed over the workers), depending on budget_type.
+    Evaluations already in the results file are not redone, and do not count against the budget.
+
+    Returns the best record from the most expensive rung whose candidates were all evaluated. A rung that the
+    budget cut short only counts if it is the first one, since its few finished candidates aren't necessarily the
+    best of the survivors.
+    """
+    results = load_results(results_path)
+    candidates = get_candidates(family, n_candidates)
+    rungs = get_rungs(len(candidates), eta)
+    start_wall = time.time()
+    spent_cpu = 0.0
+
+    def out_of_budget():
+        if budget is None:
+            return False
+        spent = time.time() - start_wall if budget_type == "wall" else spent_cpu
+        return spent >= budget
+
+    best = None
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=cpus if cpus else os.cpu_count(), mp_context=context) as pool:
+        for rung, fraction in enumerate(rungs):
+            todo = [p for p in candidates if _key(p, fraction) not in results]
+            print("Rung", rung, "| fraction: %.3f" % fraction, "| candidates:", len(candidates), "| already done:", len(candidates) - len(todo))
+            futures = [pool.submit(_evaluate, family, p, fraction, fold_path, metric) for p in todo]
+            for future in concurrent.futures.as_completed(futures):
+                if future.cancelled():
+                    continue
+                record = future.result()
+                spent_cpu += record["cpu_s"]
+                results[_key(record["params"], fraction)] = record
+                with open(results_path, 'a') as f:
+                    f.write(json.dumps(record) + os.linesep)
+                print("  |-> %.4f" % record["score"], record["params"])
+                if out_of_budget():
+                    for pending in futures:
+                        pending.cancel()
+
+            done = [results[_key(p, fraction)] for p in candidates if _key(p, fraction) in results]
+            done.sort(key=lambda r: r["score"] if not math.isnan(r["score"]) else -math.inf, reverse=True)
+            if done and (len(done) == len(candidates) or best is None):
+                best = done[0]
+            if out_of_budget():
+                print("Out of budget after rung", rung)
+                break
+            candidates = [r["params"] for r in done[:max(len(done) // eta, 1)]]
+    return best
+
+def export_model(family, params, fold_path, save_dir, window):
+    """
+    Fits a model of the given family with the given parameters on the whole (upsampled) training set (whose feature vectors
+    are `window` seasons long) and saves it to save_dir under the name the rest of the program expects (e.g.,
+    models/svm.model or models/mlp.hdf5). Raises a ValueError if inference uses save_dir for another window length.
+
+    The parameters are saved next to it as <name>.params.json. Returns the path of the saved model.
+    """
+    import artifacts
+    import data
+    import folds
+    import training
+    from sklearn.externals import joblib
+
+    artifacts.check_model_dir(save_dir, window)
+    cache = folds.FoldCache.open(fold_path)
+    X, y = data.upsample(cache.X, cache.y)
+    os.makedirs(save_dir, exist_ok=True)
+    if family == "mlp":
+        path = os.path.join(save_dir, "mlp.hdf5")
+        model = training.make_mlp(cache.X.shape[1], params["hidden"], params["dropout"])
+        model.fit(X, y, batch_size=params["batch_size"], epochs=MLP_MAX_EPOCHS, verbose=0)
+        model.save(path)
+    else:
+        path = os.path.join(save_dir, family + ".model")
+        clf = training.SKLEARN_MODEL_MAKERS[family]().set_params(**params)
+        joblib.dump(clf.fit(X, y), path)
+    with open(os.path.splitext(path)[0] + ".params.json", 'w') as f:
+        json.dump(params, f, indent=2, sort_keys=True)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Searches the hyperparameters of a betrayal model with successive halving.")
+    parser.add_argument("family", choices=sorted(SEARCH_SPACES.keys()), help="The model family to search.")
+    parser.add_argument("-b", "--budget", type=float, default=None, help="The budget in seconds. Default: no budget")
+    parser.add_argument("--budget-type", choices=["wall", "cpu"], default="wall", help="What the budget measures. Default: %(default)s")
+    parser.add_argument("-n", "--candidates", type=int, default=27, help="The number of candidates to start with. Default: %(default)s")
+    parser.add_argument("--eta", type=int, default=3, help="Keep the best 1/eta candidates at each rung. Default: %(default)s")
+    parser.add_argument("-c", "--cpus", type=int, default=None, help="The number of worker processes. Default: one per CPU")
+    parser.add_argument("--metric", choices=["accuracy", "f1"], default="accuracy", help="What to rank candidates by. Default: %(default)s")
+    parser.add_argument("-d", "--data", default=None, help="Path to the diplomacy_data.json dataset.")
+    parser.add_argument("-w", "--window", type=int, default=3, help="The number of seasons per feature vector. Default: %(default)s")
+    parser.add_argument("-s", "--save-dir", default=None, help="Where to export the winning model. Default: the window's models directory (see inference.get_model_dir)")
+    parser.add_argument("--no-export", action="store_true", help="Don't export the winning model.")
+    args = parser.parse_args()
+
+    import artifacts
+    import folds
+    import training
+
+    save_dir = args.save_dir if args.save_dir else artifacts.get_model_dir(args.window)
+    if not args.no_export:
+        # Before the search rather than after it, so that a wrong directory doesn't waste the search
+        artifacts.check_model_dir(save_dir, args.window)
+    # Upsampled per fold instead (see _evaluate)
+    X_train, y_train = training._get_xy(args.data, binary=True, upsample=False, window=args.window)
+    fold_path = folds.FoldCache.create(X_train, y_train)
+    os.makedirs(SEARCH_RESULTS_DIR, exist_ok=True)
+    fp = folds.FoldCache.open(fold_path).fingerprint[:16]
+    results_path = os.path.join(SEARCH_RESULTS_DIR, args.family + "_" + args.metric + "_" + fp + ".jsonl")
+    print("Results file:", results_path)
+
+    best = successive_halving(args.family, fold_path, results_path, args.candidates, args.eta, args.budget, args.budget_type, args.cpus, args.metric)
+    if best is None:
+        print("Nothing was evaluated.")
+        exit(1)
+    print("Best:", best["params"], "| score: %.4f" % best["score"], "| fraction: %.3f" % best["fraction"])
+    if not args.no_export:
+        print("Exported to", export_model(args.family, best["params"], fold_path, save_dir, args.window))
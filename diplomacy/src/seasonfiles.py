@@ -0,0 +1,109 @@
+"""
+This module reads (and converts) season files.
+
+A season file is either one of the YAML files betrayal.py takes (one season of messages
+between a pair of countries, in the a_to_b/b_to_a format), or a season bundle: a JSON lines
+file with one such season per line, optionally gzipped (.jsonl or .jsonl.gz). Bundles are
+much faster to read than YAML and hold a whole game (or many) in one file, for bulk jobs.
+
+YAML is parsed with LibYAML's C loader when PyYAML was built with it, and with the pure
+Python safe loader otherwise. Many files are read in parallel worker processes.
+
+Example, converting a game directory into a bundle:
+
+python3 seasonfiles.py example_game/*.yml --out example_game.jsonl.gz
+
+"""
+import argparse
+import concurrent.futures
+import gzip
+import json
+import multiprocessing
+import os
+import yaml
+
+# The fastest safe loader this PyYAML has
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YAML_EXTENSIONS = (".yml", ".yaml")
+BUNDLE_EXTENSIONS = (".jsonl", ".jsonl.gz")
+# Below this many files, starting worker processes costs more than it saves
+MIN_FILES_FOR_WORKERS = 64
+
+def _open(path, mode='r', gzipped=None):
+    """
+    Opens the given path as text, through gzip if it ends in .gz (or if gzipped is True).
+    """
+    gzipped = path.endswith(".gz") if gzipped is None else gzipped
+    if gzipped:
+        return gzip.open(path, mode + 't', encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def load_yaml(path):
+    """
+    Returns the season in the given YAML file as a dict.
+    """
+    with open(path) as f:
+        return yaml.load(f, Loader=YAML_LOADER)
+
+def load_bundle(path):
+    """
+    Returns the list of seasons in the given bundle.
+    """
+    with _open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def load_season_file(path):
+    """
+    Returns the list of seasons in the given season file (a YAML file holds exactly one).
+    """
+    if path.endswith(BUNDLE_EXTENSIONS):
+        return load_bundle(path)
+    return [load_yaml(path)]
+
+def is_season_file(path):
+    """
+    Returns whether the given path looks like a season file.
+    """
+    return path.endswith(YAML_EXTENSIONS + BUNDLE_EXTENSIONS)
+
+def load_season_files(paths, workers=None):
+    """
+    Returns the seasons in the given files, in the order of the files. Large numbers of files are read
+    by `workers` worker processes (one per CPU by default); pass workers=1 to read them in this process.
+    """
+    paths = list(paths)
+    workers = workers if workers else os.cpu_count()
+    if workers == 1 or len(paths) < MIN_FILES_FOR_WORKERS:
+        per_file = [load_season_file(path) for path in paths]
+    else:
+        context = multiprocessing.get_context("spawn")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            per_file = list(pool.map(load_season_file, paths, chunksize=max(len(paths) // (4 * workers), 1)))
+    return [season for seasons in per_file for season in seasons]
+
+def write_bundle(seasons, path):
+    """
+    Writes the given seasons to a bundle at path (gzipped if path ends in .gz).
+    """
+    tmp = path + ".tmp" + str(os.getpid())
+    with _open(tmp, 'w', gzipped=path.endswith(".gz")) as f:
+        for season in seasons:
+            f.write(json.dumps(season, sort_keys=True) + "\n")
+    os.replace(tmp, path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts season files (YAML files or bundles) into a single bundle.")
+    parser.add_argument("paths", nargs="+", help="The season files, or directories of them.")
+    parser.add_argument("-o", "--out", required=True, help="The bundle to write (.jsonl, or .jsonl.gz to compress it).")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="The number of worker processes. Default: one per CPU")
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            paths += sorted(os.path.join(path, name) for name in os.listdir(path) if is_season_file(name))
+        else:
+            paths.append(path)
+    seasons = load_season_files(paths, args.workers)
+    write_bundle(seasons, args.out)
+    print("Wrote", len(seasons), "seasons from", len(paths), "files to", args.out)
@@ -0,0 +1,113 @@
+"""
+This module provides the cache that the analyzer keeps its per sentence results in.
+
+Short stock sentences ("Thanks!", "What do you think?", "Sounds good.") come up over and
+over again across games and players, and each one costs a round trip to the CoreNLP server
+(and the politeness model) every time it is analyzed. The cache remembers the results of
+the most recently used sentences (and short messages, which are often a single stock
+sentence), up to a fixed number of them, keyed by the kind of result and the text with its
+whitespace normalized.
+
+Politeness results depend on the politeness model, so they are thrown away whenever a
+different model (by its SHA-1) is loaded. Results that only depend on the text are kept.
+"""
+import collections
+import threading
+
+DEFAULT_MAXSIZE = 20000
+# The kinds of results that depend on the politeness model
+MODEL_KINDS = ("politeness",)
+
+def normalize(text):
+    """
+    Returns the given text with its leading and trailing whitespace removed and all other runs of whitespace
+    collapsed into single spaces, which doesn't change how it is parsed.
+    """
+    return " ".join(text.split())
+
+class SentenceCache:
+    """
+    A thread-safe, bounded, least recently used cache of (kind, sentence) -> result, with hit rate statistics.
+    A maxsize of 0 turns the cache off.
+    """
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self.model_hash = None
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = collections.Counter()
+        self._misses = collections.Counter()
+        self._evictions = 0
+        self._invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, text, compute):
+        """
+        Returns the cached `kind` result for the given text, calling compute(text) to get it (and caching it) if it isn't there.
+        """
+        key = (kind, normalize(text))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits[kind] += 1
+                return self._entries[key]
+            self._misses[kind] += 1
+            model_hash = self.model_hash
+        # Computed outside of the lock, so that other threads aren't held up by a slow sentence
+        result = compute(text)
+        with self._lock:
+            # Don't keep a result of a model that was replaced in the meantime
+            if self.maxsize > 0 and (kind not in MODEL_KINDS or model_hash == self.model_hash):
+                self._entries[key] = result
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return result
+
+    def set_model_hash(self, model_hash):
+        """
+        Records the hash of the politeness model now in use, throwing away the results of the previous one if it changed.
+        """
+        with self._lock:
+            if self.model_hash is not None and model_hash != self.model_hash:
+                for key in [k for k in self._entries if k[0] in MODEL_KINDS]:
+                    del self._entries[key]
+                    self._invalidations += 1
+            self.model_hash = model_hash
+
+    def resize(self, maxsize):
+        """
+        Changes the most results the cache holds, evicting the least recently used ones if it now holds too many.
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns a dict of the cache's size, hits, misses and hit rates (overall and per kind of result).
+        """
+        with self._lock:
+            hits, misses = sum(self._hits.values()), sum(self._misses.values())
+            kinds = sorted(set(self._hits) | set(self._misses))
+            return {
+                        "size":             len(self._entries),
+                        "maxsize":          self.maxsize,
+                        "hits":             hits,
+                        "misses":           misses,
+                        "hit_rate":         hits / (hits + misses) if hits + misses else None,
+                        "evictions":        self._evictions,
+                        "invalidations":    self._invalidations,
+                        "model_hash":       self.model_hash,
+                        "kinds":            {k: {"hits": self._hits[k], "misses": self._misses[k],
+                                                 "hit_rate": self._hits[k] / (self._hits[k] + self._misses[k])} for k in kinds},
+                   }
@@ -0,0 +1,313 @@
+"""
+This is a front end module that serves predictions over HTTP (on a local port or a Unix socket),
+so that other tools can score relationships without paying for a cold start every time.
+
+The models and the NLP clients are loaded once, when the server starts. Requests that come in
+at about the same time are micro-batched: the first one waits up to `batch_window` seconds for
+others, and then all of their windows go to the models in one vectorized batch.
+
+Endpoints:
+
+POST /predict   Body: {"seasons": [season, ...], "window": 3}, each season being a dict in the same
+                format as the YAML files betrayal.py takes, in chronological order.
+                Returns {"predictions": [[model name, 0 or 1], ...]}, like inference.predict(), a 400 if the
+                body isn't valid (see validate_body()), or a 500 if the prediction itself fails.
+GET  /health    Returns {"status": "ok", ...} once the models are loaded.
+GET  /stats     Returns request latency percentiles, batch sizes, the models' load statistics and the
+                analyzer's sentence cache hit rates.
+
+Example:
+
+python3 server.py --port 8642
+curl -d @relationship.json localhost:8642/predict
+
+"""
+import analyzer
+import argparse
+import collections
+import data
+import http.server
+import inference
+import json
+import numpy as np
+import os
+import queue
+import socketserver
+import threading
+import time
+
+DEFAULT_PORT = 8642
+DEFAULT_BATCH_WINDOW = 0.005
+DEFAULT_MAX_BATCH = 256
+# How many of the most recent requests the latency percentiles are computed over
+LATENCY_HISTORY = 10000
+
+class BadRequest(ValueError):
+    """
+    Raised for a /predict request whose body isn't valid, which is answered with a 400 (any other error is a 500).
+    """
+    pass
+
+def validate_body(body, windows):
+    """
+    Returns the (window, seasons) of the given (decoded JSON) /predict body, or raises BadRequest if it isn't
+    of the form documented at the top of this module or asks for a window that isn't one of the given ones.
+    """
+    if not isinstance(body, dict):
+        raise BadRequest("The body must be a JSON object")
+    window = body.get("window", inference.DEFAULT_WINDOW)
+    if isinstance(window, bool) or not isinstance(window, int) or window < 1:
+        raise BadRequest("window must be a positive integer, got " + json.dumps(window))
+    if window not in windows:
+        raise BadRequest("There are no models loaded for a window of " + str(window) + ", only for " + str(windows))
+    seasons = body.get("seasons")
+    if not isinstance(seasons, list):
+        raise BadRequest("seasons must be a list of seasons")
+    if len(seasons) < window:
+        raise BadRequest("Need at least " + str(window) + " seasons for a window of " + str(window) + ", got " + str(len(seasons)))
+    for i, season in enumerate(seasons):
+        where = "seasons[" + str(i) + "]"
+        if not isinstance(season, dict):
+            raise BadRequest(where + " must be an object")
+        if season.get("season") not in ("Spring", "Fall"):
+            raise BadRequest(where + ".season must be \"Spring\" or \"Fall\"")
+        try:
+            int(season.get("year"))
+        except (TypeError, ValueError):
+            raise BadRequest(where + ".year must be a year")
+        for direction in ("a_to_b", "b_to_a"):
+            messages = season.get(direction)
+            if not isinstance(messages, dict):
+                raise BadRequest(where + "." + direction + " must be an object")
+            for key in ("from_country", "to_country"):
+                if not isinstance(messages.get(key), str):
+                    raise BadRequest(where + "." + direction + "." + key + " must be a string")
+            # A one sided season has no messages (null) in one direction
+            if messages.get("messages") is not None and not (isinstance(messages["messages"], list) and all(isinstance(m, str) for m in messages["messages"])):
+                raise BadRequest(where + "." + direction + ".messages must be a list of strings or null")
+    return window, seasons
+
+class _Request:
+    """
+    One relationship waiting for its prediction.
+    """
+    def __init__(self, X, window):
+        self.X = X
+        self.window = window
+        self.done = threading.Event()
+        self.predictions = None
+        self.error = None
+
+class MicroBatcher:
+    """
+    Collects the windows of concurrent requests and predicts them together, in a thread of its own.
+    """
+    def __init__(self, batch_window=DEFAULT_BATCH_WINDOW, max_batch=DEFAULT_MAX_BATCH):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.batch_sizes = collections.deque(maxlen=LATENCY_HISTORY)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def predict(self, X, window):
+        """
+        Returns the list of (name, 0 or 1) for the given window's feature vector, once its batch has been predicted.
+        """
+        request = _Request(X, window)
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.predictions
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self.batch_sizes.append(len(batch))
+
+            by_window = collections.defaultdict(list)
+            for request in batch:
+                by_window[request.window].append(request)
+            for window, requests in by_window.items():
+                try:
+                    predictions = inference.predict_batch(np.stack([r.X for r in requests]), window)
+                    for i, request in enumerate(requests):
+                        request.predictions = [(name, int(ys[i])) for name, ys in predictions]
+                except Exception as e:
+                    for request in requests:
+                        request.error = e
+                for request in requests:
+                    request.done.set()
+
+class PredictionServer:
+    """
+    The state shared by every request: the micro-batcher and the latency measurements.
+    """
+    def __init__(self, windows=(inference.DEFAULT_WINDOW,), batch_window=DEFAULT_BATCH_WINDOW, max_batch=DEFAULT_MAX_BATCH):
+        self.windows = list(windows)
+        self.started = time.time()
+        self.ready = False
+        self.batcher = MicroBatcher(batch_window, max_batch)
+        self.latencies = collections.deque(maxlen=LATENCY_HISTORY)
+        self.nrequests = 0
+        self.nerrors = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the models for every window the server was started with.
+        """
+        inference.preload(self.windows)
+        self.ready = True
+
+    def predict(self, body):
+        """
+        Returns the response to a /predict request with the given (decoded JSON) body.
+        Raises BadRequest if the body isn't valid (see validate_body()).
+        """
+        window, seasons = validate_body(body, self.windows)
+        rel = inference.get_relationship([inference.orient_season(s) for s in seasons[-window:]])
+        X = data.windows_from_matrix(rel.to_feature_matrix(), window)[-1]
+        return {"predictions": self.batcher.predict(X, window)}
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.latencies.append(seconds)
+            self.nrequests += 1
+            self.nerrors += int(error)
+
+    def health(self):
+        return {"status": "ok" if self.ready else "loading", "uptime_s": time.time() - self.started, "windows": self.windows}
+
+    def stats(self):
+        with self._lock:
+            ms = np.array(self.latencies) * 1000
+            nrequests, nerrors = self.nrequests, self.nerrors
+        percentiles = {"p" + str(p) + "_ms": float(np.percentile(ms, p)) for p in (50, 90, 95, 99)} if len(ms) else {}
+        sizes = np.array(self.batcher.batch_sizes)
+        return {
+                    "requests":         nrequests,
+                    "errors":           nerrors,
+                    "latency":          dict(percentiles, mean_ms=float(np.mean(ms)) if len(ms) else None, max_ms=float(np.max(ms)) if len(ms) else None),
+                    "batches":          len(sizes),
+                    "mean_batch_size":  float(np.mean(sizes)) if len(sizes) else None,
+                    "models":           inference.REGISTRY.stats(),
+                    "sentence_cache":   analyzer.SENTENCE_CACHE.stats(),
+               }
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Routes the HTTP requests to the PredictionServer (self.server.predictions).
+    """
+    def _respond(self, status, obj):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        """
+        Returns the request's body decoded from JSON, or raises BadRequest if it can't be.
+        """
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            return json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError as e:
+            # Includes a bad Content-Length, invalid UTF-8 and invalid JSON
+            raise BadRequest("The body must be JSON (" + str(e) + ")")
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._respond(200 if self.server.predictions.ready else 503, self.server.predictions.health())
+        elif self.path == "/stats":
+            self._respond(200, self.server.predictions.stats())
+        else:
+            self._respond(404, {"error": "Unknown endpoint: " + self.path})
+
+    def do_POST(self):
+        if self.path != "/predict":
+            self._respond(404, {"error": "Unknown endpoint: " + self.path})
+            return
+        start = time.time()
+        try:
+            response, status = self.server.predictions.predict(self._read_json()), 200
+        except BadRequest as e:
+            response, status = {"error": "Bad request: " + str(e)}, 400
+        except Exception as e:
+            # Anything that goes wrong past validation (analyzing the messages, the models) is the server's fault
+            response, status = {"error": str(e)}, 500
+        self.server.predictions.record(time.time() - start, error=status != 200)
+        self._respond(status, response)
+
+    def address_string(self):
+        # Unix socket clients don't have an address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(port=DEFAULT_PORT, host="127.0.0.1", unix_socket=None, windows=(inference.DEFAULT_WINDOW,),
+          batch_window=DEFAULT_BATCH_WINDOW, max_batch=DEFAULT_MAX_BATCH, verbose=False):
+    """
+    Loads the models and serves predictions until interrupted.
+    """
+    predictions = PredictionServer(windows, batch_window, max_batch)
+    print("Loading the models...")
+    predictions.load()
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        httpd = ThreadingUnixHTTPServer(unix_socket, RequestHandler)
+        print("Serving on", unix_socket)
+    else:
+        httpd = ThreadingHTTPServer((host, port), RequestHandler)
+        print("Serving on http://" + host + ":" + str(port))
+    httpd.predictions = predictions
+    httpd.verbose = verbose
+    try:
+        httpd.serve_forever()
+    finally:
+        httpd.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves betrayal predictions over HTTP with the models kept loaded.")
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help="The port to listen on. Default: %(default)s")
+    parser.add_argument("--host", default="127.0.0.1", help="The address to listen on. Default: %(default)s")
+    parser.add_argument("-u", "--unix-socket", default=None, help="Listen on this Unix socket instead of a port.")
+    parser.add_argument("-w", "--windows", type=int, nargs="+", default=[inference.DEFAULT_WINDOW],
+                        help="The window lengths to load models for. Default: %(default)s")
+    parser.add_argument("--batch-window", type=float, default=DEFAULT_BATCH_WINDOW,
+                        help="Seconds to wait for more requests to batch with the first one. Default: %(default)s")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="The largest batch to predict at once. Default: %(default)s")
+    parser.add_argument("--sentence-cache-size", type=int, default=analyzer.SENTENCE_CACHE.maxsize,
+                        help="The most sentences the analyzer keeps the results of (0 to turn the cache off). Default: %(default)s")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log every request.")
+    args = parser.parse_args()
+
+    analyzer.SENTENCE_CACHE.resize(args.sentence_cache_size)
+
+    try:
+        serve(args.port, args.host, args.unix_socket, args.windows, args.batch_window, args.max_batch, args.verbose)
+    except KeyboardInterrupt:
+        print("Stopped serving.")
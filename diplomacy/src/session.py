@@ -0,0 +1,144 @@
+"""
+This module follows the relationships in a game while it is being played, one season at a time.
+
+Each (game, pair of countries) has a session that keeps the analysis of every message the
+pair has exchanged so far. When a new season's YAML file comes in, only the messages that
+haven't been seen before are analyzed, and the prediction is made from the stored analyses
+of the last few seasons, so a turn costs about as much as that season's new messages.
+
+Sessions are stored as append-only log files, one per pair: sessions/<game>/<A>-<B>.jsonl.
+Each line records one ingested season along with the analyses of its new messages.
+
+Example (run it again with each new season's files as the game goes on):
+
+python3 session.py --game mygame gameparser_output/1902FallAR.yml gameparser_output/1902FallFG.yml
+
+"""
+import analyzer
+import argparse
+import data
+import dedup
+import inference
+import json
+import os
+import seasonfiles
+
+SESSION_DIR = "sessions"
+
+def message_key(msg):
+    """
+    Returns the key a message's analysis is stored under, the same one the other analysis caches use (see dedup.text_key).
+    """
+    return dedup.text_key(msg)
+
+class Session:
+    """
+    The analyzed seasons of one pair of countries in one game. Use get_session() rather than building one directly.
+    """
+    def __init__(self, game, pair, session_dir=SESSION_DIR):
+        self.game = game
+        self.pair = tuple(pair)
+        self.path = os.path.join(session_dir, game, "-".join(self.pair) + ".jsonl")
+        self.analyses = {}  # Message key -> analysis
+        self.seasons = {}   # Season (see inference.season_key) -> {"betrayer": [message key], "victim": [message key]}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    if line.strip():
+                        self._apply(json.loads(line))
+
+    def __len__(self):
+        return len(self.seasons)
+
+    def _apply(self, record):
+        """
+        Applies one record of the session's log.
+        """
+        self.analyses.update(record["analyses"])
+        self.seasons[record["season"]] = record["messages"]
+
+    def ingest(self, yam, analyze=analyzer.analyze_message):
+        """
+        Adds the given season's YAML dict to the session (replacing that season, if it was ingested before),
+        analyzing only the messages the session hasn't seen yet. Returns the number of messages analyzed.
+        """
+        yam = inference.orient_season(yam)
+        record = {"season": inference.season_key(yam), "messages": {}, "analyses": {}}
+        for person, direction in (("betrayer", "a_to_b"), ("victim", "b_to_a")):
+            keys = []
+            for msg in yam[direction]['messages'] or []:
+                key = message_key(msg)
+                if key not in self.analyses and key not in record["analyses"]:
+                    record["analyses"][key] = analyze(msg)
+                keys.append(key)
+            record["messages"][person] = keys
+        if self.seasons.get(record["season"]) == record["messages"]:
+            # Nothing new, e.g., a file that was saved again without changes
+            return 0
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + os.linesep)
+        self._apply(record)
+        return len(record["analyses"])
+
+    def get_relationship(self, last=None):
+        """
+        Returns a data.Relationship made of the session's seasons (only the last `last` of them, if given).
+        """
+        keys = sorted(self.seasons.keys())
+        keys = keys[-last:] if last else keys
+        seasons = []
+        for key in keys:
+            messages = {person: [self.analyses[k] for k in self.seasons[key][person]] for person in ("betrayer", "victim")}
+            seasons.append({"season": key, "interaction": None, "messages": messages})
+        return data.Relationship({"idx": 0, "game": self.game, "betrayal": False, "people": list(self.pair), "seasons": seasons})
+
+    def predict(self, window=inference.DEFAULT_WINDOW):
+        """
+        Predicts whether there will be a betrayal or not next turn from the session's last `window` seasons.
+        """
+        return inference.predict(self.get_relationship(window), window)
+
+# Sessions that have already been opened by this process, by (game, pair, session_dir)
+_open_sessions = {}
+
+def get_session(game, pair, session_dir=SESSION_DIR):
+    """
+    Returns the session for the given game and pair of countries, reusing it if this process already opened it.
+    """
+    key = (game, tuple(pair), session_dir)
+    if key not in _open_sessions:
+        _open_sessions[key] = Session(game, pair, session_dir)
+    return _open_sessions[key]
+
+def ingest_file(path, game, window=inference.DEFAULT_WINDOW, session_dir=SESSION_DIR):
+    """
+    Ingests the season in the given YAML file into its pair's session and, once the pair has talked for
+    at least `window` seasons, predicts whether there will be a betrayal next turn.
+
+    Returns (pair, number of messages analyzed, predictions or None).
+    """
+    yam = seasonfiles.load_yaml(path)
+    pair = inference.get_pair(yam)
+    session = get_session(game, pair, session_dir)
+    nanalyzed = session.ingest(yam)
+    predictions = session.predict(window) if len(session) >= window else None
+    return pair, nanalyzed, predictions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingests new seasons into their pairs' sessions and predicts betrayals.")
+    parser.add_argument("paths", nargs="+", metavar="path/to/file.yml", help="The new seasons' YAML files (one per pair of countries).")
+    parser.add_argument("-g", "--game", required=True, help="The name of the game the seasons belong to.")
+    parser.add_argument("-w", "--window", type=int, default=inference.DEFAULT_WINDOW,
+                        help="The number of seasons the models look at. Default: %(default)s")
+    parser.add_argument("-s", "--session-dir", default=SESSION_DIR, help="Where the sessions are kept. Default: %(default)s")
+    args = parser.parse_args()
+
+    for path in args.paths:
+        pair, nanalyzed, predictions = ingest_file(path, args.game, args.window, args.session_dir)
+        print("-".join(pair), "| new messages analyzed:", nanalyzed)
+        if predictions is None:
+            print("  |-> Not enough seasons yet for a window of", args.window)
+        else:
+            print("  |->", predictions)
@@ -3,17 +3,20 @@ This is a front end module for running the program in training mode.
 
 This module was used to train the models and evaluate them.
 """
+import argparse
 import os
 if not "SSH_CONNECTION" in os.environ:
     # Disable annoying TF warnings when importing keras (which imports TF)
     os.environ['TF_CPP_MIN_LOG_LEVEL']='2'
-    import tensorflow as tf
+import artifacts
 import data
+from ensemble import Ensemble
+import folds
 import itertools
 import keras
-from keras.callbacks import ModelCheckpoint
+from keras.callbacks import EarlyStopping, ModelCheckpoint
 from keras.models import Sequential
-from keras.layers import Dense, Dropout, Embedding, LSTM
+from keras.layers import Dense, Dropout, Embedding, LSTM, Masking, TimeDistributed
 from keras.wrappers.scikit_learn import KerasClassifier
 import matplotlib
 if "SSH_CONNECTION" in os.environ:
@@ -30,13 +33,15 @@ import numpy as np
 import pickle
 import random
 import scipy
+import sklearn
 from sklearn import decomposition, neighbors, svm, tree
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.externals import joblib
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import accuracy_score, confusion_matrix, precision_recall_fscore_support, roc_curve, auc
-from sklearn.model_selection import cross_val_score, StratifiedKFold, train_test_split
+from sklearn.model_selection import cross_val_score, train_test_split
 from sklearn.neural_network import MLPClassifier
+import time
 
 random.seed(12345)
 np.random.seed(12345)
@@ -45,27 +50,85 @@ cached_Xs = None
 cached_Ys = None
 cached_ptd = None
 cached_binary = True
+cached_window = 3
 X_validation_set = None
 Y_validation_set = None
 
-def _get_rnn_data(path_to_data=None, binary=True):
+# Settings for fitting the Keras models; these can be changed from the command line (see __main__)
+MAX_EPOCHS = 1000
+MLP_BATCH_SIZE = 20
+RNN_BATCH_SIZE = 32              # Whole relationships per batch
+EARLY_STOPPING_PATIENCE = 100   # Epochs without val_loss improving before giving up
+MAX_FIT_SECONDS = None          # Wall clock budget per fit; None means no limit
+
+class TimeBudget(keras.callbacks.Callback):
+    """
+    Keras callback that logs how long each epoch takes and stops training once
+    max_seconds have gone by since training started (if max_seconds is given).
+    """
+    def __init__(self, max_seconds=None, verbose=True):
+        super().__init__()
+        self.max_seconds = max_seconds
+        self.verbose = verbose
+        self.start = None
+        self.epoch_start = None
+
+    def on_train_begin(self, logs=None):
+        self.start = time.time()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        now = time.time()
+        if self.verbose:
+            print("  |-> Epoch", epoch + 1, "took %.2fs (%.1fs total)" % (now - self.epoch_start, now - self.start))
+        if self.max_seconds is not None and now - self.start >= self.max_seconds:
+            print("  |-> Out of time after", epoch + 1, "epochs. Stopping.")
+            self.model.stop_training = True
+
+def configure_threads(nthreads):
     """
+    Limits TensorFlow (and therefore Keras) to the given number of threads.
     """
-    # Need to get whole relationships at a time along with labels that are simply whether this feature vector (which is a season)
-    # is the last turn of a betrayal relationship
+    import tensorflow as tf
+    config = tf.ConfigProto(intra_op_parallelism_threads=nthreads, inter_op_parallelism_threads=nthreads)
+    keras.backend.set_session(tf.Session(config=config))
 
-    # Dimension of Xs should be: (500, x, 10), where x varies from 3 to 10 (i.e., len of relationship)
-    Xs = [x for x in data.get_X_feed_rnn(path_to_data)]
-    if binary:
-        Ys = [y for y in data.get_Y_feed_binary_rnn(path_to_data)]
-    else:
-        assert False, "Not yet supported"
+def _keras_fit_callbacks(path_to_save_model, patience=None, max_seconds=None, verbose=True):
+    """
+    Returns the callbacks that every Keras fit uses: checkpointing of the best model, early stopping, and the time budget.
+    """
+    patience = patience if patience is not None else EARLY_STOPPING_PATIENCE
+    max_seconds = max_seconds if max_seconds is not None else MAX_FIT_SECONDS
+    checkpointer = ModelCheckpoint(filepath=path_to_save_model, verbose=1 if verbose else 0, save_best_only=True)
+    early_stopper = EarlyStopping(monitor='val_loss', patience=patience, verbose=1 if verbose else 0)
+    return [checkpointer, early_stopper, TimeBudget(max_seconds, verbose)]
 
-    return Xs, Ys
+def _restore_best_weights(model, path_to_save_model):
+    """
+    Puts the weights of the best model checkpointed during the fit (see _keras_fit_callbacks) back into the given model,
+    which is otherwise left with the weights of the last epoch, up to `patience` epochs past the best one.
+    """
+    if os.path.exists(path_to_save_model):
+        model.load_weights(path_to_save_model)
+    return model
 
-def _get_xy(path_to_data=None, binary=True, upsample=True, replicate=False):
+def _get_rnn_data(path_to_data=None, binary=True):
+    """
+    Returns (training pairs, validation pairs) for the RNN, where each pair is (X, y) for one whole relationship:
+    X has one row of features per season (3 to 10 of them) and y says, for each season, whether it is the last
+    season of a relationship that ends in betrayal.
     """
-    Returns Xs, Ys, shuffled.
+    if not binary:
+        assert False, "Not yet supported"
+    train = data.get_sequences(path_to_data)
+    validation = data.get_sequences(path_to_data, validation=True)
+    return train, validation
+
+def _get_xy(path_to_data=None, binary=True, upsample=True, replicate=False, window=3):
+    """
+    Returns Xs, Ys, shuffled. Each X is `window` seasons' worth of features.
 
     Keeps back a validation set that you can get via X_validation_set and Y_validation_set.
     """
@@ -73,15 +136,16 @@ def _get_xy(path_to_data=None, binary=True, upsample=True, replicate=False):
     global cached_Ys
     global cached_ptd
     global cached_binary
-    if cached_Xs is not None and cached_Ys is not None and cached_ptd == path_to_data and cached_binary == binary and upsample and not replicate:
+    global cached_window
+    if cached_Xs is not None and cached_Ys is not None and cached_ptd == path_to_data and cached_binary == binary and cached_window == window and upsample and not replicate:
         return cached_Xs, cached_Ys
     else:
         print("Getting the data. This will take a moment...")
-        Xs = [x for x in data.get_X_feed(path_to_data, upsample=upsample, replicate=replicate)]
+        Xs = [x for x in data.get_X_feed(path_to_data, upsample=upsample, replicate=replicate, window=window)]
         if binary:
-            Ys = np.array([y for y in data.get_Y_feed_binary(path_to_data, upsample=upsample)])
+            Ys = np.array([y for y in data.get_Y_feed_binary(path_to_data, upsample=upsample, window=window)])
         else:
-            Ys = np.array([y for y in data.get_Y_feed(Xs, path_to_data, upsample=upsample)])
+            Ys = np.array([y for y in data.get_Y_feed(Xs, path_to_data, upsample=upsample, window=window)])
         Xs = np.array([x[1] for x in Xs])
 
         # Shuffle
@@ -94,7 +158,7 @@ def _get_xy(path_to_data=None, binary=True, upsample=True, replicate=False):
         # Keep back validation set
         global X_validation_set
         global Y_validation_set
-        X_validation_set, Y_validation_set = data.get_validation_set(replicate=replicate)
+        X_validation_set, Y_validation_set = data.get_validation_set(replicate=replicate, window=window)
         print("Ones in validation set:", len([y for y in Y_validation_set if y == 1]))
         print("Zeros in validation set:", len([y for y in Y_validation_set if y == 0]))
 
@@ -104,6 +168,7 @@ def _get_xy(path_to_data=None, binary=True, upsample=True, replicate=False):
             cached_Ys = Ys
             cached_ptd = path_to_data
             cached_binary = binary
+            cached_window = window
         return Xs, Ys
 
 def plot_confusion_matrix(cm, classes, subplot, normalize=False, title="Confusion matrix", cmap=plt.cm.Blues):
@@ -133,7 +198,7 @@ def plot_confusion_matrix(cm, classes, subplot, normalize=False, title="Confusio
     if subplot == 234 or subplot == 235 or subplot == 236:
         plt.xlabel('Predicted label', fontsize=15)
 
-def train_knn(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title=""):
+def train_knn(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title="", window=3):
     """
     Trains a knn classifier on the dataset.
 
@@ -142,17 +207,18 @@ def train_knn(path_to_data=None, path_to_save_model=None, load_model=False, path
     If load_model is True, it will load the model from the given location and resume training.
     If binary is True, the model will be trained to simply detect whether, given three Seasons' worth of messages, there
         will be a betrayal between these users in this order phase.
+    The window is how many consecutive Seasons make up each feature vector.
     """
     print("Training the KNN with inverse weights...")
     if load_model:
         clf = load_model_from_path(path_to_load)
         compute_confusion_matrix(clf, upsample=False, subplot=subplot, title=title, path_to_data=path_to_data, binary=binary)
     else:
-        clf = neighbors.KNeighborsClassifier(n_neighbors=3, weights='distance')
-        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title)
+        clf = make_knn()
+        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title, window=window)
     return clf
 
-def train_logregr(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title="", replicate=False):
+def train_logregr(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title="", replicate=False, window=3):
     """
     Trains a logistic regression model.
 
@@ -162,73 +228,85 @@ def train_logregr(path_to_data=None, path_to_save_model=None, load_model=False,
     If binary is True, the model will be trained to simply detect whether, given three Seasons' worth of messages, there
         will be a betrayal between these users in this order phase.
     If replicate is True, this will attempt to train a model that corresponds to what the authors did.
+    The window is how many consecutive Seasons make up each feature vector.
     """
     print("Training logistic regression model...")
     if load_model:
         clf = load_model_from_path(path_to_load)
         compute_confusion_matrix(clf, upsample=False, subplot=subplot, title=title, path_to_data=path_to_data, binary=binary)
     else:
-        clf = LogisticRegression(penalty='l2', dual=False, tol=0.0001, C=0.1, fit_intercept=True,
-                             intercept_scaling=1, class_weight='balanced', random_state=None, solver='liblinear', max_iter=200)
-        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title)
+        clf = make_logregr()
+        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title, window=window)
     return clf
 
-def train_rnn(path_to_data=None, path_to_save_model="rnn.hdf5", load_model=False, path_to_load="rnn.hdf5", binary=True, subplot=111, title=""):
+def make_rnn(nfeatures=10, units=256):
     """
+    Returns a compiled, untrained LSTM that takes padded batches of whole relationships (see data.bucket_sequences)
+    and predicts, for every season, whether it is the last one before a betrayal. Padded seasons are masked out.
     """
-    def make_model(X):
-        model = Sequential()
-        model.add(LSTM(256, input_shape=X.shape[1:], dropout=0.2, recurrent_dropout=0.2))
-        model.add(Dense(1, activation='sigmoid'))
-        return model
-
-    print("Training the RNN...")
-    print("  |-> Getting the data...")
-    X_train, y_train = _get_rnn_data(path_to_data, binary)
-    X_test, y_test = X_validation_set, Y_validation_set
-
-    def concat(Z):
-        temp = []
-        for z in Z:
-            temp += z
-        return temp
-
-    print("  |-> Concatenating the data for the RNN...")
-    X_train = np.array(concat(X_train))
-    X_test = np.array(concat(X_test))
-    y_train = np.array(concat(y_train))
-    y_test = np.array(concat(y_test))
+    model = Sequential()
+    model.add(Masking(mask_value=data.PAD_VALUE, input_shape=(None, nfeatures)))
+    model.add(LSTM(units, return_sequences=True, dropout=0.2, recurrent_dropout=0.2))
+    model.add(TimeDistributed(Dense(1, activation='sigmoid')))
+    model.compile(loss='binary_crossentropy', optimizer='rmsprop', metrics=['accuracy'], sample_weight_mode='temporal')
+    return model
 
-    print("  |-> X shape:", X_train.shape)
-    print("  |-> Y shape:", y_train.shape)
+def _cycle_batches(batches):
+    """
+    Yields the given batches forever, in a new random order each epoch, for Keras' fit_generator.
+    """
+    order = list(range(len(batches)))
+    while True:
+        random.shuffle(order)
+        for i in order:
+            yield batches[i]
+
+def train_rnn(path_to_data=None, path_to_save_model="rnn.hdf5", load_model=False, path_to_load="rnn.hdf5", binary=True, subplot=111, title="",
+              epochs=None, batch_size=None, patience=None, max_seconds=None):
+    """
+    Trains an LSTM on whole relationships.
 
-    X_train = np.reshape(X_train, (X_train.shape[0], 1, X_train.shape[1]))
-    X_test = np.reshape(X_test, (X_test.shape[0], 1, X_test.shape[1]))
+    Relationships are grouped into batches of batch_size relationships of similar length, and each batch is only padded
+    as far as its longest relationship. The padding is masked, so the model sees each relationship's seasons in order
+    and nothing else.
 
-    print("  |-> X shape after reshape:", X_train.shape)
+    epochs, batch_size, patience (for early stopping) and max_seconds (the wall clock budget for the fit) default
+    to MAX_EPOCHS, RNN_BATCH_SIZE, EARLY_STOPPING_PATIENCE and MAX_FIT_SECONDS respectively.
+    """
+    print("Training the RNN...")
+    print("  |-> Getting the data...")
+    train, validation = _get_rnn_data(path_to_data, binary)
+    batches = data.bucket_sequences(train, batch_size if batch_size else RNN_BATCH_SIZE)
+    X_test, y_test, w_test = data.pad_sequences(validation)
+    print("  |-> Relationships:", len(train), "Batches:", len(batches), "Batch shapes:", sorted(set(b[0].shape[1] for b in batches)))
 
     if load_model:
         print("  |-> Loading saved model...")
         model = keras.models.load_model(path_to_load)
     else:
-        model = make_model(X_train)
-
         print("  |-> Compiling...")
-        model.compile(loss='binary_crossentropy', optimizer='rmsprop', metrics=['accuracy'])
+        model = make_rnn(X_test.shape[2])
 
         print("  |-> Fitting the model...")
-        checkpointer = ModelCheckpoint(filepath=path_to_save_model, verbose=1, save_best_only=True)
-        model.fit(X_train, y_train, batch_size=10, epochs=1000, verbose=2, validation_data=(X_test, y_test), callbacks=[checkpointer])
+        callbacks = _keras_fit_callbacks(path_to_save_model, patience, max_seconds)
+        model.fit_generator(_cycle_batches(batches), steps_per_epoch=len(batches), epochs=epochs if epochs else MAX_EPOCHS,
+                            verbose=2, validation_data=(X_test, y_test, w_test), callbacks=callbacks)
+        _restore_best_weights(model, path_to_save_model)
 
     print("  |-> Evaluating the model...")
-    score = model.evaluate(X_test, y_test, verbose=1)
+    score = model.evaluate(X_test, y_test, sample_weight=w_test, verbose=1)
     print("")
     print("  |-> Loss:", score[0])
     print("  |-> Accuracy:", score[1])
 
-    compute_confusion_matrix(model, upsample=False, subplot=subplot, title=title, round_data=True)
+    # Only the real (unpadded) seasons count
+    real = w_test > 0
+    y_pred = np.round(model.predict(X_test)[:, :, 0][real])
+    report_predictions(y_test[:, :, 0][real], y_pred, subplot=subplot, title=title)
+    return model
 
-def train_mlp(path_to_data=None, path_to_save_model="mlp.hdf5", load_model=False, path_to_load="mlp.hdf5", binary=True, subplot=111, title=""):
+def train_mlp(path_to_data=None, path_to_save_model="mlp.hdf5", load_model=False, path_to_load="mlp.hdf5", binary=True, subplot=111, title="", window=3,
+              epochs=None, batch_size=None, patience=None, max_seconds=None):
     """
     Trains a multilayer perceptron.
 
@@ -237,19 +315,12 @@ def train_mlp(path_to_data=None, path_to_save_model="mlp.hdf5", load_model=False
     If load_model is True, it will load the model from the given location and resume training.
     If binary is True, the model will be trained to simply detect whether, given three Seasons' worth of messages, there
         will be a betrayal between these users in this order phase.
+    The window is how many consecutive Seasons make up each feature vector.
+    See fit_mlp for epochs, batch_size, patience and max_seconds.
     """
     print("Training the MLP...")
-    def make_model():
-        model = Sequential()
-        model.add(Dense(1024, input_dim=30, kernel_initializer='normal', activation='relu'))
-        model.add(Dropout(0.5))
-        model.add(Dense(256, kernel_initializer='normal', activation='relu'))
-        model.add(Dropout(0.4))
-        model.add(Dense(1, kernel_initializer='normal', activation='sigmoid'))
-        return model
-
     print("  |-> Getting the data...")
-    X_train, y_train = _get_xy(path_to_data, binary)
+    X_train, y_train = _get_xy(path_to_data, binary, window=window)
     X_test = X_validation_set
     y_test = Y_validation_set
 
@@ -257,15 +328,11 @@ def train_mlp(path_to_data=None, path_to_save_model="mlp.hdf5", load_model=False
         print("  |-> Loading saved model...")
         model = keras.models.load_model(path_to_load)
     else:
-        model = make_model()
-
         print("  |-> Compiling...")
-        model.compile(loss='binary_crossentropy', optimizer='adagrad', metrics=['accuracy'])
+        model = make_mlp(X_train.shape[1])
 
         print("  |-> Fitting the model...")
-        checkpointer = ModelCheckpoint(filepath=path_to_save_model, verbose=1, save_best_only=True)
-        lr_reducer = keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=50, min_lr=0.00001)
-        model.fit(X_train, y_train, batch_size=20, epochs=1000, verbose=2, validation_data=(X_test, y_test), callbacks=[checkpointer, lr_reducer])
+        fit_mlp(model, X_train, y_train, X_test, y_test, path_to_save_model, epochs=epochs, batch_size=batch_size, patience=patience, max_seconds=max_seconds)
 
     print("  |-> Evaluating the model...")
     score = model.evaluate(X_test, y_test, verbose=1)
@@ -276,7 +343,7 @@ def train_mlp(path_to_data=None, path_to_save_model="mlp.hdf5", load_model=False
     compute_confusion_matrix(model, upsample=False, subplot=subplot, title=title, round_data=True)
     return model
 
-def train_random_forest(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title=""):
+def train_random_forest(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title="", window=3):
     """
     Trains a random forest classifier on the dataset.
 
@@ -285,17 +352,18 @@ def train_random_forest(path_to_data=None, path_to_save_model=None, load_model=F
     If load_model is True, it will load the model from the given location and resume training.
     If binary is True, the model will be trained to simply detect whether, given three Seasons' worth of messages, there
         will be a betrayal between these users in this order phase.
+    The window is how many consecutive Seasons make up each feature vector.
     """
     print("Training the random forest...")
     if load_model:
         clf = load_model_from_path(path_to_load)
         compute_confusion_matrix(clf, upsample=False, subplot=subplot, title=title, path_to_data=path_to_data, binary=binary)
     else:
-        clf = RandomForestClassifier(class_weight='balanced')
-        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title)
+        clf = make_random_forest()
+        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title, window=window)
     return clf
 
-def train_svm(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title=""):
+def train_svm(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title="", window=3):
     """
     Trains an SVM classifier on the dataset.
 
@@ -304,17 +372,18 @@ def train_svm(path_to_data=None, path_to_save_model=None, load_model=False, path
     If load_model is True, it will load the model from the given location and resume training.
     If binary is True, the model will be trained to simply detect whether, given three Seasons' worth of messages, there
         will be a betrayal between these users in this order phase.
+    The window is how many consecutive Seasons make up each feature vector.
     """
     print("Training the SVM with nonlinear kernel (RBF)...")
     if load_model:
         clf = load_model_from_path(path_to_load)
         compute_confusion_matrix(clf, upsample=False, subplot=subplot, title=title, path_to_data=path_to_data, binary=binary)
     else:
-        clf = svm.SVC(class_weight='balanced')
-        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title)
+        clf = make_svm()
+        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title, window=window)
     return clf
 
-def train_tree(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title=""):
+def train_tree(path_to_data=None, path_to_save_model=None, load_model=False, path_to_load=None, binary=True, subplot=111, title="", window=3):
     """
     Trains a decision tree classifier on the dataset.
 
@@ -323,28 +392,105 @@ def train_tree(path_to_data=None, path_to_save_model=None, load_model=False, pat
     If load_model is True, it will load the model from the given location and resume training.
     If binary is True, the model will be trained to simply detect whether, given three Seasons' worth of messages, there
         will be a betrayal between these users in this order phase.
+    The window is how many consecutive Seasons make up each feature vector.
     """
     print("Training the decision tree model...")
     if load_model:
         clf = load_model_from_path(path_to_load)
         compute_confusion_matrix(clf, upsample=False, subplot=subplot, title=title, path_to_data=path_to_data, binary=binary)
     else:
-        clf = tree.DecisionTreeClassifier(class_weight='balanced')
-        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title)
+        clf = make_tree()
+        clf = train_model(clf, cross_validate=True, conf_matrix=True, save_model_at_path=path_to_save_model, subplot=subplot, title=title, window=window)
     return clf
 
-def train_model(clf, cross_validate=False, conf_matrix=False, path_to_data=None, binary=True, save_model_at_path=None, subplot=111, title="Confusion Matrix", replicate=False):
+def make_knn():
+    """
+    Returns an untrained KNN classifier with inverse distance weights.
+    """
+    return neighbors.KNeighborsClassifier(n_neighbors=3, weights='distance')
+
+def make_logregr():
+    """
+    Returns an untrained logistic regression model.
+    """
+    return LogisticRegression(penalty='l2', dual=False, tol=0.0001, C=0.1, fit_intercept=True,
+                              intercept_scaling=1, class_weight='balanced', random_state=None, solver='liblinear', max_iter=200)
+
+def make_mlp(input_dim=30, hidden=(1024, 256), dropout=(0.5, 0.4)):
+    """
+    Returns a compiled, untrained multilayer perceptron that takes feature vectors of length input_dim.
+
+    hidden is the number of units in each hidden layer and dropout is the dropout rate after each of them
+    (either one rate per hidden layer or a single rate for all of them).
+    """
+    if not hasattr(dropout, "__len__"):
+        dropout = [dropout] * len(hidden)
+    model = Sequential()
+    for i, (units, rate) in enumerate(zip(hidden, dropout)):
+        if i == 0:
+            model.add(Dense(units, input_dim=input_dim, kernel_initializer='normal', activation='relu'))
+        else:
+            model.add(Dense(units, kernel_initializer='normal', activation='relu'))
+        model.add(Dropout(rate))
+    model.add(Dense(1, kernel_initializer='normal', activation='sigmoid'))
+    model.compile(loss='binary_crossentropy', optimizer='adagrad', metrics=['accuracy'])
+    return model
+
+def make_random_forest():
+    """
+    Returns an untrained random forest classifier.
+    """
+    return RandomForestClassifier(class_weight='balanced')
+
+def make_svm():
+    """
+    Returns an untrained SVM classifier with an RBF kernel.
+    """
+    return svm.SVC(class_weight='balanced')
+
+def make_tree():
+    """
+    Returns an untrained decision tree classifier.
+    """
+    return tree.DecisionTreeClassifier(class_weight='balanced')
+
+# The scikit-learn models, by the name they are saved under in models/
+SKLEARN_MODEL_MAKERS = {
+                        "knn":      make_knn,
+                        "logregr":  make_logregr,
+                        "forest":   make_random_forest,
+                        "svm":      make_svm,
+                        "tree":     make_tree,
+                       }
+
+def fit_mlp(model, X_train, y_train, X_test, y_test, path_to_save_model="mlp.hdf5", verbose=2, epochs=None, batch_size=None, patience=None, max_seconds=None):
+    """
+    Fits the given MLP (see make_mlp), checkpointing the best model (by validation loss) to path_to_save_model,
+    and returns it with the best model's weights.
+
+    Training stops after `epochs` epochs, once the validation loss hasn't improved for `patience` epochs, or once
+    max_seconds have gone by, whichever comes first. These default to MAX_EPOCHS, EARLY_STOPPING_PATIENCE and
+    MAX_FIT_SECONDS; batch_size defaults to MLP_BATCH_SIZE.
+    """
+    lr_reducer = keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.2, patience=50, min_lr=0.00001)
+    callbacks = _keras_fit_callbacks(path_to_save_model, patience, max_seconds, verbose) + [lr_reducer]
+    model.fit(X_train, y_train, batch_size=batch_size if batch_size else MLP_BATCH_SIZE, epochs=epochs if epochs else MAX_EPOCHS,
+              verbose=verbose, validation_data=(X_test, y_test), callbacks=callbacks)
+    return _restore_best_weights(model, path_to_save_model)
+
+def train_model(clf, cross_validate=False, conf_matrix=False, path_to_data=None, binary=True, save_model_at_path=None, subplot=111, title="Confusion Matrix", replicate=False, window=3):
     """
     Trains the given model.
 
     If confusion_matrix is True, a confusion matrix subplot will be added to plt.
     If path_to_data is specified, it will get the data from that location, otherwise it will get it from the default location.
     """
-    X_train, y_train = _get_xy(path_to_data, binary, replicate=replicate)
+    X_train, y_train = _get_xy(path_to_data, binary, replicate=replicate, window=window)
     X_test, y_test = X_validation_set, Y_validation_set
     clf = clf.fit(X_train, y_train)
     if cross_validate:
-        scores = cross_val_score(clf, X_train, y_train, cv=5, n_jobs=-1)
+        cache = folds.get_fold_cache(X_train, y_train)
+        scores = folds.cross_val_score(clf, cache, n_jobs=-1)
         print("  |-> Scores:", scores)
     if confusion_matrix:
         compute_confusion_matrix(clf, upsample=False, subplot=subplot, title=title, path_to_data=path_to_data, binary=binary)
@@ -358,9 +504,11 @@ def train_model(clf, cross_validate=False, conf_matrix=False, path_to_data=None,
 def compute_roc_curve(clf, X, y, subplot=111, title="ROC"):
     """
     Computes and plots an ROC curve for the given classifier.
+
+    Uses the cached cross validation folds for (X, y), so every model's curve is computed on the same splits.
     """
     # Run classifier with cross-validation and plot ROC curves
-    cv = StratifiedKFold(n_splits=6)
+    cache = folds.get_fold_cache(X, y)
     classifier = clf
     classifier.probability=True
 
@@ -371,10 +519,10 @@ def compute_roc_curve(clf, X, y, subplot=111, title="ROC"):
     lw = 2
 
     i = 0
-    for (train, test), color in zip(cv.split(X, y), colors):
-        probas_ = classifier.fit(X[train], y[train]).predict_proba(X[test])
+    for (X_train, y_train, X_test, y_test), color in zip(cache, colors):
+        probas_ = classifier.fit(X_train, y_train).predict_proba(X_test)
         # Compute ROC curve and area the curve
-        fpr, tpr, thresholds = roc_curve(y[test], probas_[:, 1])
+        fpr, tpr, thresholds = roc_curve(y_test, probas_[:, 1])
         mean_tpr += scipy.interp(mean_fpr, fpr, tpr)
         mean_tpr[0] = 0.0
         roc_auc = auc(fpr, tpr)
@@ -383,7 +531,7 @@ def compute_roc_curve(clf, X, y, subplot=111, title="ROC"):
         i += 1
     plt.plot([0, 1], [0, 1], linestyle='--', lw=lw, color='k', label='Luck')
 
-    mean_tpr /= cv.get_n_splits(X, y)
+    mean_tpr /= len(cache)
     mean_tpr[-1] = 1.0
     mean_auc = auc(mean_fpr, mean_tpr)
     plt.plot(mean_fpr, mean_tpr, color='g', linestyle='--', label='Mean (area = %0.2f)' % mean_auc, lw=lw)
@@ -395,16 +543,29 @@ def compute_roc_curve(clf, X, y, subplot=111, title="ROC"):
     plt.title(title)
     plt.legend(loc="lower right")
 
-def compute_confusion_matrix(clf, upsample=True, subplot=111, title="Confusion Matrix", path_to_data=None, binary=True, round_data=False):
+def compute_confusion_matrix(clf, upsample=True, subplot=111, title="Confusion Matrix", path_to_data=None, binary=True, round_data=False, fold_cache=None):
     """
     Computes and plots a confusion matrix.
 
+    If fold_cache is given (see folds.get_fold_cache), the matrix is computed from clf's out-of-fold predictions on
+    the cached folds rather than from the validation set. A clone of clf is fit on each fold in that case.
+
     @param upsample is deprecated - instead, just change the upscale value in data.py
     """
-    X_test, y_test = X_validation_set, Y_validation_set
-    y_pred = clf.predict(X_test)
+    if fold_cache is not None:
+        y_test = fold_cache.y
+        y_pred = folds.cross_val_predict(clf, fold_cache)
+    else:
+        X_test, y_test = X_validation_set, Y_validation_set
+        y_pred = clf.predict(X_test)
     if round_data:
         y_pred = [round(y[0]) for y in y_pred] # In case predicted value is from a model that does not output a binary value
+    report_predictions(y_test, y_pred, subplot=subplot, title=title)
+
+def report_predictions(y_test, y_pred, subplot=111, title="Confusion Matrix"):
+    """
+    Plots the confusion matrix for the given predictions and prints the usual metrics.
+    """
     cnf_matrix = confusion_matrix(y_test, y_pred)
     plot_confusion_matrix(cnf_matrix, classes=["No Betrayal", "Betrayal"], subplot=subplot, title=title)
     print("Number of samples in validation set:", len(y_test))
@@ -418,6 +579,21 @@ def compute_confusion_matrix(clf, upsample=True, subplot=111, title="Confusion M
     accuracy = accuracy_score(y_test, y_pred)
     print("Accuracy:", accuracy)
 
+def compare_window_sizes(clf, windows=(2, 3, 4, 5), path_to_data=None, cv=5):
+    """
+    Cross validates a clone of the given (unfitted) classifier on the dataset built with each of the given
+    window lengths and returns a dict of the form {window: scores}.
+
+    All of the datasets are built together in one pass over the relationships.
+    """
+    datasets = data.get_windowed_datasets(windows, datapath=path_to_data, reverse=True)
+    results = {}
+    for window, (X, y) in sorted(datasets.items()):
+        scores = cross_val_score(sklearn.base.clone(clf), X, y, cv=cv, n_jobs=-1)
+        print("  |-> Window:", window, "Samples:", len(y), "Betrayals:", sum(y), "Scores:", scores, "Mean:", np.mean(scores))
+        results[window] = scores
+    return results
+
 def load_model_from_path(path):
     """
     Returns a clf from the given path.
@@ -455,57 +631,40 @@ def pca_display(Xs, Ys, dimensions=3):
 
     plt.show()
 
-class Ensemble:
-    def __init__(self, models, names):
-        self.models = models
-        self.names = names
-
-    def predict(self, Xs):
-        ys = []
-        for X in Xs:
-            Y = []
-            for name, model in zip(self.names, self.models):
-                if name == "MLP":
-                    Y.append(np.array([model.predict(X.reshape(1, 30)).tolist()[0]]))
-                else:
-                    Y.append(model.predict(X.reshape(1, -1)).tolist()[0])
-            ys.append(Y)
-        weighted_ys = []
-        precision = 0.87 + 0.8+ 0.85 + 0.85 + 0.83
-        recall = 0.89 + 0.78 + 0.63 + 0.71 + 0.69
-        for Y in ys:
-            weighted_Y = []
-            for name, y in zip(self.names, Y):
-                to_append = 0
-                if name == "MLP" and y:
-                    to_append = 1 * 0.89 / recall
-                elif name == "MLP" and not y:
-                    to_append = -1 * 0.87 / precision
-                elif name == "KNN" and y:
-                    to_append = 1 * 0.78 / recall
-                elif name == "KNN" and not y:
-                    to_append = -1 * 0.8 / precision
-                elif name == "Tree" and y:
-                    to_append = 1 * 0.63 / recall
-                elif name == "Tree" and not y:
-                    to_append = -1 * 0.85 / precision
-                elif name == "Forest" and y:
-                    to_append = 1 * 0.71 / recall
-                elif name == "Forest" and not y:
-                    to_append = -1 * 0.85 / precision
-                elif name == "SVM" and y:
-                    to_append = 1 * 0.69 / recall
-                elif name == "SVM" and not y:
-                    to_append = -1 * 0.83 /precision
-                else:
-                    assert False, "Model: " + name + " not accounted for when y is " + bool(y)
-                weighted_Y.append(to_append)
-            prediction = np.array([1]) if sum(weighted_Y) > 0.51 else np.array([0])
-            weighted_ys.append(prediction)
-        return weighted_ys
-
 if __name__ == "__main__":
-    Xs, Ys = _get_xy()
+    parser = argparse.ArgumentParser(description="Trains (or loads) and evaluates the betrayal models.")
+    parser.add_argument("--train", action="store_true", help="Train the models and save them to the current directory instead of loading them from the window's models directory.")
+    parser.add_argument("--rnn", action="store_true", help="Also train the RNN (only with --train).")
+    parser.add_argument("--epochs", type=int, default=MAX_EPOCHS, help="The maximum number of epochs for the Keras models. Default: %(default)s")
+    parser.add_argument("--batch-size", type=int, default=MLP_BATCH_SIZE, help="The MLP's batch size. Default: %(default)s")
+    parser.add_argument("--rnn-batch-size", type=int, default=RNN_BATCH_SIZE, help="The number of relationships per RNN batch. Default: %(default)s")
+    parser.add_argument("--patience", type=int, default=EARLY_STOPPING_PATIENCE,
+                        help="Stop fitting a Keras model once its validation loss hasn't improved for this many epochs. Default: %(default)s")
+    parser.add_argument("--max-time", type=float, default=MAX_FIT_SECONDS, help="The maximum number of seconds to spend fitting each Keras model. Default: no limit")
+    parser.add_argument("--threads", type=int, default=None, help="The number of threads TensorFlow may use. Default: TensorFlow's choice")
+    parser.add_argument("-w", "--window", type=int, default=artifacts.DEFAULT_WINDOW,
+                        help="The number of seasons per feature vector. Without --train, the models for it are loaded from its models directory. Default: %(default)s")
+    parser.add_argument("--compare-windows", type=int, nargs="+", default=None, metavar="WINDOW",
+                        help="Instead of training, cross validate --compare-model on each of these window lengths and exit.")
+    parser.add_argument("--compare-model", choices=sorted(SKLEARN_MODEL_MAKERS.keys()), default="forest",
+                        help="The model that --compare-windows cross validates. Default: %(default)s")
+    args = parser.parse_args()
+
+    MAX_EPOCHS = args.epochs
+    MLP_BATCH_SIZE = args.batch_size
+    RNN_BATCH_SIZE = args.rnn_batch_size
+    EARLY_STOPPING_PATIENCE = args.patience
+    MAX_FIT_SECONDS = args.max_time
+    if args.threads:
+        configure_threads(args.threads)
+
+    if args.compare_windows:
+        print("Comparing window lengths", args.compare_windows, "with the", args.compare_model, "model...")
+        compare_window_sizes(SKLEARN_MODEL_MAKERS[args.compare_model](), windows=args.compare_windows)
+        exit(0)
+
+    window = args.window
+    Xs, Ys = _get_xy(window=window)
     ones = [y for y in Ys if y == 1]
     zeros = [y for y in Ys if y == 0]
     assert(len(ones) + len(zeros) == len(Ys))
@@ -514,19 +673,23 @@ if __name__ == "__main__":
 
     pca_display(Xs, Ys, dimensions=2)
 
-    #train_rnn(path_to_save_model="rnn.hdf5", subplot=236, title="RNN")
-    #mlp = train_mlp(path_to_save_model="mlp.hdf5", subplot=231, title="MLP")
-    #knn = train_knn(path_to_save_model="knn.model", subplot=232, title="KNN")
-    #tree =train_tree(path_to_save_model="tree.model", subplot=233, title="Tree")
-    #forest = train_random_forest(path_to_save_model="forest.model", subplot=234, title="Forest")
-    #svm = train_svm(path_to_save_model="svm.model", subplot=235, title="SVM")
-    #train_logregr(path_to_save_model="logregr.model", subplot=236, title="Log Reg")
-
-    mlp = train_mlp(load_model=True, path_to_load="models/mlp.hdf5", subplot=231, title="MLP")
-    knn = train_knn(load_model=True, path_to_load="models/knn.model", subplot=232, title="KNN")
-    tree = train_tree(load_model=True, path_to_load="models/tree.model", subplot=233, title="Tree")
-    forest = train_random_forest(load_model=True, path_to_load="models/forest.model", subplot=234, title="Forest")
-    svm = train_svm(load_model=True, path_to_load="models/svm.model", subplot=235, title="SVM")
+    if args.train:
+        if args.rnn:
+            # The RNN reads whole relationships rather than windows of them, so the window doesn't apply to it
+            train_rnn(path_to_save_model="rnn.hdf5", subplot=236, title="RNN")
+        mlp = train_mlp(path_to_save_model="mlp.hdf5", subplot=231, title="MLP", window=window)
+        knn = train_knn(path_to_save_model="knn.model", subplot=232, title="KNN", window=window)
+        tree =train_tree(path_to_save_model="tree.model", subplot=233, title="Tree", window=window)
+        forest = train_random_forest(path_to_save_model="forest.model", subplot=234, title="Forest", window=window)
+        svm = train_svm(path_to_save_model="svm.model", subplot=235, title="SVM", window=window)
+        #train_logregr(path_to_save_model="logregr.model", subplot=236, title="Log Reg", window=window)
+    else:
+        model_dir = artifacts.get_model_dir(window)
+        mlp = train_mlp(load_model=True, path_to_load=os.path.join(model_dir, "mlp.hdf5"), subplot=231, title="MLP", window=window)
+        knn = train_knn(load_model=True, path_to_load=os.path.join(model_dir, "knn.model"), subplot=232, title="KNN", window=window)
+        tree = train_tree(load_model=True, path_to_load=os.path.join(model_dir, "tree.model"), subplot=233, title="Tree", window=window)
+        forest = train_random_forest(load_model=True, path_to_load=os.path.join(model_dir, "forest.model"), subplot=234, title="Forest", window=window)
+        svm = train_svm(load_model=True, path_to_load=os.path.join(model_dir, "svm.model"), subplot=235, title="SVM", window=window)
     #rnn = train_rnn(load_model=True, path_to_load="models/rnn.hdf5", subplot=236, title="RNN")
 
     #logregr = train_logregr(load_model=True, path_to_load="models/logregr.model", subplot=236, title="Log Reg", replicate=True)
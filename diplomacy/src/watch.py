@@ -0,0 +1,124 @@
+"""
+This is a front end module that watches a directory of season files (e.g., the
+gameparser_output/ directory that scripts/gameparser.py writes to) and scores new or
+changed files as they show up, for as long as it runs.
+
+The directory is polled every `interval` seconds. A file is only scored once it has stopped
+changing for `debounce` seconds, so a burst of writes (e.g., the parser rewriting a whole
+season) is scored once. Each file only touches its own pair's session (see session.py),
+so only that season's new messages get analyzed. The models and the NLP clients are loaded
+once, when the watcher starts.
+
+Every prediction is appended as a line of JSON to the output log.
+
+Example:
+
+python3 watch.py gameparser_output --game mygame --log predictions.jsonl
+
+"""
+import argparse
+import inference
+import json
+import os
+import session
+import time
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_DEBOUNCE = 2.0
+
+def scan(directory):
+    """
+    Returns a dict of path -> (modification time, size) for every season file in the given directory.
+    """
+    states = {}
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith((".yml", ".yaml")):
+            st = entry.stat()
+            states[entry.path] = (st.st_mtime, st.st_size)
+    return states
+
+class Watcher:
+    """
+    Keeps track of which files in a directory have changed and which of those have settled down.
+    """
+    def __init__(self, directory, debounce=DEFAULT_DEBOUNCE, skip_existing=False):
+        self.directory = directory
+        self.debounce = debounce
+        self.seen = scan(directory) if skip_existing else {}
+        self.pending = {}   # path -> (state, when that state was first seen)
+
+    def poll(self, now=None):
+        """
+        Looks at the directory once. Returns the paths of the files that have changed and then stayed the same
+        for at least `debounce` seconds, in the order they were last changed.
+        """
+        now = time.time() if now is None else now
+        for path, state in scan(self.directory).items():
+            if self.seen.get(path) == state:
+                continue
+            if path not in self.pending or self.pending[path][0] != state:
+                self.pending[path] = (state, now)
+
+        ready = [path for path, (_state, since) in self.pending.items() if now - since >= self.debounce]
+        ready.sort(key=lambda path: self.pending[path][0][0])
+        for path in ready:
+            self.seen[path] = self.pending.pop(path)[0]
+        return ready
+
+def score(path, game, window, session_dir, log_path):
+    """
+    Ingests the given season file into its pair's session and appends the resulting prediction to the log.
+    Returns the record that was logged.
+    """
+    start = time.time()
+    pair, nanalyzed, predictions = session.ingest_file(path, game, window, session_dir)
+    record = {
+                "time":         time.strftime("%Y-%m-%d %H:%M:%S"),
+                "file":         os.path.basename(path),
+                "pair":         "-".join(pair),
+                "analyzed":     nanalyzed,
+                "predictions":  dict(predictions) if predictions is not None else None,
+                "seconds":      time.time() - start,
+             }
+    with open(log_path, 'a') as f:
+        f.write(json.dumps(record) + os.linesep)
+    return record
+
+def watch(directory, game, log_path, window=inference.DEFAULT_WINDOW, session_dir=session.SESSION_DIR,
+          interval=DEFAULT_INTERVAL, debounce=DEFAULT_DEBOUNCE, skip_existing=False):
+    """
+    Watches the given directory and scores every new or changed season file, until interrupted.
+    """
+    print("Loading the models...")
+    inference.preload([window])
+    watcher = Watcher(directory, debounce, skip_existing)
+    print("Watching", directory, "(Ctrl-C to stop)...")
+    while True:
+        for path in watcher.poll():
+            try:
+                record = score(path, game, window, session_dir, log_path)
+            except Exception as e:
+                # E.g., a file that isn't valid YAML (yet). It gets another go when it changes again.
+                print("  |-> Could not score", path, ":", e)
+                continue
+            print("  |->", record["file"], record["pair"], "| analyzed:", record["analyzed"], "|", record["predictions"])
+        time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scores new or changed season files in a directory as they arrive.")
+    parser.add_argument("directory", help="The directory to watch, e.g., gameparser_output.")
+    parser.add_argument("-g", "--game", default=None, help="The name of the game being watched. Default: the directory's name")
+    parser.add_argument("-l", "--log", default="predictions.jsonl", help="Where to append the predictions. Default: %(default)s")
+    parser.add_argument("-w", "--window", type=int, default=inference.DEFAULT_WINDOW, help="The number of seasons the models look at. Default: %(default)s")
+    parser.add_argument("-s", "--session-dir", default=session.SESSION_DIR, help="Where the sessions are kept. Default: %(default)s")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between looks at the directory. Default: %(default)s")
+    parser.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                        help="Seconds a file must stay the same before it is scored. Default: %(default)s")
+    parser.add_argument("--skip-existing", action="store_true", help="Don't score the files that are already there when the watcher starts.")
+    args = parser.parse_args()
+
+    game = args.game if args.game else os.path.basename(os.path.normpath(args.directory))
+    try:
+        watch(args.directory, game, args.log, args.window, args.session_dir, args.interval, args.debounce, args.skip_existing)
+    except KeyboardInterrupt:
+        print("Stopped watching.")